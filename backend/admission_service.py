@@ -0,0 +1,183 @@
+import os
+import math
+import asyncio
+import logging
+from collections import deque
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 0. 입장 제한 설정 (인스턴스 크기에 맞춰 조절)
+# ==========================================
+# 동시에 돌아가는 파이프라인 최대 수
+GENERATE_MAX_CONCURRENT = int(os.getenv("GENERATE_MAX_CONCURRENT", "8"))
+# 자리를 기다릴 수 있는 주문 수 (넘치면 429). 0이면 기다리지 않고 바로 429
+GENERATE_MAX_QUEUE = int(os.getenv("GENERATE_MAX_QUEUE", "16"))
+# 예상 대기 시간이 이보다 길면 줄 세우지 않고 바로 429 (0이면 대기열 길이만 봄)
+GENERATE_MAX_QUEUE_WAIT_SECONDS = float(os.getenv("GENERATE_MAX_QUEUE_WAIT_SECONDS", "120"))
+# 실행 중인 파이프라인들이 메모리에 들고 있을 수 있는 미디어(그림/음성 bytes) 총량
+GENERATE_MEDIA_BUDGET_BYTES = int(os.getenv("GENERATE_MEDIA_BUDGET_BYTES", str(512 * 1024 * 1024)))
+# 파이프라인 1건이 들고 있는 미디어 크기의 첫 추정치. 실행이 끝날 때마다 실제 크기로 보정됨
+GENERATE_MEDIA_ESTIMATE_BYTES = int(os.getenv("GENERATE_MEDIA_ESTIMATE_BYTES", str(24 * 1024 * 1024)))
+# 아직 완료된 실행이 없을 때 Retry-After 계산에 쓸 파이프라인 1건 소요 시간
+GENERATE_DEFAULT_DURATION_SECONDS = float(os.getenv("GENERATE_DEFAULT_DURATION_SECONDS", "60"))
+
+ADMISSION_REJECTED = telemetry.Counter("admission_rejected_total", "Generate requests rejected with 429", ("reason",))
+
+
+class Overloaded(Exception):
+    """자리도 대기열도 없을 때. retry_after초 뒤에 다시 시도하라는 뜻입니다."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# ==========================================
+# 1. 입장권 (자리 1개 + 미디어 메모리 예약분)
+# ==========================================
+class Admission:
+    """async with로 쓰면 자리가 날 때까지 기다렸다가, 블록이 끝나면 자리와 메모리 예약분을 돌려줍니다."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.future = asyncio.get_running_loop().create_future()
+        self.reserved_bytes = 0
+
+    @property
+    def waiting(self) -> bool:
+        return not self.future.done()
+
+    async def __aenter__(self):
+        try:
+            await self.future
+        except asyncio.CancelledError:
+            # 자리를 받은 직후 취소됐다면 돌려주고, 기다리던 중이면 대기열에서 빠짐
+            if self.future.done() and not self.future.cancelled():
+                self.controller._release(self)
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        self.controller._release(self)
+
+
+# ==========================================
+# 2. 프로세스 전체 입장 관리자
+# ==========================================
+class AdmissionController:
+    """
+    동시 파이프라인 수와 미디어 메모리 예산을 함께 지키는 입장 관리자입니다.
+    자리가 없으면 순서대로 줄을 세우고, 대기열이 꽉 찼거나 너무 오래 기다려야 하면
+    지금까지 관찰한 파이프라인 소요 시간으로 계산한 Retry-After와 함께 거절합니다.
+    """
+
+    def __init__(self, max_pipelines: int, max_queue: int, media_budget_bytes: int,
+                 media_estimate_bytes: int, max_queue_wait: float = 0):
+        self.max_pipelines = max_pipelines
+        self.max_queue = max_queue
+        self.media_budget_bytes = media_budget_bytes
+        self.media_estimate_bytes = media_estimate_bytes
+        self.max_queue_wait = max_queue_wait
+        self.in_flight = 0
+        self.reserved_bytes = 0
+        self.waiters = deque()  # 자리를 기다리는 Admission (먼저 온 순서)
+        self.admitted = 0
+        self.rejected = 0
+
+    def _fits(self) -> bool:
+        if self.in_flight >= self.max_pipelines:
+            return False
+        # 예산보다 큰 주문 하나라도 혼자서는 돌 수 있게 (아무것도 안 돌고 있으면 통과)
+        return self.in_flight == 0 or self.reserved_bytes + self.media_estimate_bytes <= self.media_budget_bytes
+
+    def _grant(self, admission: Admission):
+        admission.reserved_bytes = self.media_estimate_bytes
+        self.reserved_bytes += admission.reserved_bytes
+        self.in_flight += 1
+        self.admitted += 1
+        admission.future.set_result(None)
+
+    def _pump(self):
+        while self.waiters and self._fits():
+            admission = self.waiters.popleft()
+            if not admission.future.done():  # 기다리다 취소된 주문은 건너뜀
+                self._grant(admission)
+
+    def _release(self, admission: Admission):
+        self.in_flight -= 1
+        self.reserved_bytes -= admission.reserved_bytes
+        admission.reserved_bytes = 0
+        self._pump()
+
+    def effective_slots(self) -> int:
+        """동시 실행 한도와 메모리 예산 중 더 빡빡한 쪽으로 본 실제 동시 실행 가능 수"""
+        by_memory = self.media_budget_bytes // max(1, self.media_estimate_bytes)
+        return max(1, min(self.max_pipelines, by_memory))
+
+    def estimated_wait(self, position: int) -> float:
+        """대기열 position번째(0부터)가 자리를 받기까지 예상 시간(초). 관찰한 평균 소요 시간 기준"""
+        duration = telemetry.PIPELINE_DURATION.mean(kind="pipeline", outcome="succeeded") or GENERATE_DEFAULT_DURATION_SECONDS
+        return duration * (position + 1) / self.effective_slots()
+
+    def admit(self, wait_when_busy: bool = False) -> Admission:
+        """
+        입장권을 발급합니다. 자리가 있으면 바로, 없으면 대기열에 줄을 세웁니다.
+        wait_when_busy=False이고 대기열이 꽉 찼거나 예상 대기 시간이 한도를 넘으면 Overloaded를 던집니다.
+        (백그라운드 작업처럼 이미 자기 대기열이 있는 호출은 wait_when_busy=True로 항상 기다림)
+        """
+        admission = Admission(self)
+        if not self.waiters and self._fits():
+            self._grant(admission)
+            return admission
+
+        position = sum(1 for waiter in self.waiters if not waiter.future.done())
+        if not wait_when_busy:
+            reason = ""
+            if position >= self.max_queue:
+                reason = "queue_full"
+            elif self.max_queue_wait and self.estimated_wait(position) > self.max_queue_wait:
+                reason = "wait_too_long"
+            if reason:
+                logger.warning(f"🚦 [입장 제한] 주문 거절 ({reason}): 실행 {self.in_flight}, 대기 {position}")
+                self.rejected += 1
+                ADMISSION_REJECTED.inc(reason=reason)
+                raise Overloaded(reason, math.ceil(self.estimated_wait(position)))
+        self.waiters.append(admission)
+        return admission
+
+    def observe_media_bytes(self, media_bytes: int):
+        """파이프라인 1건이 실제로 들고 있던 미디어 크기로 추정치를 보정합니다 (지수 이동 평균)."""
+        if media_bytes > 0:
+            self.media_estimate_bytes = round(self.media_estimate_bytes * 0.8 + media_bytes * 0.2)
+            self._pump()
+
+    def stats(self) -> dict:
+        queued = sum(1 for waiter in self.waiters if not waiter.future.done())
+        return {
+            "max_pipelines": self.max_pipelines,
+            "max_queue": self.max_queue,
+            "max_queue_wait_seconds": self.max_queue_wait,
+            "media_budget_bytes": self.media_budget_bytes,
+            "media_estimate_bytes": self.media_estimate_bytes,
+            "effective_slots": self.effective_slots(),
+            "in_flight": self.in_flight,
+            "queued": queued,
+            "reserved_bytes": self.reserved_bytes,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "estimated_wait_seconds": round(self.estimated_wait(queued), 1),
+        }
+
+
+# /generate, /generate/stream, 백그라운드 작업이 함께 쓰는 입장 관리자
+controller = AdmissionController(
+    max_pipelines=GENERATE_MAX_CONCURRENT,
+    max_queue=GENERATE_MAX_QUEUE,
+    media_budget_bytes=GENERATE_MEDIA_BUDGET_BYTES,
+    media_estimate_bytes=GENERATE_MEDIA_ESTIMATE_BYTES,
+    max_queue_wait=GENERATE_MAX_QUEUE_WAIT_SECONDS,
+)
@@ -1,12 +1,18 @@
 import os
 import asyncio
+import json
 import base64
-import tempfile
-import uuid
+import hashlib
 import logging
-from openai import OpenAI, AsyncOpenAI
+import jiter
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
-from schemas import StoryDraft
+from schemas import StoryDraft, SceneSchema
+from model_scheduler import ModelScheduler
+import audio_service
+import db_service
+import draft_templates
+import telemetry
 
 logger = logging.getLogger(__name__)
 
@@ -15,52 +21,188 @@ logger = logging.getLogger(__name__)
 # ==========================================
 load_dotenv() # .env 파일에서 API 키 불러오기
 
-# GPT 텍스트 생성 및 DALL-E 이미지 편집용 (동기식 클라이언트)
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-# TTS 음성 생성용 (비동기식 클라이언트)
-aclient = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# GPT 텍스트 / 이미지 / TTS 모두 비동기식 클라이언트 하나로 처리 (이벤트 루프를 막지 않음)
+# 재시도는 아래 스케줄러가 Retry-After를 보면서 직접 하므로 SDK 자체 재시도는 끕니다.
+aclient = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
 
 TEXT_MODEL = os.getenv("OPENAI_TEXT_MODEL", "gpt-4o-mini")
 IMAGE_MODEL = os.getenv("OPENAI_IMAGE_MODEL", "gpt-image-1.5")  # DALL-E 3에서 최신 모델로 변경 권장
+DRAFT_MODEL = "gpt-4o-2024-08-06"
+TTS_MODEL = "gpt-4o-mini-tts"
+TTS_VOICE = "alloy"
+TTS_FORMAT = audio_service.TTS_FORMAT
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "true").lower() == "true"
+# 대본을 스트리밍으로 받아, 캐릭터 설정/씬 대사가 확정되는 순간 Anchor와 TTS를 먼저 출발시킴
+DRAFT_STREAMING = os.getenv("DRAFT_STREAMING", "true").lower() == "true"
+# 대본 작성 규칙 8번의 주인공 표현. 대본 템플릿을 다른 아이에게 재사용하려면 그림 프롬프트에 성별도 드러나지 않아야 함
+# (서버 설정으로 정해지는 고정 문구라 system 메시지의 프롬프트 캐시는 그대로 맞음)
+PROTAGONIST_RULE = (
+    "'the child', 'the little one'처럼 성별이 드러나지 않는 표현으로 주인공을 가리키세요. (boy/girl, he/she/his/her 같은 낱말은 쓰지 말 것)"
+    if draft_templates.DRAFT_TEMPLATE_CACHE_ENABLED
+    else "'the child', 'a little girl'처럼 일반적인 표현으로 주인공을 가리키세요."
+)
+
+# 씬 그림 일관성 방식 (요청의 consistency_mode가 없을 때 기본값)
+# - chain: 모든 씬을 앞 씬 그림에 이어 그림 (연속성 최고, 그림이 전부 순차)
+# - anchor: 모든 씬을 캐릭터 시트만 보고 동시에 그림 (그림 시간 ≈ 1장)
+# - hybrid: 대본이 '앞 장면에서 이어짐'으로 표시한 씬만 이어 그리고 나머지는 동시에
+CONSISTENCY_MODES = ("chain", "anchor", "hybrid")
+CONSISTENCY_MODE = os.getenv("IMAGE_CONSISTENCY_MODE", "chain").lower()
+if CONSISTENCY_MODE not in CONSISTENCY_MODES:
+    logger.warning(f"⚠️ 알 수 없는 IMAGE_CONSISTENCY_MODE '{CONSISTENCY_MODE}' → chain으로 동작합니다.")
+    CONSISTENCY_MODE = "chain"
+
+def _parse_model_settings(env_name: str) -> dict:
+    """"모델=값,모델=값" 형식의 환경변수를 {모델: 값} 딕셔너리로 바꿉니다."""
+    return {
+        name.strip(): value.strip()
+        for name, value in (
+            pair.split("=", 1) for pair in os.getenv(env_name, "").split(",") if "=" in pair
+        )
+    }
+
+# 모델별 동시 호출 수 제한. 예: OPENAI_MODEL_CONCURRENCY="gpt-image-1.5=4,gpt-4o-mini-tts=16"
+DEFAULT_MODEL_CONCURRENCY = int(os.getenv("OPENAI_DEFAULT_CONCURRENCY", "8"))
+MODEL_CONCURRENCY = {name: int(limit) for name, limit in _parse_model_settings("OPENAI_MODEL_CONCURRENCY").items()}
+
+# 모델별 분당 요청 수 / 분당 토큰 수 (0이면 제한 없음). 예: OPENAI_MODEL_RATE_LIMITS="gpt-image-1.5=50/0,gpt-4o-2024-08-06=500/200000"
+MODEL_RATE_LIMITS = {
+    name: tuple(int(x) for x in limits.split("/", 1)) if "/" in limits else (int(limits), 0)
+    for name, limits in _parse_model_settings("OPENAI_MODEL_RATE_LIMITS").items()
+}
+
+# 프로세스 전체가 공유하는 호출 스케줄러 (토큰 버킷 + 우선순위 차선 + 백오프 재시도)
+scheduler = ModelScheduler(
+    default_concurrency=DEFAULT_MODEL_CONCURRENCY,
+    concurrency=MODEL_CONCURRENCY,
+    rate_limits=MODEL_RATE_LIMITS,
+    max_attempts=int(os.getenv("OPENAI_MAX_ATTEMPTS", "4")),
+)
+
+# 이미지 1장(1024x1024, high)을 만들 때 소모되는 출력 토큰 대략치
+IMAGE_OUTPUT_TOKENS = 4200
+DRAFT_OUTPUT_TOKENS = 3000
+
+def _estimate_tokens(text: str) -> int:
+    """분당 토큰 양동이에 쓸 대략적인 토큰 수 (정확할 필요는 없음)"""
+    return len(text) // 2 + 1
 
 
 # ==========================================
 # 1. [총괄 셰프] GPT-4o 스토리 & 퀴즈 대본 생성 (Structured Outputs)
 # ==========================================
-def generate_story_draft(child_name: str, age: int, personality: str, emotion: str, source_text: str) -> StoryDraft:
+def _field_done(partial: dict, model, field: str) -> bool:
+    """Structured Outputs는 스키마 순서대로 키를 쓰므로, field 다음 키가 나타났다면 field 값은 다 쓰인 것입니다."""
+    names = list(model.model_fields)
+    return any(name in partial for name in names[names.index(field) + 1:])
+
+def _dispatch_partial_draft(partial: dict, started: set, on_characters=None, on_scene_text=None):
+    """스트리밍 중인 대본(부분 JSON)에서 확정된 필드를 찾아 콜백을 한 번씩 호출합니다."""
+    if on_characters and "characters" not in started and _field_done(partial, StoryDraft, "anchor_prompt"):
+        started.add("characters")
+        on_characters(partial["anchor_prompt"], partial["style_guide"], partial["character_bible"])
+    if on_scene_text:
+        for scene in partial.get("scenes") or []:
+            scene_no = scene.get("scene_no") if isinstance(scene, dict) else None
+            if scene_no is None or scene_no in started or not _field_done(scene, SceneSchema, "text"):
+                continue
+            started.add(scene_no)
+            on_scene_text(scene_no, scene["text"])
+
+async def _stream_draft(messages: list, on_characters=None, on_scene_text=None, extra_body=None):
+    """대본을 스트리밍으로 받으면서 부분 JSON을 해석하고, 다 받으면 최종 completion을 돌려줍니다."""
+    started = set()  # 이미 출발시킨 것 ("characters" / 씬 번호)
+    try:
+        async with aclient.beta.chat.completions.stream(
+            model=DRAFT_MODEL, messages=messages, response_format=StoryDraft, extra_body=extra_body,
+        ) as stream:
+            async for event in stream:
+                if event.type != "content.delta":
+                    continue
+                # 마지막 문자열까지 키가 보이도록 trailing-strings 모드로 지금까지 받은 JSON을 다시 해석
+                partial = jiter.from_json(event.snapshot.encode("utf-8"), partial_mode="trailing-strings")
+                if isinstance(partial, dict):
+                    _dispatch_partial_draft(partial, started, on_characters, on_scene_text)
+            return await stream.get_final_completion()
+    except Exception as e:
+        # 이미 미디어를 출발시킨 뒤라면 다시 받은 대본과 어긋나므로 스케줄러가 재시도하지 않게 합니다.
+        if started:
+            raise RuntimeError(f"대본 스트리밍이 중간에 끊겼습니다: {e}") from e
+        raise
+
+async def generate_story_draft(child_name: str, age: int, personality: str, emotion: str, source_text: str,
+                               on_characters=None, on_scene_text=None, stage_code: str = "") -> StoryDraft:
+    """
+    system 메시지는 진도(교재)마다 글자 하나 다르지 않은 고정 앞부분이고, 아이 정보는 그 뒤 user 메시지에 넣습니다.
+    (OpenAI 프롬프트 캐시는 앞부분이 같아야 맞으므로, 같은 진도 주문끼리 교재+규칙 토큰을 캐시로 처리)
+    on_characters(anchor_prompt, style_guide, character_bible): 캐릭터 설정 세 필드가 확정되는 순간 호출
+    on_scene_text(scene_no, text): 씬 대사가 확정되는 순간 호출
+    콜백을 주고 DRAFT_STREAMING이 켜져 있으면 대본을 스트리밍으로 받아 나머지 대본이 쓰이는 동안 미디어를 먼저 시작합니다.
+    """
     logger.info("\n⏳ [GPT-4o] 동화 대본 및 캐릭터 설정 생성 중...")
     
     system_prompt = f"""
-    당신은 {age}살 아이들의 마음을 읽어주는 최고의 맞춤형 동화 작가이자 교육 전문가입니다.
-    아이의 이름은 '{child_name}'이고, 성향은 '{personality}'이며, 현재 기분은 '{emotion}' 상태입니다.
+    당신은 아이들의 마음을 읽어주는 최고의 맞춤형 동화 작가이자 교육 전문가입니다.
     
-    이 아이를 달래주기 위해, 아래의 [학습 개념]을 자연스럽게 녹여낸 5장짜리 동화책 대본을 작성하세요.
+    [아이 정보]의 아이를 달래주기 위해, 아래의 [학습 개념]을 자연스럽게 녹여낸 5장짜리 동화책 대본을 작성하세요.
     
     [학습 개념]
     {source_text}
     
     [작성 규칙]
-    1. 주인공의 이름은 반드시 '{child_name}'으로 하세요.
+    1. 주인공의 이름은 반드시 [아이 정보]의 이름으로 하고, 아이의 나이에 맞는 어휘와 문장 길이로 쓰세요.
     2. 총 5개의 씬(scene)으로 구성하세요. 
     3. 3번 씬과 5번 씬에는 반드시 [학습 개념]과 관련된 퀴즈(quiz)를 넣으세요. 나머지 씬의 quiz는 null로 비워두세요.
     4. 각 씬마다 DALL-E 3가 그림을 그릴 수 있도록, 'image_prompt'를 상세한 영어로 작성하세요. (수채화 풍의 따뜻한 동화책 스타일을 묘사할 것)
     5. 모든 동화 내용, 대사, 퀴즈는 반드시 '한국어'로 작성하세요. (단, DALL-E를 위한 image_prompt와 style_guide 등은 반드시 영어로 작성할 것)
     6. 일관된 그림 생성을 위해 'style_guide', 'character_bible', 'anchor_prompt'를 구체적인 영어로 작성하세요.
+    7. 바로 앞 씬과 같은 장소·같은 순간이 이어지는 씬이면 'continues_previous'를 true로, 장소나 시간이 바뀌면 false로 하세요. (1번 씬은 false)
+    8. 영어로 쓰는 필드(image_prompt, style_guide, character_bible, anchor_prompt)에는 아이 이름을 쓰지 말고 {PROTAGONIST_RULE}
     """
 
+    user_prompt = f"""
+    [아이 정보]
+    - 이름: {child_name}
+    - 나이: {age}살
+    - 성향: {personality}
+    - 현재 기분: {emotion}
+    
+    규격에 맞춰서 동화책 JSON 데이터를 생성해줘.
+    """
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    streaming = bool(DRAFT_STREAMING and (on_characters or on_scene_text))
+    # 같은 진도 주문을 같은 캐시 서버로 보내 앞부분 캐시 적중률을 높임 (SDK 버전과 무관하게 extra_body로 전달)
+    extra_body = {"prompt_cache_key": f"draft-{stage_code}"} if stage_code else None
+
+    def make_call():
+        if streaming:
+            return _stream_draft(messages, on_characters, on_scene_text, extra_body=extra_body)
+        return aclient.beta.chat.completions.parse(
+            model=DRAFT_MODEL,
+            messages=messages,
+            response_format=StoryDraft, 
+            extra_body=extra_body,
+        )
+
     # GPT-4o 호출 (Structured Outputs 기능으로 JSON 틀 강제)
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": "규격에 맞춰서 동화책 JSON 데이터를 생성해줘."}
-        ],
-        response_format=StoryDraft, 
-    )
+    with telemetry.span("openai.chat", model=DRAFT_MODEL, streaming=streaming):
+        completion = await scheduler.call(
+            DRAFT_MODEL,
+            make_call,
+            tokens=_estimate_tokens(system_prompt + user_prompt) + DRAFT_OUTPUT_TOKENS,
+            label="대본",
+        )
 
     story_draft = completion.choices[0].message.parsed
-    logger.info(f"✅ [GPT-4o] 대본 생성 완료! 제목: {story_draft.title}")
+    usage = getattr(completion, "usage", None)
+    cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+    if usage is not None:
+        telemetry.annotate(prompt_tokens=usage.prompt_tokens, cached_prompt_tokens=cached_tokens)
+    logger.info(f"✅ [GPT-4o] 대본 생성 완료! 제목: {story_draft.title} (입력 토큰 {getattr(usage, 'prompt_tokens', '?')}, 캐시 {cached_tokens})")
     
     return story_draft
 
@@ -68,7 +210,7 @@ def generate_story_draft(child_name: str, age: int, personality: str, emotion: s
 # ==========================================
 # 2. [미술 감독] 캐릭터 시트(Anchor Image) 생성
 # ==========================================
-def generate_anchor_image(anchor_prompt: str, style_guide: str, character_bible: str) -> str:
+async def generate_anchor_image(anchor_prompt: str, style_guide: str, character_bible: str) -> bytes:
     logger.info("🎨 [Anchor] 캐릭터 시트(기준 이미지) 생성 중...")
     
     full_prompt = f"""
@@ -93,29 +235,31 @@ def generate_anchor_image(anchor_prompt: str, style_guide: str, character_bible:
         else:
             params["response_format"] = "b64_json"
 
-        response = client.images.generate(**params)
+        with telemetry.span("openai.image_generate", model=IMAGE_MODEL):
+            response = await scheduler.call(
+                IMAGE_MODEL,
+                lambda: aclient.images.generate(**params),
+                tokens=_estimate_tokens(full_prompt) + IMAGE_OUTPUT_TOKENS,
+                label="Anchor",
+            )
         
-        # 임시 파일로 저장 (OS 기본 임시 폴더 사용)
+        # 디스크에 쓰지 않고 메모리 상의 PNG 바이트 그대로 돌려줌
         item = response.data[0]
         b64 = item.b64_json if hasattr(item, "b64_json") and item.b64_json else item.b64
         image_data = base64.b64decode(b64)
-        file_path = os.path.join(tempfile.gettempdir(), f"anchor_{uuid.uuid4().hex}.png")
-        
-        with open(file_path, "wb") as f:
-            f.write(image_data)
             
         logger.info("✅ [Anchor] 캐릭터 시트 생성 완료!")
-        return file_path
+        return image_data
         
     except Exception as e:
         logger.error(f"❌ [Anchor] 생성 실패: {e}")
-        return ""
+        return b""
 
 
 # ==========================================
 # 3. [미술팀] 일관성 있는 씬 이미지 생성 (Sequential Editing)
 # ==========================================
-def generate_scene_image_consistent(scene_no: int, scene_prompt: str, style_guide: str, character_bible: str, anchor_path: str, prev_image_path: str = None) -> str:
+async def generate_scene_image_consistent(scene_no: int, scene_prompt: str, style_guide: str, character_bible: str, anchor_image: bytes, prev_image: bytes = None) -> bytes:
     logger.info(f"🎨 [{scene_no}번 씬] 일관성 있는 그림 그리는 중...")
     
     # 프롬프트 조합
@@ -129,119 +273,268 @@ def generate_scene_image_consistent(scene_no: int, scene_prompt: str, style_guid
     {scene_prompt}
     """
     
+    # 메모리 상의 PNG 바이트를 (파일명, 바이트, MIME) 형태의 파일 객체로 그대로 넘깁니다 (복사/디스크 저장 없음)
+    image_files = []
+    if anchor_image:
+        image_files.append(("anchor.png", anchor_image, "image/png"))
+    if prev_image:
+        image_files.append((f"scene_{scene_no - 1}.png", prev_image, "image/png"))
+    if not image_files:
+        logger.error(f"❌ [{scene_no}번 씬] 기준 이미지가 없어 그림을 그릴 수 없습니다.")
+        return b""
+
     try:
-        # 안전한 파일 핸들링을 위해 리스트 준비
-        image_files = [open(anchor_path, "rb")]
-        try:
-            if prev_image_path:
-                image_files.append(open(prev_image_path, "rb"))
-                
-            # 모델 종류에 따라 파라미터 분기 처리
-            params = {
-                "model": IMAGE_MODEL,
-                "image": image_files,
-                "prompt": consistent_prompt,
-                "n": 1,
-                "size": "1024x1024",
-                "quality": "high"
-            }
-            
-            if "gpt-image" in IMAGE_MODEL:
-                params["input_fidelity"] = "high" # 원본 캐릭터 유지율 증대
-                params["output_format"] = "png"
-            else:
-                params["response_format"] = "b64_json"
-
-            # 최신 다중 이미지 기반 edit 수행
-            response = client.images.edit(**params)
-            
-            item = response.data[0]
-            b64 = item.b64_json if hasattr(item, "b64_json") and item.b64_json else item.b64
-            image_data = base64.b64decode(b64)
-            file_path = os.path.join(tempfile.gettempdir(), f"scene_{scene_no}_{uuid.uuid4().hex}.png")
-            
-            with open(file_path, "wb") as f:
-                f.write(image_data)
-                
-            logger.info(f"✅ [{scene_no}번 씬] 그림 완성!")
-            return file_path
+        # 모델 종류에 따라 파라미터 분기 처리
+        params = {
+            "model": IMAGE_MODEL,
+            "image": image_files,
+            "prompt": consistent_prompt,
+            "n": 1,
+            "size": "1024x1024",
+            "quality": "high"
+        }
+        
+        if "gpt-image" in IMAGE_MODEL:
+            params["input_fidelity"] = "high" # 원본 캐릭터 유지율 증대
+            params["output_format"] = "png"
+        else:
+            params["response_format"] = "b64_json"
+
+        # 최신 다중 이미지 기반 edit 수행
+        with telemetry.span("openai.image_edit", model=IMAGE_MODEL, scene_no=scene_no):
+            response = await scheduler.call(
+                IMAGE_MODEL,
+                lambda: aclient.images.edit(**params),
+                tokens=_estimate_tokens(consistent_prompt) + IMAGE_OUTPUT_TOKENS,
+                label=f"{scene_no}번 씬 그림",
+            )
+        
+        item = response.data[0]
+        b64 = item.b64_json if hasattr(item, "b64_json") and item.b64_json else item.b64
+        image_data = base64.b64decode(b64)
             
-        finally:
-            # 안전하게 열어둔 파일 객체들을 모두 닫습니다 (메모리 릭 및 권한 오류 방지)
-            for f in image_files:
-                try:
-                    f.close()
-                except Exception:
-                    pass
+        logger.info(f"✅ [{scene_no}번 씬] 그림 완성!")
+        return image_data
                     
     except Exception as e:
         logger.error(f"❌ [{scene_no}번 씬] 그림 실패: {e}")
-        return ""
+        return b""
 
 
 # ==========================================
 # 4. [음향팀] TTS 음성 생성 (비동기)
 # ==========================================
-async def generate_audio(text: str, scene_no: int):
+def tts_cache_key(text: str, voice: str = TTS_VOICE, model: str = TTS_MODEL, fmt: str = TTS_FORMAT) -> str:
+    """(대사, 목소리, 모델, 포맷)이 같으면 같은 녹음이므로, 이 조합의 해시를 캐시 키로 씁니다."""
+    raw = json.dumps([text, voice, model, fmt], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+async def generate_audio(text: str, scene_no: int, use_cache: bool = True):
+    """use_cache=False면 같은 대사라도 새로 녹음하고, 내용 해시 이름으로 올려 기존 녹음을 덮어쓰지 않습니다. (씬 재생성용)"""
+    # 저비트레이트 재인코딩을 켜면 결과물이 달라지므로 캐시 키에도 최종 포맷/비트레이트를 반영
+    out_format = audio_service.output_format()
+    cache_format = f"{out_format}@{audio_service.AUDIO_BITRATE}" if audio_service.reencodes() else TTS_FORMAT
+    file_ext, content_type = audio_service.AUDIO_FORMATS[out_format]
+
+    # 같은 대사를 이미 녹음해서 창고에 올려둔 적이 있으면 TTS 호출과 업로드를 모두 건너뜁니다.
+    object_name = f"tts/{tts_cache_key(text, fmt=cache_format)}{file_ext}"
+    if TTS_CACHE_ENABLED and use_cache:
+        cached_url = await db_service.find_asset(object_name)
+        if cached_url:
+            logger.info(f"♻️ [{scene_no}번 씬] 같은 대사의 녹음을 재사용합니다!")
+            return {"scene_no": scene_no, "type": "audio", "data": None, "url": cached_url}
+
     logger.info(f"🎵 [{scene_no}번 씬] 성우 녹음 중...")
     try:
-        response = await aclient.audio.speech.create(
-            model="gpt-4o-mini-tts", # 최신 고품질 효율 모델
-            voice="alloy",  
-            input=text
-        )
+        with telemetry.span("openai.tts", model=TTS_MODEL, scene_no=scene_no):
+            response = await scheduler.call(
+                TTS_MODEL,
+                lambda: aclient.audio.speech.create(
+                    model=TTS_MODEL, # 최신 고품질 효율 모델
+                    voice=TTS_VOICE,  
+                    input=text,
+                    response_format=TTS_FORMAT,
+                ),
+                tokens=_estimate_tokens(text),
+                label=f"{scene_no}번 씬 녹음",
+            )
+        audio_bytes = response.read()
+        try:
+            audio_bytes = await audio_service.compress_speech(audio_bytes)
+        except Exception as e:
+            # 재인코딩에 실패하면 TTS 원본 포맷 그대로 올립니다.
+            logger.warning(f"⚠️ [{scene_no}번 씬] 음성 압축 실패, 원본 포맷 사용: {e}")
+            file_ext, content_type = audio_service.AUDIO_FORMATS[TTS_FORMAT]
+            object_name = f"tts/{tts_cache_key(text)}{file_ext}"
         logger.info(f"✅ [{scene_no}번 씬] 녹음 완성!")
-        return {"scene_no": scene_no, "type": "audio", "data": response.read()}
+        item = {"scene_no": scene_no, "type": "audio", "data": audio_bytes, "file_ext": file_ext, "content_type": content_type}
+        if use_cache:
+            item["object_name"] = object_name
+        return item
     except Exception as e:
         logger.error(f"❌ [{scene_no}번 씬] 녹음 실패: {e}")
         return {"scene_no": scene_no, "type": "audio", "data": None}
 
 
 # ==========================================
-# 5. [공장장] 순차적 그림 생성 & 비동기 음성 생성 혼합
+# 5. [공장장] 의존 관계 기반 미디어 스케줄러
 # ==========================================
-async def generate_all_media_sequential(story_draft: StoryDraft):
-    print("\n🚀 [시퀀셜 공장 가동] 그림은 순서대로, 음성은 동시에 만듭니다!")
-    
-    # 1. Anchor Image 생성 (동기)
-    anchor_path = generate_anchor_image(
-        story_draft.anchor_prompt, 
-        story_draft.style_guide, 
-        story_draft.character_bible
-    )
-    
-    media_results = []
-    
-    # 2. Scene Image 순차 생성 (Sequential)
-    prev_image_path = None
-    for scene in story_draft.scenes:
-        # 그림 생성 (순차)
-        img_path = generate_scene_image_consistent(
+def chains_previous(consistency_mode: str, scene, index: int) -> bool:
+    """이 씬을 바로 앞 씬 그림에 이어 그릴지 (chain: 항상, anchor: 안 함, hybrid: 대본이 이어진다고 표시한 씬만)"""
+    if index == 0 or consistency_mode == "anchor":
+        return False
+    return consistency_mode == "chain" or scene.continues_previous
+
+
+class MediaGraph:
+    """
+    실제 의존 관계대로만 기다리는 미디어 공정표입니다.
+    - 그림: anchor → 씬들. 앞 씬에 이어 그리는 씬만 앞 그림을 기다리고, 나머지는 anchor만 있으면 동시에 출발
+      (chain이면 anchor → 1번 씬 → 2번 씬 → ... 순차, anchor면 5장 모두 동시)
+    - 음성: 씬 대사만 있으면 바로 시작 (그림과 무관)
+    - on_media: 파일 하나가 완성되는 즉시 호출되는 비동기 콜백 (예: 업로드)
+    - anchor_image: 미리 만들어 둔 캐릭터 시트 (앵커 라이브러리 / 체크포인트). 주면 Anchor 생성을 건너뜀
+    - on_anchor: Anchor를 새로 그렸을 때 그 바이트로 호출되는 비동기 콜백 (예: 체크포인트 저장)
+    - completed: {(scene_no, "image" / "audio"): URL} 지난 실행에서 이미 끝난 결과. 다시 만들지 않고 URL만 넘김
+    - consistency_mode: chain / anchor / hybrid (없으면 IMAGE_CONSISTENCY_MODE)
+    대본 스트리밍 중에 start_anchor/start_audio로 먼저 출발한 결과는 run()이 시작될 때(대본 확정 후) 콜백으로 넘깁니다.
+    """
+
+    def __init__(self, on_media=None, anchor_image: bytes = None, on_anchor=None, completed: dict = None, consistency_mode: str = None):
+        self.consistency_mode = consistency_mode or CONSISTENCY_MODE
+        self.on_media = on_media
+        self.anchor_image = anchor_image
+        self.on_anchor = on_anchor
+        self.completed = completed or {}
+        self.anchor_task = None
+        self.audio_tasks = {}  # {scene_no: Task}
+        self.image_tasks = []
+        self.sink_tasks = []
+        self.results = []
+        self.running = False
+        self._held = []  # run() 전에 끝난 결과 [(종류, 값)]
+
+    def connect(self, on_media=None, on_anchor=None, completed: dict = None, anchor_image: bytes = None):
+        """대본이 확정된 뒤 콜백과 지난 실행 결과를 연결합니다. 캐릭터 시트는 아직 정해지지 않았을 때만 바꿉니다."""
+        self.on_media = on_media or self.on_media
+        self.on_anchor = on_anchor or self.on_anchor
+        self.completed = completed or self.completed
+        if anchor_image and not self.anchor_image and self.anchor_task is None:
+            self.anchor_image = anchor_image
+
+    def _sink(self, kind: str, value):
+        if not self.running:
+            self._held.append((kind, value))
+            return
+        callback = self.on_anchor if kind == "anchor" else self.on_media
+        if callback:
+            self.sink_tasks.append(asyncio.create_task(callback(value)))
+
+    def _emit(self, item: dict):
+        self.results.append(item)
+        self._sink("media", item)
+
+    async def _audio(self, text: str, scene_no: int):
+        done_url = self.completed.get((scene_no, "audio"))
+        if done_url:
+            item = {"scene_no": scene_no, "type": "audio", "data": None, "url": done_url}
+        else:
+            item = await generate_audio(text, scene_no)
+        self._emit(item)
+        return item
+
+    def start_audio(self, scene_no: int, text: str):
+        """씬 대사가 확정되는 순간 TTS를 출발시킵니다. (같은 씬은 한 번만)"""
+        if scene_no not in self.audio_tasks:
+            self.audio_tasks[scene_no] = asyncio.create_task(self._audio(text, scene_no))
+
+    def start_anchor(self, anchor_prompt: str, style_guide: str, character_bible: str):
+        """캐릭터 설정이 확정되는 순간 Anchor 그림을 출발시킵니다."""
+        if self.anchor_task is not None:
+            return
+        if self.anchor_image:
+            self.anchor_task = asyncio.get_running_loop().create_future()
+            self.anchor_task.set_result(self.anchor_image)
+        else:
+            self.anchor_task = asyncio.create_task(self._anchor(anchor_prompt, style_guide, character_bible))
+
+    async def _anchor(self, anchor_prompt: str, style_guide: str, character_bible: str) -> bytes:
+        anchor_image = await generate_anchor_image(anchor_prompt, style_guide, character_bible)
+        if anchor_image:
+            self._sink("anchor", anchor_image)
+        return anchor_image
+
+    async def _scene_image(self, story_draft: StoryDraft, scene, prev_task: asyncio.Task = None) -> tuple:
+        """씬 그림 1장. 다음 씬이 이어 그릴 수 있도록 (그림 bytes, 지난 실행의 URL)을 돌려줍니다."""
+        # 지난 실행에서 이미 그린 씬은 URL만 넘기고, 이어 그리는 다음 씬이 필요할 때만 그 그림을 내려받음
+        done_url = self.completed.get((scene.scene_no, "image"))
+        if done_url:
+            self._emit({"scene_no": scene.scene_no, "type": "image", "data": None, "url": done_url})
+            return None, done_url
+
+        prev_image = None
+        if prev_task is not None:
+            prev_image, prev_url = await prev_task
+            if prev_image is None and prev_url:
+                try:
+                    prev_image = await db_service.download_asset(prev_url)
+                except Exception as e:
+                    logger.warning(f"⚠️ [{scene.scene_no}번 씬] 이전 씬 그림을 내려받지 못해 캐릭터 시트만 사용: {e}")
+        anchor_image = self.anchor_image = await self.anchor_task
+
+        img_bytes = await generate_scene_image_consistent(
             scene_no=scene.scene_no,
             scene_prompt=scene.image_prompt,
             style_guide=story_draft.style_guide,
             character_bible=story_draft.character_bible,
-            anchor_path=anchor_path,
-            prev_image_path=prev_image_path
+            anchor_image=anchor_image,
+            prev_image=prev_image
         )
-        
-        # 파일 경로를 결과에 담음 (나중에 업로드할 때 읽음)
-        if img_path:
-            with open(img_path, "rb") as f:
-                img_bytes = f.read()
-            media_results.append({"scene_no": scene.scene_no, "type": "image", "data": img_bytes})
-            prev_image_path = img_path # 다음 씬을 위해 경로 업데이트
-        else:
-            media_results.append({"scene_no": scene.scene_no, "type": "image", "data": None})
+        # 같은 바이트 객체를 업로드와 다음 씬 편집에 그대로 공유 (추가 복사 없음)
+        self._emit({"scene_no": scene.scene_no, "type": "image", "data": img_bytes or None})
+        # 이 씬이 실패하면 다음 씬은 그 앞 그림에라도 이어 그림
+        return img_bytes or prev_image, ""
 
-    # 3. Audio 생성 (병렬 - 변화 없음)
-    audio_tasks = []
-    for scene in story_draft.scenes:
-        # 내레이션 대사 사용
-        audio_tasks.append(generate_audio(scene.text, scene.scene_no))
-        
-    audio_results = await asyncio.gather(*audio_tasks)
-    media_results.extend(audio_results)
-    
+    async def _images(self, story_draft: StoryDraft):
+        prev_task = None
+        for index, scene in enumerate(story_draft.scenes):
+            depends_on = prev_task if chains_previous(self.consistency_mode, scene, index) else None
+            prev_task = asyncio.create_task(self._scene_image(story_draft, scene, depends_on))
+            self.image_tasks.append(prev_task)
+        await asyncio.gather(*self.image_tasks)
+
+    def cancel(self):
+        """출발한 작업을 모두 취소합니다. (대본 실패 / 미디어 실패)"""
+        for task in (self.anchor_task, *self.audio_tasks.values(), *self.image_tasks, *self.sink_tasks):
+            if task is not None:
+                task.cancel()
+
+    async def run(self, story_draft: StoryDraft) -> list:
+        self.running = True
+        held, self._held = self._held, []
+        for kind, value in held:
+            self._sink(kind, value)
+        for scene in story_draft.scenes:
+            self.start_audio(scene.scene_no, scene.text)
+        # 모든 씬 그림이 이미 있으면(재개) Anchor도 필요 없음
+        if any((scene.scene_no, "image") not in self.completed for scene in story_draft.scenes):
+            self.start_anchor(story_draft.anchor_prompt, story_draft.style_guide, story_draft.character_bible)
+
+        try:
+            await self._images(story_draft)
+            await asyncio.gather(*self.audio_tasks.values())
+            # 마지막으로 완성된 파일의 후처리(업로드)까지 기다립니다.
+            await asyncio.gather(*self.sink_tasks)
+        except BaseException:
+            self.cancel()
+            raise
+        return self.results
+
+
+async def generate_all_media_sequential(story_draft: StoryDraft, on_media=None, graph: MediaGraph = None):
+    """씬 그림(일관성 방식에 따라 사슬 또는 동시)과 음성을 겹쳐서 만들고, 완성된 파일마다 on_media(업로드 등)를 즉시 호출합니다."""
+    graph = graph or MediaGraph(on_media)
+    print(f"\n🚀 [미디어 공장 가동] 그림은 '{graph.consistency_mode}' 방식으로, 음성과 업로드는 완성되는 즉시 처리합니다!")
+    media_results = await graph.run(story_draft)
     print("🎉 [공장 완료] 모든 미디어 파일 생성 끝!\n")
-    return media_results
\ No newline at end of file
+    return media_results
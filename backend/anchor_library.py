@@ -0,0 +1,108 @@
+import os
+import json
+import asyncio
+import logging
+import threading
+
+import db_service
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 0. 앵커 라이브러리 설정
+# ==========================================
+# (진도 코드, 캐릭터 유형)별로 미리 만들어 둔 캐릭터 시트 + 스타일/캐릭터 설정을 한 줄씩 기록하는 파일
+# 상대 경로는 실행한 폴더가 아니라 이 파일이 있는 backend 폴더 기준 (서버와 batch_generate.py가 같은 라이브러리를 씀)
+ANCHOR_LIBRARY_PATH = os.getenv("ANCHOR_LIBRARY_PATH", "anchor_library.jsonl")
+if ANCHOR_LIBRARY_PATH:
+    ANCHOR_LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ANCHOR_LIBRARY_PATH)
+# 라이브러리에 없는 조합을 새로 그렸을 때 그 결과를 라이브러리에 추가할지 (배치 실행기는 항상 켬)
+ANCHOR_LIBRARY_AUTOSAVE = os.getenv("ANCHOR_LIBRARY_AUTOSAVE", "false").lower() == "true"
+
+_entries = {}  # {(stage_code, archetype): {"anchor_url", "style_guide", "character_bible", "anchor_prompt"}}
+_anchor_bytes = {}  # {anchor_url: PNG bytes} - 한 번 내려받은 캐릭터 시트는 메모리에 보관
+_lock = threading.Lock()
+
+
+def library_key(stage_code: str, archetype: str) -> tuple:
+    return (stage_code.strip(), archetype.strip().lower())
+
+
+def _append_entry(entry: dict):
+    with _lock:
+        with open(ANCHOR_LIBRARY_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def _load_library():
+    if not ANCHOR_LIBRARY_PATH or not os.path.exists(ANCHOR_LIBRARY_PATH):
+        return
+    with open(ANCHOR_LIBRARY_PATH, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                _entries[library_key(entry["stage_code"], entry["archetype"])] = entry
+            except (ValueError, KeyError):
+                continue  # 쓰다 만 줄은 무시
+    logger.info(f"📚 [Anchor Library] {len(_entries)}개 조합 불러옴")
+
+
+# ==========================================
+# 1. 조회 (대화형 요청: 있으면 Anchor 생성을 건너뜀)
+# ==========================================
+def find_entry(stage_code: str, archetype: str) -> dict:
+    """(진도 코드, 캐릭터 유형)에 맞는 라이브러리 항목을 돌려줍니다. 없으면 None."""
+    if not archetype:
+        return None
+    return _entries.get(library_key(stage_code, archetype))
+
+
+async def load_anchor(entry: dict) -> bytes:
+    """라이브러리 항목의 캐릭터 시트 PNG를 돌려줍니다. 내려받기에 실패하면 b""."""
+    url = entry["anchor_url"]
+    if url not in _anchor_bytes:
+        try:
+            _anchor_bytes[url] = await db_service.download_asset(url)
+        except Exception as e:
+            logger.error(f"❌ [Anchor Library] 캐릭터 시트 내려받기 실패: {e}")
+            return b""
+    return _anchor_bytes[url]
+
+
+# ==========================================
+# 2. 추가 (배치 실행 중 새로 그린 캐릭터 시트를 저장)
+# ==========================================
+async def save_entry(stage_code: str, archetype: str, style_guide: str, character_bible: str,
+                     anchor_prompt: str, anchor_image: bytes) -> dict:
+    """
+    캐릭터 시트를 창고에 올리고 라이브러리에 기록합니다. 이미 있는 조합이면 기존 항목을 그대로 돌려줍니다.
+    파일 기록은 이벤트 루프를 막지 않도록 스레드에서 합니다.
+    """
+    key = library_key(stage_code, archetype)
+    if key in _entries:
+        return _entries[key]
+
+    anchor_url = await db_service.upload_to_supabase_async(anchor_image, ".png", "image/png")
+    if not anchor_url:
+        return None
+
+    entry = {
+        "stage_code": key[0],
+        "archetype": key[1],
+        "anchor_url": anchor_url,
+        "style_guide": style_guide,
+        "character_bible": character_bible,
+        "anchor_prompt": anchor_prompt,
+    }
+    with _lock:
+        if key in _entries:  # 동시에 같은 조합을 저장하려던 다른 작업이 먼저 기록함
+            return _entries[key]
+        _entries[key] = entry
+        _anchor_bytes[anchor_url] = anchor_image
+    if ANCHOR_LIBRARY_PATH:
+        await asyncio.to_thread(_append_entry, entry)
+    logger.info(f"📚 [Anchor Library] 새 조합 저장: {key[0]} / {key[1]}")
+    return entry
+
+
+_load_library()
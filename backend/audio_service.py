@@ -0,0 +1,126 @@
+import os
+import shutil
+import asyncio
+import logging
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 0. 오디오 포맷 설정
+# ==========================================
+# 설정하면 씬 음성을 이 비트레이트의 음성용 Opus로 다시 인코딩합니다 (TTS_FORMAT이 opus여도). 예: "24k"
+AUDIO_BITRATE = os.getenv("AUDIO_BITRATE", "")
+# 씬 음성을 한 파일로 이어 붙인 '전체 낭독 트랙' 생성 여부와 그 비트레이트 / 씬 사이 쉼
+NARRATION_TRACK_ENABLED = os.getenv("NARRATION_TRACK_ENABLED", "false").lower() == "true"
+NARRATION_BITRATE = os.getenv("NARRATION_BITRATE", AUDIO_BITRATE or "32k")
+NARRATION_GAP_SECONDS = float(os.getenv("NARRATION_GAP_SECONDS", "0.5"))
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+# 포맷 이름 → (확장자, Content-Type)
+AUDIO_FORMATS = {
+    "mp3": (".mp3", "audio/mpeg"),
+    "opus": (".opus", "audio/ogg"),
+    "aac": (".aac", "audio/aac"),
+    "flac": (".flac", "audio/flac"),
+    "wav": (".wav", "audio/wav"),
+}
+
+# 씬별 TTS 포맷 (OpenAI TTS가 지원하는 mp3 / opus / aac / flac / wav)
+# 모르는 값이면 모든 동화책의 음성 단계가 실패하므로 서버를 띄울 때 바로 멈춥니다.
+TTS_FORMAT = os.getenv("TTS_FORMAT", "mp3").strip().lower()
+if TTS_FORMAT not in AUDIO_FORMATS:
+    raise ValueError(f"알 수 없는 TTS_FORMAT '{TTS_FORMAT}' (가능한 값: {', '.join(AUDIO_FORMATS)})")
+
+# 이어 붙일 때 쓰는 중간 형식: 24kHz / 16bit / 모노 PCM (OpenAI TTS 출력과 같은 샘플레이트)
+PCM_SAMPLE_RATE = 24000
+PCM_BYTES_PER_SECOND = PCM_SAMPLE_RATE * 2
+
+_warned_no_ffmpeg = False
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which(FFMPEG_BINARY) is not None
+
+
+def reencodes() -> bool:
+    """씬 음성을 AUDIO_BITRATE로 다시 인코딩하는지. ffmpeg가 없으면 설정이 무시된다는 경고를 한 번 남깁니다."""
+    global _warned_no_ffmpeg
+    if not AUDIO_BITRATE:
+        return False
+    if ffmpeg_available():
+        return True
+    if not _warned_no_ffmpeg:
+        _warned_no_ffmpeg = True
+        logger.warning(f"⚠️ AUDIO_BITRATE={AUDIO_BITRATE}가 설정됐지만 ffmpeg가 없어 TTS 원본({TTS_FORMAT})을 그대로 올립니다.")
+    return False
+
+
+def output_format() -> str:
+    """업로드되는 씬 음성의 최종 포맷 (재인코딩을 켜면 opus)"""
+    return "opus" if reencodes() else TTS_FORMAT
+
+
+async def _ffmpeg(args: list, input_bytes: bytes) -> bytes:
+    """ffmpeg를 파이프로 실행합니다 (디스크를 거치지 않고, 이벤트 루프도 막지 않음)."""
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", *args,
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate(input_bytes)
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg 실패: {stderr.decode(errors='ignore').strip()}")
+    return stdout
+
+
+def _opus_args(bitrate: str) -> list:
+    # 음성에 맞춘 Opus 설정 (VoIP 모드가 낮은 비트레이트에서 말소리를 더 또렷하게 유지)
+    # bitexact + 고정 serial: 같은 입력이면 같은 바이트가 나와서 내용 해시 이름으로 중복 저장을 피할 수 있음
+    return [
+        "-c:a", "libopus", "-b:a", bitrate, "-application", "voip",
+        "-fflags", "+bitexact", "-flags:a", "+bitexact", "-serial_offset", "1",
+        "-f", "ogg", "pipe:1",
+    ]
+
+
+# ==========================================
+# 1. 씬 음성 압축 (선택)
+# ==========================================
+async def compress_speech(audio_bytes: bytes) -> bytes:
+    """AUDIO_BITRATE가 설정돼 있으면 음성용 저비트레이트 Opus로 다시 인코딩합니다 (TTS가 이미 opus여도). 아니면 그대로."""
+    if not reencodes():
+        return audio_bytes
+    with telemetry.span("audio.compress"):
+        return await _ffmpeg(["-i", "pipe:0", *_opus_args(AUDIO_BITRATE)], audio_bytes)
+
+
+# ==========================================
+# 2. 전체 낭독 트랙 (씬 음성 이어 붙이기)
+# ==========================================
+async def build_narration(clips: list) -> tuple:
+    """
+    clips: [(scene_no, 음성 bytes)] (씬 순서대로)
+    반환: (Opus 트랙 bytes, {scene_no: (시작 초, 끝 초)})
+    각 클립을 PCM으로 풀어 길이를 정확히 잰 뒤, 씬 사이에 짧은 쉼을 넣고 한 번에 인코딩합니다.
+    """
+    pcm_clips = await asyncio.gather(*(
+        _ffmpeg(["-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", str(PCM_SAMPLE_RATE), "pipe:1"], data)
+        for _, data in clips
+    ))
+
+    gap = b"\x00\x00" * int(PCM_SAMPLE_RATE * NARRATION_GAP_SECONDS)
+    pcm_track = bytearray()
+    offsets = {}
+    for (scene_no, _), pcm in zip(clips, pcm_clips):
+        if pcm_track:
+            pcm_track += gap
+        start = len(pcm_track) / PCM_BYTES_PER_SECOND
+        pcm_track += pcm
+        offsets[scene_no] = (round(start, 3), round(len(pcm_track) / PCM_BYTES_PER_SECOND, 3))
+
+    track = await _ffmpeg(
+        ["-f", "s16le", "-ac", "1", "-ar", str(PCM_SAMPLE_RATE), "-i", "pipe:0", *_opus_args(NARRATION_BITRATE)],
+        bytes(pcm_track),
+    )
+    return track, offsets
@@ -0,0 +1,185 @@
+"""
+동화 대량 생성 실행기 (오프라인 배치)
+
+    python batch_generate.py orders.csv --concurrency 8
+    python batch_generate.py orders.jsonl --checkpoint orders.done.jsonl
+
+- 입력: GenerateRequest 필드(child_name, age, personality, emotion, stage_code, ...)를 열로 가진 CSV 또는 한 줄에 JSON 하나인 JSONL
+- 한 건이 끝날 때마다 체크포인트 파일에 결과를 한 줄씩 기록하고, 다시 실행하면 성공한 줄은 건너뜁니다. (실패/미완료 줄만 다시 실행)
+  CHECKPOINT_DIR을 설정하면 실패한 줄도 파이프라인 체크포인트에 남은 대본/캐릭터 시트/끝난 씬은 다시 만들지 않고 이어서 진행합니다.
+- 서버와는 별도 프로세스라 호출 스케줄러도 따로 돕니다. 서버의 대화형 요청과 나눠 쓰는 것은 OpenAI 계정의 분당 한도뿐이므로,
+  서버가 바쁜 시간에는 --concurrency를 낮추거나 주문을 서버의 POST /generate?background=true(배치 차선)로 넣으세요.
+- 처음 나온 (진도, 캐릭터 유형) 조합의 캐릭터 시트는 앵커 라이브러리에 저장되어 다음 주문부터 재사용됩니다.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from pydantic import ValidationError
+
+from schemas import GenerateRequest
+from model_scheduler import BATCH, current_priority
+from pipeline_service import request_fingerprint, run_story_pipeline
+import anchor_library
+import db_service
+import image_service
+import pdf_service
+
+logger = logging.getLogger("batch_generate")
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+
+# ==========================================
+# 1. 입력 / 체크포인트 파일
+# ==========================================
+def read_orders(path: str) -> list:
+    """CSV/JSONL을 읽어 [(줄 번호, 원본 dict)]를 돌려줍니다. 빈 칸은 값이 없는 것으로 봅니다."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    return [
+        (row_no, {k.strip(): v for k, v in row.items() if k and v not in ("", None)})
+        for row_no, row in enumerate(rows, start=1)
+    ]
+
+
+def load_checkpoint(path: str) -> dict:
+    """{주문 키: 마지막 기록}. 쓰다 만 마지막 줄(충돌로 끊긴 경우)은 무시합니다."""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                records[record["key"]] = record
+            except (ValueError, KeyError):
+                continue
+    return records
+
+
+def order_key(row_no: int, row: dict) -> str:
+    # 줄 번호 + 내용 지문: 입력 파일이 바뀌면 다른 주문으로 취급
+    try:
+        return f"{row_no}:{request_fingerprint(GenerateRequest(**row))}"
+    except ValidationError:
+        return f"{row_no}:invalid"
+
+
+class CheckpointWriter:
+    """결과를 한 줄씩 덧붙이고 바로 디스크에 내려씁니다 (중간에 죽어도 끝난 건은 남음)."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+# ==========================================
+# 2. 실행 (동시 실행 수 제한)
+# ==========================================
+async def run_order(row_no: int, row: dict, key: str, semaphore: asyncio.Semaphore, checkpoint: CheckpointWriter) -> bool:
+    async with semaphore:
+        started_at = time.time()
+        record = {"key": key, "row": row_no, "status": "failed", "story_id": None, "error": None}
+        try:
+            # 같은 내용의 줄이 여러 개여도 체크포인트가 섞이지 않도록 줄 번호가 들어간 주문 키를 씀
+            result = await run_story_pipeline(GenerateRequest(**row), checkpoint_key=f"batch-{key.replace(':', '-')}")
+            record.update(status="succeeded", story_id=result["story_id"])
+        except ValidationError as e:
+            record["error"] = "잘못된 주문: " + ", ".join(f"{'.'.join(map(str, err['loc']))} ({err['msg']})" for err in e.errors())
+        except Exception as e:
+            record["error"] = str(getattr(e, "detail", e))
+        record["seconds"] = round(time.time() - started_at, 1)
+        checkpoint.write(record)
+
+        mark = "✅" if record["status"] == "succeeded" else "❌"
+        logger.info(f"{mark} [Batch] {row_no}번 주문 {record['status']} ({record['seconds']}초) {record['error'] or ''}")
+        return record["status"] == "succeeded"
+
+
+async def run_batch(input_path: str, checkpoint_path: str, concurrency: int) -> int:
+    # 이 흐름에서 만들어지는 모든 작업은 배치 차선으로 모델을 호출합니다. (이 프로세스 안에서의 순서일 뿐, 서버와는 공유하지 않음)
+    current_priority.set(BATCH)
+
+    orders = read_orders(input_path)
+    done = load_checkpoint(checkpoint_path)
+    pending = []
+    for row_no, row in orders:
+        key = order_key(row_no, row)
+        if done.get(key, {}).get("status") == "succeeded":
+            continue
+        pending.append((row_no, row, key))
+    logger.info(f"📋 [Batch] 전체 {len(orders)}건 중 {len(orders) - len(pending)}건은 이미 처리됨, {len(pending)}건 실행 (동시 {concurrency}건)")
+
+    try:
+        await asyncio.to_thread(db_service.warm_curriculum_cache)
+    except Exception as e:
+        logger.error(f"❌ [Batch] 교재 캐시 예열 실패: {e}")
+
+    # 라이브러리에 아직 없는 (진도, 캐릭터 유형) 조합은 조합마다 첫 주문을 먼저 돌려 캐릭터 시트를 채워 두고,
+    # 나머지 주문은 그 시트를 재사용합니다. (같은 시트를 여러 번 그리지 않도록)
+    leaders, followers, seen = [], [], set()
+    for order in pending:
+        row = order[1]
+        archetype = row.get("character_archetype")
+        lib_key = anchor_library.library_key(row.get("stage_code", ""), archetype) if archetype else None
+        if (anchor_library.ANCHOR_LIBRARY_AUTOSAVE and lib_key and lib_key not in seen
+                and not anchor_library.find_entry(row.get("stage_code", ""), archetype)):
+            seen.add(lib_key)
+            leaders.append(order)
+        else:
+            followers.append(order)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    checkpoint = CheckpointWriter(checkpoint_path)
+    results = []
+    try:
+        for group in (leaders, followers):
+            results += await asyncio.gather(*(
+                run_order(row_no, row, key, semaphore, checkpoint) for row_no, row, key in group
+            ))
+    finally:
+        checkpoint.close()
+        # 저장 직후 띄운 PDF 렌더링까지 마친 뒤 업로드 연결과 프로세스 풀을 닫음
+        await pdf_service.drain()
+        await db_service.close_http_client()
+        image_service.shutdown()
+        pdf_service.shutdown()
+
+    failed = results.count(False)
+    logger.info(f"🏁 [Batch] 완료: 성공 {len(results) - failed}건, 실패 {failed}건 → {checkpoint_path}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSV/JSONL 주문서로 동화를 대량 생성합니다.")
+    parser.add_argument("input", help="GenerateRequest 주문서 (.csv 또는 .jsonl)")
+    parser.add_argument("--checkpoint", help="결과/재시작 기록 파일 (기본: <입력>.checkpoint.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="동시에 돌리는 파이프라인 수")
+    parser.add_argument("--no-save-anchors", action="store_true", help="새 캐릭터 시트를 앵커 라이브러리에 저장하지 않음")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    anchor_library.ANCHOR_LIBRARY_AUTOSAVE = not args.no_save_anchors
+    checkpoint_path = args.checkpoint or f"{os.path.splitext(args.input)[0]}.checkpoint.jsonl"
+
+    failed = asyncio.run(run_batch(args.input, checkpoint_path, max(1, args.concurrency)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""
+벤치마크용 가짜 OpenAI + Supabase 서버 (한 프로세스, 한 포트)
+
+    python bench/fake_services.py --port 8101 --image-latency 8 --openai-error-rate 0.05
+
+- OpenAI: POST /v1/chat/completions (대본, stream=true면 SSE 조각), /v1/images/generations, /v1/images/edits, /v1/audio/speech
+- Supabase: GET/POST/PATCH /rest/v1/{table} (curriculums / stories; select 열 선택과 JSON 경로, eq/lt/gt 필터,
+  or=(...), order, limit), POST /storage/v1/object/{bucket}/{path}, HEAD/GET /storage/v1/object/public/{bucket}/{path}
+- 응답 지연(평균 ± jitter), 오류 비율(OpenAI 429 / Storage 503), 그림 크기와 음성 크기를 옵션으로 조절합니다.
+- GET /__stats 로 경로별 호출 수와 주입한 오류 수를 확인할 수 있습니다.
+"""
+import io
+import os
+import re
+import json
+import time
+import uuid
+import random
+import base64
+import asyncio
+import argparse
+from collections import Counter
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from PIL import Image
+
+app = FastAPI()
+config = argparse.Namespace()
+stats = Counter()
+_objects = {}  # {storage 경로: bytes}
+_stories = {}  # {story id: row}
+_png_b64 = ""
+_audio_bytes = b""
+_draft_seq = 0
+
+
+# ==========================================
+# 0. 지연 / 오류 주입
+# ==========================================
+async def _delay(latency: float):
+    if latency > 0:
+        await asyncio.sleep(latency * random.uniform(1 - config.jitter, 1 + config.jitter))
+
+
+def _inject_error(rate: float, kind: str) -> Response:
+    if rate <= 0 or random.random() >= rate:
+        return None
+    stats[f"injected_error:{kind}"] += 1
+    if kind == "openai":
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached (fake)", "type": "requests", "code": "rate_limit_exceeded"}},
+            status_code=429, headers={"retry-after": str(config.retry_after)},
+        )
+    return JSONResponse({"statusCode": "503", "error": "Service Unavailable"}, status_code=503)
+
+
+def _make_payloads():
+    """노이즈 PNG(압축이 거의 안 돼서 실제 삽화와 크기가 비슷함)와 음성 바이트를 한 번만 만들어 둡니다."""
+    global _png_b64, _audio_bytes
+    side = config.image_px
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    _png_b64 = base64.b64encode(buffer.getvalue()).decode()
+    _audio_bytes = os.urandom(config.audio_bytes)
+
+
+# ==========================================
+# 1. 가짜 OpenAI
+# ==========================================
+def _draft_json() -> str:
+    # 매 요청 대사를 다르게 만들어 TTS 캐시가 벤치마크 결과를 가리지 않게 합니다 (--repeat-text로 끔)
+    global _draft_seq
+    _draft_seq += 1
+    tag = "" if config.repeat_text else f" #{_draft_seq}"
+    scenes = [
+        {
+            "scene_no": no,
+            "text": f"벤치마크 동화 {no}번 장면입니다.{tag}",
+            "image_prompt": f"Benchmark scene {no}, watercolor",
+            "image_url": "",
+            "audio_url": "",
+            "quiz": {"type": "choice", "question": "질문?", "answer": "1", "correct_msg": "정답!", "wrong_msg": "다시!"}
+            if no in (3, 5) else None,
+        }
+        for no in range(1, config.scenes + 1)
+    ]
+    return json.dumps({
+        "title": f"벤치마크 동화{tag}",
+        "summary": "부하 테스트용 이야기",
+        "style_guide": "Watercolor style, soft pastel colors",
+        "character_bible": "Little child with a yellow raincoat",
+        "anchor_prompt": "Character sheet of the child",
+        "scenes": scenes,
+    }, ensure_ascii=False)
+
+
+async def _stream_chat(model: str):
+    # 대본 JSON을 조각내어 chat_latency에 걸쳐 나눠 보냄 (실제 스트리밍처럼 앞 필드가 먼저 도착)
+    content = _draft_json()
+    chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    size = max(1, len(content) // config.chat_chunks)
+    pieces = [content[i:i + size] for i in range(0, len(content), size)]
+    for index, piece in enumerate(pieces + [None]):
+        if piece is not None:
+            await _delay(config.chat_latency / len(pieces))
+        chunk = {
+            "id": chunk_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "delta": {"role": "assistant", "content": piece} if index == 0 else ({"content": piece} if piece else {}),
+                "finish_reason": None if piece is not None else "stop",
+            }],
+        }
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    stats["openai.chat"] += 1
+    body = await request.json()
+    if body.get("stream"):
+        error = _inject_error(config.openai_error_rate, "openai")
+        if error:
+            return error
+        return StreamingResponse(_stream_chat(body.get("model", "fake")), media_type="text/event-stream")
+    await _delay(config.chat_latency)
+    error = _inject_error(config.openai_error_rate, "openai")
+    if error:
+        return error
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": _draft_json()}}],
+        "usage": {"prompt_tokens": 800, "completion_tokens": 1500, "total_tokens": 2300},
+    }
+
+
+async def _image_response(route: str, request: Request, latency: float):
+    stats[route] += 1
+    await request.body()  # edit 요청의 multipart 본문(기준 그림들)을 끝까지 읽음
+    await _delay(latency)
+    error = _inject_error(config.openai_error_rate, "openai")
+    if error:
+        return error
+    return {"created": int(time.time()), "data": [{"b64_json": _png_b64}]}
+
+
+@app.post("/v1/images/generations")
+async def images_generate(request: Request):
+    return await _image_response("openai.image_generate", request, config.anchor_latency)
+
+
+@app.post("/v1/images/edits")
+async def images_edit(request: Request):
+    return await _image_response("openai.image_edit", request, config.image_latency)
+
+
+@app.post("/v1/audio/speech")
+async def audio_speech(request: Request):
+    stats["openai.tts"] += 1
+    await request.body()
+    await _delay(config.tts_latency)
+    error = _inject_error(config.openai_error_rate, "openai")
+    if error:
+        return error
+    return Response(_audio_bytes, media_type="audio/mpeg")
+
+
+# ==========================================
+# 2. 가짜 Supabase (PostgREST 테이블 + Storage)
+# ==========================================
+def _curriculum_row(stage_code: str) -> dict:
+    return {
+        "stage_code": stage_code,
+        "title": f"교재 {stage_code}",
+        "chapter": 1,
+        "description": "벤치마크용 교재",
+        "source_text": "덧셈은 두 수를 합치는 것입니다. " * 20,
+    }
+
+
+# PostgREST 쿼리 흉내: 앱이 실제로 쓰는 만큼만 (eq/neq/lt/lte/gt/gte, or=(...)/and(...), order, limit, select)
+_OPERATORS = {
+    "eq": lambda a, b: a == b, "neq": lambda a, b: a != b,
+    "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b,
+}
+_RESERVED_PARAMS = {"select", "order", "limit", "offset", "or", "and"}
+
+
+def _split_top_level(text: str) -> list:
+    """괄호/따옴표 밖의 쉼표로 나눕니다. 'a.eq.1,and(b.eq.2,c.lt."x,y")' → ['a.eq.1', 'and(b.eq.2,c.lt."x,y")']"""
+    parts, depth, quoted, current = [], 0, False, ""
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append(current)
+            current = ""
+            continue
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _condition(expr: str):
+    """'col.op.value' / 'and(...)' / 'or(...)' 하나를 row → bool 함수로 바꿉니다."""
+    expr = expr.strip()
+    for group, combine in (("and(", all), ("or(", any)):
+        if expr.startswith(group) and expr.endswith(")"):
+            children = [_condition(part) for part in _split_top_level(expr[len(group):-1])]
+            return lambda row: combine(child(row) for child in children)
+    column, op, value = expr.split(".", 2)
+    return _filter(column, op, value)
+
+
+def _filter(column: str, op: str, value: str):
+    value = value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+    compare = _OPERATORS[op]
+    return lambda row: row.get(column) is not None and compare(str(row.get(column)), value)
+
+
+def _query_conditions(request: Request) -> list:
+    conditions = []
+    for key, value in request.query_params.multi_items():
+        if key in ("or", "and"):
+            conditions.append(_condition(f"{key}{value}"))
+        elif key not in _RESERVED_PARAMS and "." in value:
+            op, operand = value.split(".", 1)
+            if op in _OPERATORS:
+                conditions.append(_filter(key, op, operand))
+    return conditions
+
+
+def _json_path(row: dict, path: str):
+    """'scenes->0->>image_url'처럼 JSON 경로를 따라 값을 꺼냅니다."""
+    column, *keys = re.split(r"->>?", path)
+    value = row.get(column)
+    for key in keys:
+        if isinstance(value, list) and key.isdigit():
+            value = value[int(key)] if int(key) < len(value) else None
+        elif isinstance(value, dict):
+            value = value.get(key)
+        else:
+            return None
+    return value
+
+
+def _project(row: dict, select: str) -> dict:
+    select = select.replace(" ", "")
+    if not select or select == "*":
+        return row
+    projected = {}
+    for spec in select.split(","):
+        alias, _, path = spec.rpartition(":")
+        path_column = re.split(r"->>?", path)[-1]
+        projected[alias or path_column] = _json_path(row, path)
+    return projected
+
+
+def _order_and_limit(rows: list, request: Request) -> list:
+    # 뒤의 정렬 키부터 안정 정렬하면 앞의 키가 우선
+    for spec in reversed([s for s in request.query_params.get("order", "").split(",") if s]):
+        column, _, direction = spec.partition(".")
+        rows = sorted(rows, key=lambda row: str(row.get(column, "")), reverse=direction.startswith("desc"))
+    limit = request.query_params.get("limit")
+    return rows[:int(limit)] if limit else rows
+
+
+def _table_rows(table: str, request: Request) -> list:
+    if table == "curriculums":
+        return [_curriculum_row(f"BENCH-{i}") for i in range(1, 6)] + [
+            _curriculum_row(value[3:]) for key, value in request.query_params.items()
+            if key == "stage_code" and value.startswith("eq.") and not value[3:].startswith("BENCH-")
+        ]
+    if table == "stories":
+        return list(_stories.values())
+    return []
+
+
+def _matching_rows(table: str, request: Request) -> list:
+    conditions = _query_conditions(request)
+    return [row for row in _table_rows(table, request) if all(condition(row) for condition in conditions)]
+
+
+@app.get("/rest/v1/{table}")
+async def table_select(table: str, request: Request):
+    stats[f"db.select.{table}"] += 1
+    await _delay(config.db_latency)
+    rows = _order_and_limit(_matching_rows(table, request), request)
+    return [_project(row, request.query_params.get("select", "*")) for row in rows]
+
+
+@app.patch("/rest/v1/{table}")
+async def table_update(table: str, request: Request):
+    stats[f"db.update.{table}"] += 1
+    body = await request.json()
+    await _delay(config.db_latency)
+    rows = _matching_rows(table, request) if table == "stories" else []
+    for row in rows:
+        row.update(body)
+    return [_project(row, request.query_params.get("select", "*")) for row in rows]
+
+
+@app.post("/rest/v1/{table}")
+async def table_insert(table: str, request: Request):
+    stats[f"db.insert.{table}"] += 1
+    body = await request.json()
+    await _delay(config.db_latency)
+    rows = body if isinstance(body, list) else [body]
+    saved = []
+    for row in rows:
+        created_at = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()) + f".{time.time_ns() // 1000 % 1000000:06d}Z"
+        row = {"id": str(uuid.uuid4()), "created_at": created_at, **row}
+        if table == "stories":
+            _stories[row["id"]] = row
+        saved.append(row)
+    return JSONResponse(saved, status_code=201)
+
+
+@app.post("/storage/v1/object/{bucket}/{path:path}")
+async def storage_upload(bucket: str, path: str, request: Request):
+    stats["storage.upload"] += 1
+    body = await request.body()
+    await _delay(config.storage_latency)
+    error = _inject_error(config.storage_error_rate, "storage")
+    if error:
+        return error
+    _objects[path] = body
+    stats["storage.bytes"] += len(body)
+    return {"Key": f"{bucket}/{path}"}
+
+
+@app.api_route("/storage/v1/object/public/{bucket}/{path:path}", methods=["GET", "HEAD"])
+async def storage_public(bucket: str, path: str, request: Request):
+    stats[f"storage.{request.method.lower()}"] += 1
+    await _delay(config.storage_latency)
+    if path not in _objects:
+        return Response(status_code=404)
+    if request.method == "HEAD":
+        return Response(status_code=200)
+    return Response(_objects[path])
+
+
+@app.get("/__stats")
+async def get_stats():
+    return dict(stats)
+
+
+# ==========================================
+# 3. 실행
+# ==========================================
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="벤치마크용 가짜 OpenAI + Supabase 서버")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--chat-latency", type=float, default=2.0, help="대본 응답 지연(초)")
+    parser.add_argument("--chat-chunks", type=int, default=40, help="스트리밍 대본을 나눠 보낼 조각 수")
+    parser.add_argument("--anchor-latency", type=float, default=6.0, help="Anchor 그림 응답 지연(초)")
+    parser.add_argument("--image-latency", type=float, default=6.0, help="씬 그림(edit) 응답 지연(초)")
+    parser.add_argument("--tts-latency", type=float, default=1.5, help="TTS 응답 지연(초)")
+    parser.add_argument("--storage-latency", type=float, default=0.05, help="Storage 업로드/조회 지연(초)")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="테이블 조회/저장 지연(초)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="지연의 ± 비율 (0.2 = ±20%%)")
+    parser.add_argument("--openai-error-rate", type=float, default=0.0, help="OpenAI 429 응답 비율")
+    parser.add_argument("--storage-error-rate", type=float, default=0.0, help="Storage 503 응답 비율")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 응답의 Retry-After(초)")
+    parser.add_argument("--image-px", type=int, default=1024, help="돌려줄 PNG 한 변 크기")
+    parser.add_argument("--audio-bytes", type=int, default=60000, help="돌려줄 음성 크기(bytes)")
+    parser.add_argument("--scenes", type=int, default=5, help="대본의 씬 개수")
+    parser.add_argument("--repeat-text", action="store_true", help="매번 같은 대사를 돌려줌 (TTS 캐시 적중 측정용)")
+    return parser
+
+
+def main():
+    import uvicorn
+
+    config.__dict__.update(vars(build_parser().parse_args()))
+    _make_payloads()
+    uvicorn.run(app, host=config.host, port=config.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+/generate 처리량 벤치마크 (실제 API 비용 없음)
+
+    python bench/run_bench.py --requests 40 --concurrency 8
+    python bench/run_bench.py --requests 20 --concurrency 4 --env IMAGE_VARIANTS_ENABLED=false --image-latency 3
+    python bench/run_bench.py --json results.json --openai-error-rate 0.05
+
+1. 가짜 OpenAI + Supabase 서버(fake_services.py)를 띄우고 (모르는 옵션은 그대로 가짜 서버에 전달)
+2. 그 서버를 바라보도록 환경변수를 바꿔 실제 FastAPI 앱(main:app)을 uvicorn으로 띄운 뒤
+3. 동시 요청 수를 제한한 부하 생성기로 POST /generate를 보내고
+4. p50/p95/p99 지연, 분당 동화 수, 앱 프로세스(+자식 프로세스) 최대 RSS, 단계별 평균 시간을 보고합니다.
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_SERVER = os.path.join(BACKEND_DIR, "bench", "fake_services.py")
+
+
+# ==========================================
+# 0. 서버 띄우기 / 정리
+# ==========================================
+def start_process(args: list, env: dict = None, verbose: bool = False) -> subprocess.Popen:
+    # 서버 로그는 --verbose일 때만 화면에 (보고서가 로그에 묻히지 않도록)
+    output = None if verbose else subprocess.DEVNULL
+    return subprocess.Popen(args, cwd=BACKEND_DIR, env={**os.environ, **(env or {})}, stdout=output, stderr=output)
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"서버가 시작하자마자 종료됨: {url}")
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"서버가 {timeout}초 안에 뜨지 않음: {url}")
+
+
+def stop_process(process: subprocess.Popen):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+# ==========================================
+# 1. 메모리 측정 (/proc, 리눅스 전용)
+# ==========================================
+def _descendants(pid: int) -> list:
+    pids = [pid]
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                for child in f.read().split():
+                    pids += _descendants(int(child))
+        except OSError:
+            continue
+    return pids
+
+
+def _rss_bytes(pid: int) -> int:
+    """앱 프로세스와 자식 프로세스(이미지 후처리 워커 등)의 RSS 합계"""
+    total = 0
+    for child in _descendants(pid):
+        try:
+            with open(f"/proc/{child}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+async def sample_peak_rss(pid: int, peak: dict, interval: float = 0.2):
+    if not os.path.exists(f"/proc/{pid}"):
+        return
+    while True:
+        try:
+            peak["bytes"] = max(peak["bytes"], _rss_bytes(pid))
+        except OSError:
+            return
+        await asyncio.sleep(interval)
+
+
+# ==========================================
+# 2. 부하 생성기
+# ==========================================
+async def send_one(client: httpx.AsyncClient, index: int, args, semaphore: asyncio.Semaphore, results: list):
+    # 아이 이름을 매번 다르게 해서 중복 주문 합치기/재전송 캐시에 걸리지 않게 함
+    body = {
+        "child_name": f"벤치{index}",
+        "age": 6,
+        "personality": "호기심 많음",
+        "emotion": "신남",
+        "stage_code": args.stage_code,
+    }
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            response = await client.post("/generate", json=body)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        results.append({"index": index, "status": status, "seconds": time.perf_counter() - started})
+
+
+def percentile(values: list, p: float) -> float:
+    """nearest-rank 백분위수"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def stage_means(metrics_text: str) -> dict:
+    """/metrics에서 단계별 (평균 초, 호출 수)를 뽑습니다."""
+    sums, counts = {}, {}
+    for name, stage, value in re.findall(r'edutale_stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)', metrics_text):
+        (sums if name == "sum" else counts)[stage] = float(value)
+    return {stage: (sums[stage] / counts[stage], int(counts[stage])) for stage in sorted(counts) if counts[stage]}
+
+
+async def run(args, fake_args: list) -> dict:
+    # 앱이 쓰는 로컬 파일(체크포인트, 앵커 라이브러리, 대본 템플릿)은 실행마다 새 임시 폴더에 두고 끝나면 지움
+    with tempfile.TemporaryDirectory(prefix="edutale-bench-") as data_dir:
+        return await _run(args, fake_args, data_dir)
+
+
+async def _run(args, fake_args: list, data_dir: str) -> dict:
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    app_env = {
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{fake_url}/v1",
+        "SUPABASE_URL": fake_url,
+        "SUPABASE_API": "bench-service-key",
+        # 벤치마크가 작업 트리에 파일을 남기거나 이전 결과를 재사용하지 않도록
+        "ASSET_INDEX_PATH": "",
+        "CHECKPOINT_DIR": os.path.join(data_dir, "checkpoints"),
+        "ANCHOR_LIBRARY_PATH": os.path.join(data_dir, "anchor_library.jsonl"),
+        "DRAFT_TEMPLATE_PATH": os.path.join(data_dir, "draft_templates.jsonl"),
+        **dict(item.split("=", 1) for item in args.env),
+    }
+
+    fake = start_process([sys.executable, FAKE_SERVER, "--port", str(args.fake_port), *fake_args], verbose=args.verbose)
+    app = None
+    try:
+        await wait_until_ready(f"{fake_url}/__stats", fake)
+        app = start_process(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.app_port), "--log-level", "warning"],
+            app_env,
+            verbose=args.verbose,
+        )
+        await wait_until_ready(f"{app_url}/metrics", app)
+
+        peak = {"bytes": 0}
+        sampler = asyncio.create_task(sample_peak_rss(app.pid, peak))
+        results = []
+        semaphore = asyncio.Semaphore(args.concurrency)
+        async with httpx.AsyncClient(base_url=app_url, timeout=args.timeout) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(send_one(client, i, args, semaphore, results) for i in range(args.requests)))
+            wall = time.perf_counter() - started
+            metrics_text = (await client.get("/metrics")).text
+            fake_stats = (await client.get(f"{fake_url}/__stats")).json()
+        sampler.cancel()
+    finally:
+        if app is not None:
+            stop_process(app)
+        stop_process(fake)
+
+    latencies = [r["seconds"] for r in results if r["status"] == 200]
+    errors = {}
+    for r in results:
+        if r["status"] != 200:
+            errors[str(r["status"])] = errors.get(str(r["status"]), 0) + 1
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "wall_seconds": round(wall, 2),
+        "stories_per_minute": round(len(latencies) / wall * 60, 2) if wall else 0.0,
+        "latency_seconds": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(max(latencies, default=0.0), 3),
+        },
+        "peak_rss_mb": round(peak["bytes"] / 1024 / 1024, 1),
+        "stages": {stage: {"mean_seconds": round(mean, 3), "count": count} for stage, (mean, count) in stage_means(metrics_text).items()},
+        "fake_calls": fake_stats,
+        "settings": {"env": args.env, "fake_args": fake_args},
+    }
+
+
+def print_report(report: dict):
+    latency = report["latency_seconds"]
+    print("\n==================== Benchmark ====================")
+    print(f"요청 {report['requests']}건 (동시 {report['concurrency']}) → 성공 {report['succeeded']}건, 실패 {report['errors'] or 0}")
+    print(f"소요 {report['wall_seconds']}초 | 분당 동화 {report['stories_per_minute']}편 | 최대 RSS {report['peak_rss_mb']} MB")
+    print(f"지연 p50 {latency['p50']}s | p95 {latency['p95']}s | p99 {latency['p99']}s | max {latency['max']}s")
+    print("\n단계별 평균 (초 / 횟수)")
+    for stage, values in report["stages"].items():
+        print(f"  {stage:<24} {values['mean_seconds']:>8.3f}  x{values['count']}")
+    print("===================================================\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="가짜 OpenAI/Supabase로 /generate 처리량을 측정합니다. 모르는 옵션은 fake_services.py로 전달됩니다.")
+    parser.add_argument("--requests", type=int, default=20, help="보낼 /generate 요청 수")
+    parser.add_argument("--concurrency", type=int, default=4, help="동시에 보내는 요청 수")
+    parser.add_argument("--stage-code", default="BENCH-1")
+    parser.add_argument("--app-port", type=int, default=8100)
+    parser.add_argument("--fake-port", type=int, default=8101)
+    parser.add_argument("--timeout", type=float, default=600.0, help="요청 1건의 최대 대기 시간(초)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="앱에 넘길 환경변수 (여러 번 가능)")
+    parser.add_argument("--json", help="결과를 JSON 파일로도 저장")
+    parser.add_argument("--verbose", action="store_true", help="가짜 서버와 앱의 로그를 함께 출력")
+    args, fake_args = parser.parse_known_args()
+
+    report = asyncio.run(run(args, fake_args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
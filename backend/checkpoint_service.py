@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import asyncio
+import logging
+
+from schemas import StoryDraft
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 0. 체크포인트 설정
+# ==========================================
+# 주문별 중간 결과(대본, 캐릭터 시트 URL, 씬별 그림/음성 URL)를 저장하는 폴더. 비어 있으면(기본) 체크포인트를 쓰지 않음
+# 기록은 이 인스턴스의 디스크에만 있으므로, 여러 인스턴스에서 이어 실행/씬 재생성을 하려면 공유 볼륨을 지정하세요.
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "")
+# 실패한 채 남아 있는 주문 체크포인트를 보관하는 시간
+CHECKPOINT_TTL_SECONDS = int(os.getenv("CHECKPOINT_TTL_SECONDS", str(24 * 3600)))
+# 완성된 동화책의 재생성용 기록을 보관하는 시간 (지나면 그 동화책은 씬 재생성 불가)
+CHECKPOINT_STORY_TTL_SECONDS = int(os.getenv("CHECKPOINT_STORY_TTL_SECONDS", str(30 * 24 * 3600)))
+# 오래된 기록 정리 주기 (서버 시작 시 + 동화책이 저장될 때 이 간격마다)
+CHECKPOINT_PRUNE_INTERVAL_SECONDS = int(os.getenv("CHECKPOINT_PRUNE_INTERVAL_SECONDS", "3600"))
+
+_STORY_PREFIX = "story-"
+_last_prune = 0.0
+
+
+class Checkpoint:
+    """
+    주문 1건의 중간 결과 기록판. 바이너리(캐릭터 시트/그림/음성)는 창고에 올린 URL로만 기록합니다.
+    실패한 주문을 다시 실행하면 여기 남은 단계는 건너뛰고, 완성된 뒤에는 씬 재생성에 쓰입니다.
+    파일 쓰기는 이벤트 루프를 막지 않도록 스레드에서, 기록 순서가 뒤바뀌지 않도록 한 번에 하나씩 합니다.
+    """
+
+    def __init__(self, name: str, data: dict = None):
+        self.name = name
+        self.data = data or {"draft": None, "anchor_url": "", "scenes": {}, "updated_at": None}
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def draft(self) -> StoryDraft:
+        return StoryDraft.model_validate(self.data["draft"]) if self.data.get("draft") else None
+
+    @property
+    def anchor_url(self) -> str:
+        return self.data.get("anchor_url", "")
+
+    @property
+    def consistency_mode(self) -> str:
+        return self.data.get("consistency_mode", "chain")
+
+    def scene(self, scene_no: int) -> dict:
+        return self.data["scenes"].get(str(scene_no), {})
+
+    def completed_media(self) -> dict:
+        """{(scene_no, "image" / "audio"): URL} - 이미 창고에 올라간 씬 결과"""
+        done = {}
+        for scene_no, scene in self.data["scenes"].items():
+            for m_type in ("image", "audio"):
+                if scene.get(f"{m_type}_url"):
+                    done[(int(scene_no), m_type)] = scene[f"{m_type}_url"]
+        return done
+
+    async def set_draft(self, draft: StoryDraft):
+        self.data["draft"] = draft.model_dump()
+        await self.save()
+
+    async def set_consistency_mode(self, mode: str):
+        self.data["consistency_mode"] = mode
+        await self.save()
+
+    async def set_anchor(self, url: str):
+        self.data["anchor_url"] = url
+        await self.save()
+
+    async def set_scene(self, scene_no: int, **fields):
+        self.data["scenes"].setdefault(str(scene_no), {}).update(fields)
+        await self.save()
+
+    async def save(self):
+        if not CHECKPOINT_DIR:
+            return
+        self.data["updated_at"] = time.time()
+        # 내용은 지금 시점으로 고정하고(다른 코루틴이 data를 바꿔도 안전), 디스크 쓰기만 스레드로
+        body = json.dumps(self.data, ensure_ascii=False)
+        async with self._write_lock:
+            await asyncio.to_thread(_write, self.name, body)
+
+
+def _write(name: str, body: str):
+    path = _path(name)
+    # 임시 파일에 다 쓴 뒤 바꿔치기: 쓰는 도중에 죽어도 이전 기록이 깨지지 않음
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(body)
+    os.replace(path + ".tmp", path)
+
+
+def _path(name: str) -> str:
+    return os.path.join(CHECKPOINT_DIR, f"{name}.json")
+
+
+def _read(name: str) -> dict:
+    if not CHECKPOINT_DIR or not os.path.exists(_path(name)):
+        return None
+    try:
+        with open(_path(name), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ [Checkpoint] 기록을 읽지 못해 새로 시작합니다 ({name}): {e}")
+        return None
+
+
+# ==========================================
+# 1. 주문 체크포인트 (요청 지문 기준)
+# ==========================================
+def load(key: str) -> Checkpoint:
+    """같은 주문의 지난 기록이 있으면 이어서, 없으면 빈 기록판을 돌려줍니다. (파일을 읽으므로 asyncio.to_thread로 호출)"""
+    if CHECKPOINT_DIR:
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    data = _read(key)
+    if data:
+        logger.info(f"♻️ [Checkpoint] 지난 실행 기록 발견 → 이어서 진행 ({key[:12]})")
+    return Checkpoint(key, data)
+
+
+async def finish(checkpoint: Checkpoint, story_id: str):
+    """동화책이 저장되면 주문 기록을 동화책 ID 기준 기록(씬 재생성용)으로 옮깁니다."""
+    global _last_prune
+    if not CHECKPOINT_DIR:
+        return
+    old_path = _path(checkpoint.name)
+    checkpoint.name = f"{_STORY_PREFIX}{story_id}"
+    checkpoint.data["story_id"] = story_id
+    await checkpoint.save()
+    if os.path.exists(old_path):
+        await asyncio.to_thread(os.remove, old_path)
+    # 오래 떠 있는 서버에서도 기록이 끝없이 쌓이지 않도록 주기적으로 정리
+    if time.time() - _last_prune >= CHECKPOINT_PRUNE_INTERVAL_SECONDS:
+        await asyncio.to_thread(prune_stale)
+
+
+# ==========================================
+# 2. 완성된 동화책 기록 (씬 재생성용)
+# ==========================================
+def load_story(story_id: str) -> Checkpoint:
+    """완성된 동화책의 기록. 없거나 보관 기간이 지났으면 None (파일을 읽으므로 asyncio.to_thread로 호출)"""
+    data = _read(f"{_STORY_PREFIX}{story_id}")
+    return Checkpoint(f"{_STORY_PREFIX}{story_id}", data) if data else None
+
+
+def prune_stale():
+    """보관 기간이 지난 실패 주문 기록과 동화책 기록을 지웁니다 (서버 시작 시, 그리고 finish에서 주기적으로)."""
+    global _last_prune
+    _last_prune = time.time()
+    if not CHECKPOINT_DIR or not os.path.isdir(CHECKPOINT_DIR):
+        return
+    now = time.time()
+    removed = 0
+    for file_name in os.listdir(CHECKPOINT_DIR):
+        path = os.path.join(CHECKPOINT_DIR, file_name)
+        ttl = CHECKPOINT_STORY_TTL_SECONDS if file_name.startswith(_STORY_PREFIX) else CHECKPOINT_TTL_SECONDS
+        try:
+            if now - os.path.getmtime(path) > ttl:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            continue  # 그사이 옮겨진 기록
+    if removed:
+        logger.info(f"🧹 [Checkpoint] 오래된 기록 {removed}건 정리")
@@ -1,9 +1,20 @@
 import os
+import json
+import time
+import random
+import asyncio
+import base64
+import hashlib
+import threading
 import uuid
+from datetime import datetime
 import httpx
+from collections import OrderedDict
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
+import telemetry
+
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -12,10 +23,121 @@ SUPABASE_API = os.getenv("SUPABASE_API")
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_API)
 BUCKET_NAME = "edu-tale-assets"
 
+# 비동기 업로드 설정 (동시 업로드 수 / 재시도 횟수)
+UPLOAD_CONCURRENCY = int(os.getenv("STORAGE_UPLOAD_CONCURRENCY", "8"))
+UPLOAD_MAX_RETRIES = int(os.getenv("STORAGE_UPLOAD_MAX_RETRIES", "3"))
+# 흘려 올리는 업로드(PDF처럼 올리는 동안 내용을 만드는 파일)의 동시 수. 씬 업로드 자리와 따로 셈
+STREAM_UPLOAD_CONCURRENCY = int(os.getenv("STORAGE_STREAM_UPLOAD_CONCURRENCY", "2"))
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# 교재 캐시 설정 (교재는 거의 바뀌지 않으므로 메모리에 들고 있음)
+CURRICULUM_CACHE_TTL = int(os.getenv("CURRICULUM_CACHE_TTL_SECONDS", "600"))
+CURRICULUM_CACHE_MAX_ENTRIES = int(os.getenv("CURRICULUM_CACHE_MAX_ENTRIES", "512"))
+
+# 동화책 캐시 설정 (메모리 한도 안에서 보관하되, 다른 인스턴스가 씬을 재생성했을 수 있으므로 이 시간이 지나면 DB에서 다시 읽음)
+STORY_CACHE_MAX_BYTES = int(os.getenv("STORY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+STORY_CACHE_TTL_SECONDS = int(os.getenv("STORY_CACHE_TTL_SECONDS", "30"))
+STORY_LIST_MAX_LIMIT = int(os.getenv("STORY_LIST_MAX_LIMIT", "50"))
+# 목록/요약용 컬럼: 무거운 scenes JSON 대신 첫 장면 그림 URL만 꺼냄 (PostgREST JSON 경로)
+STORY_SUMMARY_COLUMNS = "id, user_id, title, stage_code, emotion, created_at, cover_url:scenes->0->>image_url"
+
+# 다시 쓰일 수 있는 파일(TTS 녹음, PDF처럼 이름을 정해 올린 파일)의 인덱스 (이름 → 공용 URL). 경로를 주면 재시작해도 유지됩니다.
+ASSET_INDEX_PATH = os.getenv("ASSET_INDEX_PATH", "")
+# 인덱스에 들고 있는 최대 항목 수 (넘치면 가장 오래 안 쓴 것부터 버리고, 없으면 HEAD 요청으로 다시 확인)
+ASSET_INDEX_MAX_ENTRIES = int(os.getenv("ASSET_INDEX_MAX_ENTRIES", "20000"))
+
+# 미디어 종류별 확장자 / Content-Type
+MEDIA_FORMATS = {
+    "image": (".png", "image/png"),
+    "audio": (".mp3", "audio/mpeg"),
+}
+
 # ==========================================
-# 1. 교재 텍스트 꺼내오기 (DB Select)
+# 0. 간단한 메모리 캐시 (스레드 안전, 개수 / 크기 제한)
+# ==========================================
+class TTLCache:
+    """만료 시간(ttl초)과 최대 개수를 가진 메모리 캐시. 꽉 차면 가장 오래 안 쓴 항목부터 버립니다."""
+
+    def __init__(self, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # {key: (만료시각, 값)}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ByteLRUCache:
+    """전체 크기(bytes) 한도를 지키는 LRU 캐시. ttl초가 지난 항목은 없는 것으로 봅니다 (0이면 만료 없음)."""
+
+    def __init__(self, max_bytes: int, ttl: int = 0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._data = OrderedDict()  # {key: (크기, 만료시각, 값)}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if self.ttl and entry[1] < time.time():
+                self.size -= self._data.pop(key)[0]
+                return None
+            self._data.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, value, size: int):
+        if size > self.max_bytes:
+            return  # 한도보다 큰 항목은 보관하지 않음
+        with self._lock:
+            if key in self._data:
+                self.size -= self._data.pop(key)[0]
+            self._data[key] = (size, time.time() + self.ttl, value)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= self._data.popitem(last=False)[1][0]
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.size -= entry[0]
+
+
+_curriculum_cache = TTLCache(CURRICULUM_CACHE_TTL, CURRICULUM_CACHE_MAX_ENTRIES)
+_ALL_CURRICULUMS_KEY = "__all__"
+
+# ==========================================
+# 1. 교재 텍스트 꺼내오기 (DB Select + 캐시)
 # ==========================================
 def get_curriculum(stage_code: str):
+    cached = _curriculum_cache.get(stage_code)
+    if cached is not None:
+        return cached
+
     print(f"🔍 [DB] 진도코드 '{stage_code}' 교재 검색 중...")
     response = supabase.table("curriculums").select("*").eq("stage_code", stage_code).execute()
     
@@ -23,25 +145,63 @@ def get_curriculum(stage_code: str):
         raise ValueError(f"진도 코드 '{stage_code}'를 찾을 수 없습니다.")
         
     data = response.data[0]
-    return data["title"], data["source_text"]
+    result = (data["title"], data["source_text"])
+    _curriculum_cache.set(stage_code, result)
+    return result
+
+def _fetch_all_curriculums():
+    """전체 교재 목록과 그 ETag(내용 해시)를 DB에서 새로 읽어 캐시에 넣습니다."""
+    # 필요한 필드만 선택해서 가져오기 (stage_code, title, chapter 등)
+    response = supabase.table("curriculums").select("stage_code, title, chapter, description").order("stage_code").execute()
+    body = json.dumps(response.data, ensure_ascii=False, sort_keys=True, default=str)
+    etag = '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"'
+    result = (response.data, etag)
+    _curriculum_cache.set(_ALL_CURRICULUMS_KEY, result)
+    return result
+
+def get_all_curriculums_with_etag():
+    """(교재 목록, ETag)를 반환합니다. 실패하면 ([], None)."""
+    cached = _curriculum_cache.get(_ALL_CURRICULUMS_KEY)
+    if cached is not None:
+        return cached
 
-def get_all_curriculums():
     print("🔍 [DB] 전체 커리큘럼 목록 조회 중...")
     try:
-        # 필요한 필드만 선택해서 가져오기 (stage_code, title, chapter 등)
-        response = supabase.table("curriculums").select("stage_code, title, chapter, description").order("stage_code").execute()
-        return response.data
+        return _fetch_all_curriculums()
     except Exception as e:
         print(f"❌ [DB] 커리큘럼 조회 실패: {e}")
-        return []
+        return [], None
+
+def get_cached_curriculums() -> tuple:
+    """캐시에 있으면 (교재 목록, ETag), 없으면 None. DB를 건드리지 않으므로 이벤트 루프에서 바로 불러도 됩니다."""
+    return _curriculum_cache.get(_ALL_CURRICULUMS_KEY)
+
+def get_all_curriculums():
+    return get_all_curriculums_with_etag()[0]
+
+def warm_curriculum_cache():
+    """서버 시작 시 전체 교재를 한 번에 읽어 캐시를 채웁니다."""
+    response = supabase.table("curriculums").select("*").execute()
+    for data in response.data:
+        _curriculum_cache.set(data["stage_code"], (data["title"], data["source_text"]))
+    _fetch_all_curriculums()
+    print(f"✅ [DB] 교재 캐시 준비 완료 ({len(response.data)}건)")
+
+def invalidate_curriculum_cache():
+    """교재를 수정한 뒤 호출하면 다음 요청부터 DB에서 새로 읽습니다."""
+    _curriculum_cache.clear()
+    print("🧹 [DB] 교재 캐시 비움")
 
 # ==========================================
 # 2. 파일 업로드 및 퍼블릭 URL 받기 (Storage)
 # ==========================================
+def content_object_name(file_bytes: bytes, file_ext: str) -> str:
+    """파일 내용의 SHA-256 해시로 이름 짓기 (같은 내용은 같은 이름 → 중복 저장 없음)"""
+    return f"{hashlib.sha256(file_bytes).hexdigest()}{file_ext}"
+
 def upload_to_supabase(file_bytes: bytes, file_ext: str, content_type: str) -> str:
     """바이트 데이터를 받아 Supabase 스토리지에 올리고 공용 URL을 반환합니다."""
-    # 파일 이름이 겹치지 않도록 UUID(랜덤 문자열)로 이름 짓기
-    file_name = f"{uuid.uuid4()}{file_ext}"
+    file_name = content_object_name(file_bytes, file_ext)
     
     try:
         # 파일 업로드 (동일한 이름이 있으면 덮어쓰기 옵션 추가)
@@ -58,6 +218,215 @@ def upload_to_supabase(file_bytes: bytes, file_ext: str, content_type: str) -> s
         print(f"❌ [Storage] 업로드 실패: {e}")
         return ""
 
+# ==========================================
+# 2-1. 비동기 업로드 (공용 Keep-Alive 커넥션 풀 + 동시성 제한 + 재시도)
+# ==========================================
+_http_client: httpx.AsyncClient = None
+_upload_semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+# 흘려 올리는 업로드는 페이지를 그리는 동안에도 연결을 잡고 있으므로, 씬 그림/음성 업로드 자리를 뺏지 않게 따로 제한
+_stream_upload_semaphore = asyncio.Semaphore(STREAM_UPLOAD_CONCURRENCY)
+
+def get_http_client() -> httpx.AsyncClient:
+    """프로세스 전체가 같이 쓰는 httpx 클라이언트 (연결을 재사용해서 매번 TLS 핸드셰이크를 하지 않음)"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(max_connections=UPLOAD_CONCURRENCY * 2, max_keepalive_connections=UPLOAD_CONCURRENCY),
+        )
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+async def upload_to_supabase_async(file_bytes: bytes, file_ext: str, content_type: str, object_name: str = None) -> str:
+    """
+    upload_to_supabase의 비동기 버전. 일시적인 오류(429/5xx/네트워크)는 지수 백오프로 재시도합니다.
+    object_name을 주지 않으면 내용 해시로 이름을 짓습니다.
+    object_name을 준 파일(TTS처럼 다시 쓰일 수 있는 파일)은 인덱스에 기록해 두고, 이미 올라간 파일이면 업로드를 건너뜁니다.
+    """
+    file_name = object_name or content_object_name(file_bytes, file_ext)
+    known_url = _known_asset(file_name) if object_name else ""
+    if known_url:
+        return known_url
+
+    url = f"{SUPABASE_URL}/storage/v1/object/{BUCKET_NAME}/{file_name}"
+    headers = {
+        "Authorization": f"Bearer {SUPABASE_API}",
+        "apikey": SUPABASE_API,
+        "Content-Type": content_type,
+        "x-upsert": "true",
+    }
+
+    error = ""
+    with telemetry.span("storage.upload", bytes=len(file_bytes)):
+        for attempt in range(1, UPLOAD_MAX_RETRIES + 1):
+            telemetry.annotate(attempts=attempt)
+            try:
+                # 업로드 자리는 요청하는 동안만 잡음 (재시도 대기 중에는 다른 업로드가 쓰도록 돌려줌)
+                async with _upload_semaphore:
+                    response = await get_http_client().post(url, content=file_bytes, headers=headers)
+                if response.status_code not in RETRYABLE_STATUS:
+                    response.raise_for_status()
+                    public_url = supabase.storage.from_(BUCKET_NAME).get_public_url(file_name)
+                    if object_name:
+                        await record_asset(file_name, public_url)
+                    return public_url
+                error = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                error = repr(e)
+            except Exception as e:
+                print(f"❌ [Storage] 업로드 실패: {e}")
+                telemetry.mark_failed(type(e).__name__)
+                return ""
+
+            if attempt < UPLOAD_MAX_RETRIES:
+                delay = (2 ** (attempt - 1)) * 0.5 + random.uniform(0, 0.5)
+                print(f"⚠️ [Storage] 업로드 재시도 {attempt}/{UPLOAD_MAX_RETRIES - 1} ({error}), {delay:.1f}초 후")
+                await asyncio.sleep(delay)
+
+        print(f"❌ [Storage] 업로드 최종 실패: {error}")
+        telemetry.mark_failed("retries_exhausted")
+    return ""
+
+async def upload_stream_to_supabase_async(make_chunks, object_name: str, content_type: str) -> str:
+    """
+    make_chunks()가 만드는 비동기 바이트 조각들을 전부 모으지 않고 그대로 흘려 올립니다 (chunked 전송).
+    한 번 흘려보낸 조각은 되돌릴 수 없으므로, 재시도할 때는 make_chunks()를 다시 불러 처음부터 만듭니다.
+    조각을 만드는 시간만큼 연결을 오래 잡으므로 일반 업로드와 다른 자리(STREAM_UPLOAD_CONCURRENCY)를 씁니다.
+    """
+    url = f"{SUPABASE_URL}/storage/v1/object/{BUCKET_NAME}/{object_name}"
+    headers = {
+        "Authorization": f"Bearer {SUPABASE_API}",
+        "apikey": SUPABASE_API,
+        "Content-Type": content_type,
+        "x-upsert": "true",
+    }
+
+    error = ""
+    with telemetry.span("storage.upload", streamed=True):
+        for attempt in range(1, UPLOAD_MAX_RETRIES + 1):
+            telemetry.annotate(attempts=attempt)
+            try:
+                async with _stream_upload_semaphore:
+                    response = await get_http_client().post(url, content=make_chunks(), headers=headers)
+                if response.status_code not in RETRYABLE_STATUS:
+                    response.raise_for_status()
+                    public_url = supabase.storage.from_(BUCKET_NAME).get_public_url(object_name)
+                    await record_asset(object_name, public_url)
+                    return public_url
+                error = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                error = repr(e)
+            except Exception as e:
+                print(f"❌ [Storage] 스트리밍 업로드 실패: {e}")
+                telemetry.mark_failed(type(e).__name__)
+                return ""
+
+            if attempt < UPLOAD_MAX_RETRIES:
+                delay = (2 ** (attempt - 1)) * 0.5 + random.uniform(0, 0.5)
+                print(f"⚠️ [Storage] 스트리밍 업로드 재시도 {attempt}/{UPLOAD_MAX_RETRIES - 1} ({error}), {delay:.1f}초 후")
+                await asyncio.sleep(delay)
+
+        print(f"❌ [Storage] 스트리밍 업로드 최종 실패: {error}")
+        telemetry.mark_failed("retries_exhausted")
+    return ""
+
+async def upload_media_item(item: dict) -> str:
+    """미디어 결과 1건({"scene_no", "type", "data"})을 업로드하고 URL을 반환합니다. 데이터가 없으면 빈 문자열."""
+    if not item.get("data"):
+        return ""
+    # 항목에 포맷이 적혀 있으면 그걸 쓰고 (예: Opus 음성), 없으면 종류별 기본값
+    default_ext, default_type = MEDIA_FORMATS[item["type"]]
+    file_ext = item.get("file_ext", default_ext)
+    content_type = item.get("content_type", default_type)
+    return await upload_to_supabase_async(item["data"], file_ext, content_type, item.get("object_name"))
+
+async def download_asset(public_url: str) -> bytes:
+    """창고에 있는 파일을 공용 커넥션 풀로 내려받습니다."""
+    with telemetry.span("storage.download"):
+        response = await get_http_client().get(public_url)
+        response.raise_for_status()
+    return response.content
+
+# ==========================================
+# 2-2. 업로드된 파일 인덱스 (내용 주소 기반 캐시)
+# ==========================================
+_asset_index = OrderedDict()  # {object_name: public_url} - 최근에 쓴 것이 뒤쪽 (ASSET_INDEX_MAX_ENTRIES개까지)
+_asset_index_lock = threading.Lock()
+
+def _remember_asset(object_name: str, public_url: str) -> bool:
+    """인덱스에 넣고, 새로 들어간 항목이면 True. 한도를 넘으면 가장 오래 안 쓴 항목부터 버립니다."""
+    with _asset_index_lock:
+        is_new = _asset_index.get(object_name) != public_url
+        _asset_index[object_name] = public_url
+        _asset_index.move_to_end(object_name)
+        while len(_asset_index) > ASSET_INDEX_MAX_ENTRIES:
+            _asset_index.popitem(last=False)
+        return is_new
+
+def _known_asset(object_name: str) -> str:
+    with _asset_index_lock:
+        url = _asset_index.get(object_name, "")
+        if url:
+            _asset_index.move_to_end(object_name)
+        return url
+
+def _load_asset_index():
+    """파일의 마지막 ASSET_INDEX_MAX_ENTRIES건만 불러오고, 파일이 그보다 크면 남긴 항목만으로 다시 씁니다."""
+    if not ASSET_INDEX_PATH or not os.path.exists(ASSET_INDEX_PATH):
+        return
+    lines = 0
+    with open(ASSET_INDEX_PATH, encoding="utf-8") as f:
+        for line in f:
+            lines += 1
+            try:
+                entry = json.loads(line)
+                _remember_asset(entry["name"], entry["url"])
+            except (ValueError, KeyError):
+                continue  # 쓰다 만 줄은 무시
+    if lines > len(_asset_index):
+        # 임시 파일에 다 쓴 뒤 바꿔치기 (쓰는 도중에 죽어도 이전 인덱스가 남음)
+        with open(ASSET_INDEX_PATH + ".tmp", "w", encoding="utf-8") as f:
+            f.writelines(json.dumps({"name": name, "url": url}) + "\n" for name, url in _asset_index.items())
+        os.replace(ASSET_INDEX_PATH + ".tmp", ASSET_INDEX_PATH)
+    print(f"📇 [Storage] 파일 인덱스 {len(_asset_index)}건 불러옴")
+
+def _append_asset(object_name: str, public_url: str):
+    with _asset_index_lock:
+        with open(ASSET_INDEX_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"name": object_name, "url": public_url}) + "\n")
+
+async def record_asset(object_name: str, public_url: str):
+    """업로드가 끝난 파일을 인덱스에 기록합니다 (ASSET_INDEX_PATH가 있으면 스레드에서 파일에도 한 줄 추가)."""
+    if _remember_asset(object_name, public_url) and ASSET_INDEX_PATH:
+        await asyncio.to_thread(_append_asset, object_name, public_url)
+
+async def find_asset(object_name: str) -> str:
+    """
+    이미 창고에 있는 파일이면 공용 URL을, 없으면 빈 문자열을 반환합니다.
+    로컬 인덱스에 없으면 공용 URL에 HEAD 요청을 한 번 보내 확인합니다 (재시작 후에도 재사용 가능).
+    """
+    known_url = _known_asset(object_name)
+    if known_url:
+        return known_url
+
+    public_url = supabase.storage.from_(BUCKET_NAME).get_public_url(object_name)
+    try:
+        with telemetry.span("storage.head"):
+            response = await get_http_client().head(public_url)
+    except httpx.HTTPError:
+        return ""
+    if response.status_code == 200:
+        await record_asset(object_name, public_url)
+        return public_url
+    return ""
+
+_load_asset_index()
+
 # ==========================================
 # 3. DALL-E 임시 URL을 가로채서 우리 창고에 저장하기
 # ==========================================
@@ -67,13 +436,13 @@ async def save_image_from_url(dalle_url: str) -> str:
         return ""
         
     try:
-        # 1. DALL-E 링크에서 이미지 다운로드
-        async with httpx.AsyncClient() as client:
-            response = await client.get(dalle_url)
-            image_bytes = response.content
+        # 1. DALL-E 링크에서 이미지 다운로드 (공용 커넥션 풀 재사용)
+        response = await get_http_client().get(dalle_url)
+        response.raise_for_status()
+        image_bytes = response.content
             
         # 2. 다운받은 이미지를 Supabase에 업로드 (.png)
-        permanent_url = upload_to_supabase(image_bytes, ".png", "image/png")
+        permanent_url = await upload_to_supabase_async(image_bytes, ".png", "image/png")
         return permanent_url
     except Exception as e:
         print(f"❌ [Storage] 이미지 다운/업로드 실패: {e}")
@@ -95,16 +464,113 @@ def save_final_story(user_id: str, stage_code: str, emotion: str, title: str, sc
     
     response = supabase.table("stories").insert(data).execute()
     saved_id = response.data[0]["id"]
+    _cache_story(response.data[0])  # 저장 직후 첫 조회도 DB를 거치지 않도록
     print(f"✅ [DB] 동화책 저장 완료! (Story ID: {saved_id})")
     
     return saved_id
 
-def get_story_by_id(story_id: str):
-    """ID로 동화책 조회"""
+# ==========================================
+# 5. 동화책 조회 (캐시 / 요약 / 목록) 및 씬 갱신
+# ==========================================
+_story_cache = ByteLRUCache(STORY_CACHE_MAX_BYTES, STORY_CACHE_TTL_SECONDS)  # {story_id: (동화책, ETag)}
+
+def _cache_story(story: dict) -> tuple:
+    body = json.dumps(story, ensure_ascii=False, sort_keys=True, default=str)
+    etag = '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"'
+    entry = (story, etag)
+    _story_cache.set(str(story["id"]), entry, len(body.encode("utf-8")))
+    return entry
+
+def get_cached_story(story_id: str) -> tuple:
+    """캐시에 있으면 (동화책, ETag), 없으면 None. DB를 건드리지 않으므로 이벤트 루프에서 바로 불러도 됩니다."""
+    return _story_cache.get(story_id)
+
+def get_story_with_etag(story_id: str) -> tuple:
+    """
+    (동화책, ETag). STORY_CACHE_TTL_SECONDS 동안은 캐시에서 돌려줍니다.
+    이 인스턴스에서 씬을 재생성하면 update_story_scenes가 캐시를 바로 교체하고, 다른 인스턴스의 재생성은 TTL이 지나면 반영됩니다.
+    """
+    cached = _story_cache.get(story_id)
+    if cached is not None:
+        return cached
+
     print(f"🔍 [DB] 동화책 조회 중... (ID: {story_id})")
     response = supabase.table("stories").select("*").eq("id", story_id).execute()
     
     if not response.data:
         raise ValueError(f"Story not found: {story_id}")
         
-    return response.data[0]
\ No newline at end of file
+    return _cache_story(response.data[0])
+
+def get_story_by_id(story_id: str):
+    """ID로 동화책 조회"""
+    return get_story_with_etag(story_id)[0]
+
+def update_story_scenes(story_id: str, scenes: list) -> tuple:
+    """동화책의 scenes를 통째로 교체하고 새 (동화책, ETag)를 돌려줍니다. ETag가 바뀌므로 클라이언트 캐시도 갱신됩니다."""
+    print(f"💾 [DB] 동화책 씬 갱신 중... (ID: {story_id})")
+    # 갱신 결과를 받기 전에 실패해도 옛 씬이 캐시에 남지 않도록 먼저 비움 (다음 조회는 DB에서)
+    _story_cache.discard(story_id)
+    response = supabase.table("stories").update({"scenes": scenes}).eq("id", story_id).execute()
+    if not response.data:
+        raise ValueError(f"Story not found: {story_id}")
+    return _cache_story(response.data[0])
+
+def summarize_story(story: dict) -> dict:
+    """전체 동화책에서 목록/요약 화면에 필요한 필드만 뽑습니다 (STORY_SUMMARY_COLUMNS와 같은 모양)."""
+    scenes = story.get("scenes") or []
+    return {
+        "id": story["id"],
+        "user_id": story.get("user_id"),
+        "title": story.get("title"),
+        "stage_code": story.get("stage_code"),
+        "emotion": story.get("emotion"),
+        "created_at": story.get("created_at"),
+        "cover_url": scenes[0].get("image_url") if scenes else None,
+    }
+
+def get_story_summary(story_id: str) -> dict:
+    """요약만 필요할 때: 캐시에 전체가 있으면 거기서 뽑고, 없으면 scenes를 빼고 조회합니다."""
+    cached = _story_cache.get(story_id)
+    if cached is not None:
+        return summarize_story(cached[0])
+
+    response = supabase.table("stories").select(STORY_SUMMARY_COLUMNS).eq("id", story_id).execute()
+    if not response.data:
+        raise ValueError(f"Story not found: {story_id}")
+    return response.data[0]
+
+def _encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], str(row["id"])])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple:
+    """(created_at, story_id). 필터 문자열에 그대로 들어가므로 ISO 시각과 UUID인지 확인합니다 (아니면 ValueError → 400)."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, story_id = json.loads(raw)
+        datetime.fromisoformat(created_at)
+        return created_at, str(uuid.UUID(story_id))
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError("잘못된 cursor 입니다.")
+
+def list_user_stories(user_id: str, limit: int = 20, cursor: str = None) -> dict:
+    """
+    아이(사용자)의 동화책 요약 목록을 최신순으로 돌려줍니다.
+    (created_at, id) 기준 커서 페이지네이션이라 페이지가 깊어져도 OFFSET처럼 느려지지 않습니다.
+    """
+    limit = max(1, min(limit, STORY_LIST_MAX_LIMIT))
+    query = supabase.table("stories").select(STORY_SUMMARY_COLUMNS).eq("user_id", user_id)
+    if cursor:
+        created_at, story_id = _decode_cursor(cursor)
+        # 직전 페이지 마지막 항목보다 '뒤'(더 오래된 것)만: created_at < c 또는 (created_at = c 이고 id < i)
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{story_id}")')
+    # 한 개 더 읽어서 다음 페이지가 있는지 판단
+    response = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute()
+
+    rows = response.data[:limit]
+    has_more = len(response.data) > limit
+    return {
+        "items": rows,
+        "next_cursor": _encode_cursor(rows[-1]) if has_more and rows else None,
+    }
\ No newline at end of file
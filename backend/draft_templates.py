@@ -0,0 +1,259 @@
+import os
+import re
+import json
+import asyncio
+import random
+import itertools
+import hashlib
+import logging
+import threading
+
+from schemas import StoryDraft
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 0. 대본 템플릿 캐시 설정
+# ==========================================
+# (진도, 감정, 나이대, 성향)이 같은 주문은 이름만 바꾼 대본을 재사용해서 GPT 호출을 건너뜁니다.
+DRAFT_TEMPLATE_CACHE_ENABLED = os.getenv("DRAFT_TEMPLATE_CACHE_ENABLED", "false").lower() == "true"
+# 템플릿을 한 줄씩 기록하는 파일 (비우면 메모리에만 보관, 상대 경로는 이 파일이 있는 backend 폴더 기준)
+DRAFT_TEMPLATE_PATH = os.getenv("DRAFT_TEMPLATE_PATH", "draft_templates.jsonl")
+if DRAFT_TEMPLATE_PATH:
+    DRAFT_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), DRAFT_TEMPLATE_PATH)
+# 조합마다 이만큼의 서로 다른 대본이 모일 때까지는 새로 쓰고, 그다음부터 그중 하나를 골라 재사용
+DRAFT_TEMPLATE_VARIANTS = int(os.getenv("DRAFT_TEMPLATE_VARIANTS", "3"))
+# 나이대 경계 (예: "4,6,8" → ~4살 / 5~6살 / 7~8살 / 9살~)
+DRAFT_TEMPLATE_AGE_BANDS = [int(age) for age in os.getenv("DRAFT_TEMPLATE_AGE_BANDS", "4,6,8").split(",") if age.strip()]
+
+# 이름 뒤에 붙는 조사 (받침 있을 때, 받침 없을 때). 긴 것부터 맞춰 봅니다.
+PARTICLES = [("이랑", "랑"), ("이나", "나"), ("으로", "로"), ("이", "가"), ("은", "는"), ("을", "를"), ("과", "와"), ("아", "야")]
+NAME_PLACEHOLDER = re.compile(r"\{\{name(이)?(?:\|([^/}]+)/([^}]+))?\}\}")
+
+# 영어로 쓰는 필드. GPT가 여기에 이름을 로마자로 적으면('Minjun') 자리표시자로 바꿀 수 없으므로 저장하지 않습니다.
+ENGLISH_FIELDS = ("style_guide", "character_bible", "anchor_prompt")
+# 주인공의 성별을 드러내는 영어 낱말. 템플릿은 다른 아이에게 쓰이므로 영어 필드에 이런 낱말이 있으면 저장하지 않습니다.
+GENDERED_WORDS = frozenset({
+    "boy", "boys", "girl", "girls", "he", "she", "him", "her", "his", "hers", "himself", "herself",
+    "son", "daughter", "brother", "sister", "prince", "princess", "man", "woman", "lady", "gentleman",
+})
+# 이름 로마자 표기 후보 (국어의 로마자 표기법 + 흔히 쓰는 다른 표기). 순서는 한글 자모 순서
+_INITIALS = [("g", "k"), ("kk",), ("n",), ("d", "t"), ("tt",), ("r", "l"), ("m",), ("b", "p"), ("pp",), ("s", "sh"),
+             ("ss",), ("",), ("j", "ch"), ("jj",), ("ch",), ("k",), ("t",), ("p",), ("h",)]
+_MEDIALS = [("a",), ("ae", "e"), ("ya",), ("yae",), ("eo", "u", "o"), ("e",), ("yeo", "yu", "yo"), ("ye",), ("o",),
+            ("wa",), ("wae",), ("oe", "we"), ("yo",), ("u", "oo"), ("wo",), ("we",), ("wi",), ("yu",), ("eu", "u"),
+            ("ui",), ("i", "ee")]
+_FINALS = [("",), ("k", "g"), ("k",), ("k",), ("n",), ("n",), ("n",), ("t",), ("l",), ("k",), ("m",), ("l",), ("l",),
+           ("l",), ("p",), ("l",), ("m",), ("p", "b"), ("p",), ("t",), ("t",), ("ng",), ("t",), ("t",), ("k",), ("t",),
+           ("p",), ("t",)]
+
+_templates = {}  # {캐시 키: [대본 템플릿 dict]}
+_lock = threading.Lock()
+
+
+def _is_hangul(char: str) -> bool:
+    return "가" <= char <= "힣"
+
+
+def _final_consonant(name: str) -> int:
+    """이름 마지막 글자의 받침 번호 (0이면 받침 없음, 8이면 ㄹ). 한글이 아니면 받침 없는 것으로 봅니다."""
+    last = name[-1:] if name else ""
+    return (ord(last) - ord("가")) % 28 if _is_hangul(last) else 0
+
+
+def romanizations(name: str) -> set:
+    """한글 이름의 로마자 표기 후보들 (소문자, 띄어쓰기 없이). 예: '민준' → {'minjun', 'minjoon', ...}"""
+    if not name:
+        return set()
+    if not all(_is_hangul(char) for char in name):
+        return {name.lower()} if name.isascii() else set()
+    syllables = []
+    for char in name:
+        code = ord(char) - ord("가")
+        initial, medial, final = code // 588, (code % 588) // 28, code % 28
+        syllables.append({i + m + f for i in _INITIALS[initial] for m in _MEDIALS[medial] for f in _FINALS[final]})
+    return {"".join(parts) for parts in itertools.product(*syllables)}
+
+
+def _mentions_name_in_english(draft: dict, name: str) -> bool:
+    """영어 필드에 이름이 로마자로 들어 있는지. 'Min-jun', 'Min Jun'처럼 나뉜 표기도 붙여서 확인합니다."""
+    variants = romanizations(name)
+    texts = [draft.get(field) or "" for field in ENGLISH_FIELDS]
+    texts += [scene.get("image_prompt") or "" for scene in draft.get("scenes") or []]
+    for text in texts:
+        words = re.findall(r"[a-z]+", text.lower())
+        for size in (1, 2, 3):
+            if any("".join(words[i:i + size]) in variants for i in range(len(words) - size + 1)):
+                return True
+    return False
+
+
+def _mentions_gender_in_english(draft: dict) -> bool:
+    """영어 필드(캐릭터 설정, 씬 그림 프롬프트)에 성별을 드러내는 낱말이 있는지"""
+    texts = [draft.get(field) or "" for field in ENGLISH_FIELDS]
+    texts += [scene.get("image_prompt") or "" for scene in draft.get("scenes") or []]
+    return any(word in GENDERED_WORDS for text in texts for word in re.findall(r"[a-z]+", text.lower()))
+
+
+def age_band(age: int) -> str:
+    lower = 0
+    for bound in DRAFT_TEMPLATE_AGE_BANDS:
+        if age <= bound:
+            return f"{lower}-{bound}"
+        lower = bound + 1
+    return f"{lower}+"
+
+
+def template_key(stage_code: str, source_text: str, emotion: str, age: int, personality: str) -> str:
+    """교재 내용이 바뀌면 키도 바뀌도록 교재 텍스트의 해시를 함께 넣습니다."""
+    source_hash = hashlib.sha256(source_text.encode("utf-8")).hexdigest()[:12]
+    return "|".join([stage_code.strip(), source_hash, emotion.strip().lower(), age_band(age), personality.strip().lower()])
+
+
+# ==========================================
+# 1. 이름 ↔ 자리표시자 바꾸기 (조사 처리 포함)
+# ==========================================
+def _to_template(text: str, name: str) -> str:
+    """
+    글 속의 아이 이름을 자리표시자로 바꿉니다.
+    - {{name}}: 이름만, {{name|이/가}}: 이름 + 받침에 맞는 조사
+    - {{name이}}: 받침 있는 이름 뒤에 붙이는 '이' (예: 민준이는 → 지아는)
+    """
+    consonant = bool(_final_consonant(name))
+    out = []
+    i = 0
+    while True:
+        j = text.find(name, i)
+        if j < 0:
+            out.append(text[i:])
+            return "".join(out)
+        end = j + len(name)
+        # 앞 글자가 한글이면 다른 낱말의 일부 (예: '하민준' 속 '민준')
+        if j > 0 and _is_hangul(text[j - 1]):
+            out.append(text[i:end])
+            i = end
+            continue
+        out.append(text[i:j])
+        rest = text[end:]
+        if consonant and rest.startswith("이") and _is_hangul(rest[1:2]):
+            out.append("{{name이}}")
+            i = end + 1
+            continue
+        for after_consonant, after_vowel in PARTICLES:
+            particle = after_consonant if consonant else after_vowel
+            if rest.startswith(particle):
+                out.append(f"{{{{name|{after_consonant}/{after_vowel}}}}}")
+                i = end + len(particle)
+                break
+        else:
+            out.append("{{name}}")
+            i = end
+
+
+def _personalize(text: str, name: str) -> str:
+    final = _final_consonant(name)
+
+    def replace(match: re.Match) -> str:
+        hypocoristic, after_consonant, after_vowel = match.groups()
+        if hypocoristic:
+            return name + ("이" if final else "")
+        if after_consonant is None:
+            return name
+        # ㄹ 받침 뒤에는 '으로'가 아니라 '로'
+        if after_consonant == "으로" and final == 8:
+            return name + after_vowel
+        return name + (after_consonant if final else after_vowel)
+
+    return NAME_PLACEHOLDER.sub(replace, text)
+
+
+def _map_strings(value, func):
+    if isinstance(value, str):
+        return func(value)
+    if isinstance(value, list):
+        return [_map_strings(item, func) for item in value]
+    if isinstance(value, dict):
+        return {key: _map_strings(item, func) for key, item in value.items()}
+    return value
+
+
+def _contains(value, text: str) -> bool:
+    if isinstance(value, str):
+        return text in value
+    if isinstance(value, list):
+        return any(_contains(item, text) for item in value)
+    if isinstance(value, dict):
+        return any(_contains(item, text) for item in value.values())
+    return False
+
+
+def _load_templates():
+    if not DRAFT_TEMPLATE_CACHE_ENABLED or not DRAFT_TEMPLATE_PATH or not os.path.exists(DRAFT_TEMPLATE_PATH):
+        return
+    count = 0
+    with open(DRAFT_TEMPLATE_PATH, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                _templates.setdefault(entry["key"], []).append(entry["draft"])
+                count += 1
+            except (ValueError, KeyError):
+                continue  # 쓰다 만 줄은 무시
+    logger.info(f"📝 [Draft Template] 대본 템플릿 {count}개 불러옴")
+
+
+# ==========================================
+# 2. 조회 / 저장
+# ==========================================
+def find_draft(key: str, child_name: str) -> StoryDraft:
+    """조합마다 DRAFT_TEMPLATE_VARIANTS개가 모였으면 그중 하나를 아이 이름으로 채워 돌려줍니다. 아니면 None."""
+    if not DRAFT_TEMPLATE_CACHE_ENABLED:
+        return None
+    variants = _templates.get(key) or []
+    if len(variants) < max(1, DRAFT_TEMPLATE_VARIANTS):
+        return None
+    template = random.choice(variants)
+    return StoryDraft.model_validate(_map_strings(template, lambda text: _personalize(text, child_name)))
+
+
+def _append_template(key: str, template: dict):
+    with _lock:
+        with open(DRAFT_TEMPLATE_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": key, "draft": template}, ensure_ascii=False) + "\n")
+
+
+async def save_draft(key: str, story_draft: StoryDraft, child_name: str):
+    """
+    새로 쓴 대본에서 아이 이름을 자리표시자로 바꿔 저장합니다. 이름을 안전하게 다 바꿀 수 없으면 저장하지 않습니다.
+    파일 기록은 이벤트 루프를 막지 않도록 스레드에서 합니다.
+    """
+    if not DRAFT_TEMPLATE_CACHE_ENABLED or len(child_name.strip()) < 2:
+        return
+    name = child_name.strip()
+    draft = story_draft.model_dump()
+    # 영어 필드의 로마자 이름은 자리표시자로 바꿀 수 없어 다른 아이의 그림 프롬프트에 그대로 남으므로 저장하지 않음
+    if _mentions_name_in_english(draft, name):
+        logger.info(f"📝 [Draft Template] 영어 필드에 이름이 들어 있어 템플릿으로 저장하지 않습니다: {key}")
+        return
+    # 키에는 주인공의 성별이 없으므로, 'a little boy'로 그린 캐릭터 설정이 다른 아이에게 쓰이지 않도록 저장하지 않음
+    if _mentions_gender_in_english(draft):
+        logger.info(f"📝 [Draft Template] 영어 필드에 주인공의 성별이 드러나 있어 템플릿으로 저장하지 않습니다: {key}")
+        return
+    template = _map_strings(draft, lambda text: _to_template(text, name))
+    # 다른 낱말 속에 이름이 남아 있으면(예: '하민준') 다른 아이에게 그대로 보일 수 있으므로 포기
+    if _contains(template, name):
+        logger.info(f"📝 [Draft Template] 이름을 모두 바꿀 수 없어 템플릿으로 저장하지 않습니다: {key}")
+        return
+
+    with _lock:
+        variants = _templates.setdefault(key, [])
+        if len(variants) >= max(1, DRAFT_TEMPLATE_VARIANTS):
+            return
+        variants.append(template)
+        count = len(variants)
+    if DRAFT_TEMPLATE_PATH:
+        await asyncio.to_thread(_append_template, key, template)
+    logger.info(f"📝 [Draft Template] 대본 템플릿 저장 ({count}/{DRAFT_TEMPLATE_VARIANTS}): {key}")
+
+
+_load_templates()
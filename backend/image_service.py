@@ -0,0 +1,107 @@
+import io
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, features
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 0. 후처리 설정 (포맷 / 크기 / 화질)
+# ==========================================
+IMAGE_VARIANTS_ENABLED = os.getenv("IMAGE_VARIANTS_ENABLED", "true").lower() == "true"
+IMAGE_VARIANT_FORMATS = [f.strip() for f in os.getenv("IMAGE_VARIANT_FORMATS", "webp,avif").split(",") if f.strip()]
+IMAGE_VARIANT_SIZES = [int(s) for s in os.getenv("IMAGE_VARIANT_SIZES", "256,512").split(",") if s.strip()]
+IMAGE_POSTPROCESS_WORKERS = int(os.getenv("IMAGE_POSTPROCESS_WORKERS", "2"))
+
+# 포맷 이름 → (Pillow 포맷, 확장자, Content-Type, 인코딩 옵션)
+# AVIF는 같은 숫자라도 WebP보다 화질 척도가 높게 잡혀 있어 따로 설정하고, 인코딩 속도를 올려 CPU 시간을 줄입니다.
+VARIANT_FORMATS = {
+    "webp": ("WEBP", ".webp", "image/webp", {"quality": int(os.getenv("IMAGE_WEBP_QUALITY", "80")), "method": 4}),
+    "avif": ("AVIF", ".avif", "image/avif", {"quality": int(os.getenv("IMAGE_AVIF_QUALITY", "55")), "speed": 8}),
+}
+
+_executor: ProcessPoolExecutor = None
+_formats = []  # 실제로 인코딩 가능한 포맷 (워커 풀을 띄울 때 확인)
+
+
+def _supported_formats() -> list:
+    """설치된 Pillow가 인코딩할 수 있는 포맷만 남깁니다. (예: AVIF 미지원 빌드)"""
+    supported = []
+    for name in IMAGE_VARIANT_FORMATS:
+        if name in VARIANT_FORMATS and features.check(name):
+            supported.append(name)
+        else:
+            logger.warning(f"⚠️ [이미지 후처리] '{name}' 포맷은 지원하지 않아 건너뜁니다.")
+    return supported
+
+
+# ==========================================
+# 1. 변환 작업 (별도 프로세스에서 실행)
+# ==========================================
+def _transcode(png_bytes: bytes, formats: list, sizes: list) -> dict:
+    """
+    PNG 원본을 포맷별 원본 크기 + 지정한 크기(가로 기준) 썸네일로 변환합니다.
+    반환: {"webp": (bytes, ext, content_type), "webp_512": ..., "avif_256": ...}
+    """
+    variants = {}
+    with Image.open(io.BytesIO(png_bytes)) as original:
+        original = original.convert("RGB")
+        targets = [(None, original)]
+        for size in sizes:
+            if size < original.width:
+                resized = original.resize((size, round(original.height * size / original.width)), Image.LANCZOS)
+                targets.append((size, resized))
+
+        for name in formats:
+            pil_format, ext, content_type, options = VARIANT_FORMATS[name]
+            for size, image in targets:
+                buffer = io.BytesIO()
+                image.save(buffer, format=pil_format, **options)
+                key = name if size is None else f"{name}_{size}"
+                variants[key] = (buffer.getvalue(), ext, content_type)
+    return variants
+
+
+# ==========================================
+# 2. 비동기 진입점 (이벤트 루프는 기다리기만 함)
+# ==========================================
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor, _formats
+    if _executor is None:
+        # 이미 스레드가 떠 있는 서버 프로세스를 fork하지 않도록 spawn 방식으로 워커를 띄웁니다.
+        _executor = ProcessPoolExecutor(
+            max_workers=IMAGE_POSTPROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        _formats = _supported_formats()
+    return _executor
+
+
+async def make_variants(png_bytes: bytes) -> dict:
+    """씬 PNG로 WebP/AVIF 및 256/512px 변형을 만들어 돌려줍니다. 꺼져 있거나 실패하면 빈 딕셔너리."""
+    if not IMAGE_VARIANTS_ENABLED or not png_bytes:
+        return {}
+    try:
+        executor = _get_executor()
+        if not _formats:
+            return {}
+        loop = asyncio.get_running_loop()
+        with telemetry.span("image.variants"):
+            return await loop.run_in_executor(
+                executor, _transcode, png_bytes, _formats, IMAGE_VARIANT_SIZES
+            )
+    except Exception as e:
+        logger.error(f"❌ [이미지 후처리] 변환 실패: {e}")
+        return {}
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,166 @@
+import os
+import asyncio
+import logging
+import time
+import uuid
+from fastapi import HTTPException
+
+from schemas import GenerateRequest
+from pipeline_service import PipelineProgress, REPLAY_WINDOW_SECONDS, request_fingerprint, run_story_pipeline_once
+from model_scheduler import BATCH, current_priority
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 0. 작업(Job) 모드 설정
+# ==========================================
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))             # 동시에 돌아가는 파이프라인 수
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))     # 대기열에 쌓아둘 수 있는 최대 주문 수
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))  # 끝난 작업 결과를 보관하는 시간
+
+
+class Job:
+    """백그라운드에서 처리 중인 동화 생성 주문 1건"""
+
+    def __init__(self, req: GenerateRequest, idempotency_key: str = None):
+        self.job_id = uuid.uuid4().hex
+        self.request = req
+        self.idempotency_key = idempotency_key
+        self.fingerprint = request_fingerprint(req, idempotency_key)
+        self.status = "queued"  # queued → running → succeeded / failed
+        self.progress = PipelineProgress()
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            **self.progress.to_dict(),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "story": self.result,
+        }
+
+
+_jobs = {}  # {job_id: Job}
+_jobs_by_fingerprint = {}  # {요청 지문: Job} - 중복 주문을 같은 작업에 합치기 위함
+_queue: asyncio.Queue = None
+_workers = []
+
+
+# ==========================================
+# 1. 주문 접수 & 상태 조회
+# ==========================================
+def _find_duplicate(fingerprint: str) -> Job:
+    """같은 주문이 진행 중이거나 재전송 창 안에 성공했다면 그 작업을 돌려줍니다."""
+    job = _jobs_by_fingerprint.get(fingerprint)
+    if job is None or job.status == "failed":
+        return None
+    if job.status == "succeeded" and time.time() - job.finished_at > REPLAY_WINDOW_SECONDS:
+        return None
+    return job
+
+def submit_job(req: GenerateRequest, idempotency_key: str = None) -> Job:
+    """주문을 대기열에 넣고 곧바로 Job을 돌려줍니다. 대기열이 꽉 차면 503을 던집니다."""
+    if _queue is None:
+        raise HTTPException(status_code=503, detail="작업 워커가 아직 준비되지 않았습니다.")
+
+    _prune_finished_jobs()
+    job = Job(req, idempotency_key)
+    duplicate = _find_duplicate(job.fingerprint)
+    if duplicate is not None:
+        logger.info(f"🔗 [Job] 같은 주문 → 기존 작업에 합류: {duplicate.job_id}")
+        return duplicate
+
+    try:
+        _queue.put_nowait(job)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="대기 중인 주문이 너무 많습니다. 잠시 후 다시 시도해주세요.")
+
+    _jobs[job.job_id] = job
+    _jobs_by_fingerprint[job.fingerprint] = job
+    logger.info(f"🧾 [Job] 주문 접수: {job.job_id} (대기열 {_queue.qsize()}/{JOB_QUEUE_SIZE})")
+    return job
+
+
+def retry_job(job_id: str) -> Job:
+    """
+    실패한 작업을 같은 주문으로 다시 대기열에 넣습니다.
+    주문 지문이 같으므로 파이프라인은 체크포인트에 남은 단계(대본, 캐릭터 시트, 끝난 씬)를 건너뛰고 이어서 진행합니다.
+    (CHECKPOINT_DIR이 비어 있으면 남은 기록이 없으므로 처음부터 다시 만듭니다.)
+    """
+    job = get_job(job_id)
+    if job.status != "failed":
+        raise HTTPException(status_code=409, detail=f"실패한 작업만 재시도할 수 있습니다. (현재: {job.status})")
+    return submit_job(job.request, job.idempotency_key)
+
+
+def get_job(job_id: str) -> Job:
+    job = _jobs.get(job_id)
+    if job is None:
+        raise ValueError(f"Job not found: {job_id}")
+    return job
+
+
+def queue_depth() -> int:
+    """워커를 기다리는 주문 수"""
+    return _queue.qsize() if _queue is not None else 0
+
+
+def _prune_finished_jobs():
+    """보관 기간이 지난 완료/실패 작업을 메모리에서 정리합니다."""
+    now = time.time()
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job.finished_at and now - job.finished_at > JOB_TTL_SECONDS
+    ]
+    for job_id in expired:
+        job = _jobs.pop(job_id)
+        if _jobs_by_fingerprint.get(job.fingerprint) is job:
+            del _jobs_by_fingerprint[job.fingerprint]
+
+
+# ==========================================
+# 2. 백그라운드 워커 (프로세스 내 고정 개수)
+# ==========================================
+async def _worker(worker_no: int):
+    # 백그라운드 작업은 결과를 기다리는 화면이 없으므로 배치 차선으로 모델을 호출해 대화형 요청(/generate)에 양보합니다.
+    # (워커 Task 안에서 정해 두면 이 워커가 띄우는 파이프라인 Task가 그대로 물려받음)
+    current_priority.set(BATCH)
+    while True:
+        job = await _queue.get()
+        job.status = "running"
+        logger.info(f"👷 [Worker {worker_no}] 작업 시작: {job.job_id}")
+        try:
+            # 이미 작업 대기열에서 기다린 주문이므로 입장 제한에 걸려도 거절하지 않고 자리가 날 때까지 기다림
+            job.result = await run_story_pipeline_once(job.request, job.idempotency_key, job.progress, wait_when_busy=True)
+            job.status = "succeeded"
+        except HTTPException as e:
+            job.status = "failed"
+            job.error = e.detail
+        except Exception as e:
+            logger.error(f"❌ [Worker {worker_no}] 작업 실패 ({job.job_id}): {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            _queue.task_done()
+
+
+def start_workers():
+    global _queue
+    _queue = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+    for worker_no in range(1, JOB_WORKERS + 1):
+        _workers.append(asyncio.create_task(_worker(worker_no)))
+    logger.info(f"🏭 [Job] 백그라운드 워커 {JOB_WORKERS}개 가동")
+
+
+async def stop_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
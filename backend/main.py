@@ -1,7 +1,12 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, RedirectResponse
+from contextlib import asynccontextmanager
 
 from pydantic import BaseModel
+import os
+import hmac
+import json
 import asyncio
 import logging
 
@@ -11,10 +16,48 @@ logger = logging.getLogger(__name__)
 
 # 우리가 만든 모듈들 불러오기
 from schemas import GenerateRequest
+import admission_service
 import ai_service
+import checkpoint_service
 import db_service
-
-app = FastAPI()
+import image_service
+import pdf_service
+import pipeline_service
+import job_service
+import telemetry
+
+# 관리용 엔드포인트(캐시 비우기 등)에 X-Admin-Token 헤더로 넘겨야 하는 값. 비어 있으면 관리용 엔드포인트를 막음
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def _require_admin(token: str):
+    if not ADMIN_TOKEN or not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="관리자 토큰이 필요합니다.")
+
+# /metrics를 읽을 때마다 현재 값으로 채우는 게이지 (호출 스케줄러 / 작업 대기열)
+OPENAI_IN_FLIGHT = telemetry.Gauge("openai_in_flight", "OpenAI calls currently running", ("model",))
+OPENAI_QUEUED = telemetry.Gauge("openai_queued", "OpenAI calls waiting for a scheduler slot", ("model", "lane"))
+JOB_QUEUE_DEPTH = telemetry.Gauge("job_queue_depth", "Background jobs waiting for a worker")
+ADMISSION_QUEUED = telemetry.Gauge("admission_queued", "Generate requests waiting for a pipeline slot")
+ADMISSION_RESERVED_BYTES = telemetry.Gauge("admission_reserved_bytes", "Media bytes reserved by running pipelines")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 서버가 켜질 때 교재 캐시를 데우고 백그라운드 워커를 띄우며, 꺼질 때 정리합니다.
+    try:
+        await asyncio.to_thread(db_service.warm_curriculum_cache)
+    except Exception as e:
+        logger.error(f"❌ 교재 캐시 준비 실패 (요청 시 DB에서 직접 조회합니다): {e}")
+    await asyncio.to_thread(checkpoint_service.prune_stale)
+    # 한글 글꼴이 없으면 여기서 한 번 경고하고, PDF는 만들지 않습니다 (깨진 글자로 된 PDF를 올리지 않음)
+    await asyncio.to_thread(pdf_service.font_path)
+    job_service.start_workers()
+    yield
+    await job_service.stop_workers()
+    await db_service.close_http_client()
+    image_service.shutdown()
+    pdf_service.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS 설정
 app.add_middleware(
@@ -26,131 +69,160 @@ app.add_middleware(
 )
 
 @app.post("/generate")
-async def generate_story(req: GenerateRequest):
-    logger.info(f"\n=============================================")
-    logger.info(f"📥 [주문 접수] 아이: {req.child_name}, 감정: {req.emotion}, 진도: {req.stage_code}")
-    logger.info(f"=============================================")
-    
-    # ----------------------------------------------------
-    # Step 1. 창고에서 교재 텍스트 꺼내오기
-    # ----------------------------------------------------
+async def generate_story(req: GenerateRequest, background: bool = False, idempotency_key: str = Header(None)):
+    """
+    background=true 이면 작업 ID만 즉시 돌려주고, 실제 생성은 백그라운드 워커가 맡습니다.
+    같은 바디(+ Idempotency-Key 헤더)의 중복 주문은 진행 중인 실행에 합류하거나 저장된 결과를 돌려받습니다.
+    동시 실행 수나 미디어 메모리 예산이 꽉 차면 잠시 줄을 서고, 대기열도 꽉 차면 429(Retry-After)를 돌려줍니다.
+    """
+    if background:
+        job = job_service.submit_job(req, idempotency_key)
+        return JSONResponse(
+            status_code=202,
+            content={"job_id": job.job_id, "status": job.status, "status_url": f"/jobs/{job.job_id}"},
+        )
+
+    return await pipeline_service.run_story_pipeline_once(req, idempotency_key)
+
+@app.post("/generate/stream")
+async def generate_story_stream(req: GenerateRequest, format: str = "ndjson", idempotency_key: str = Header(None)):
+    """
+    /generate의 스트리밍 버전. 대본이 나오면 제목/요약을, 씬 그림·음성이 업로드될 때마다 URL을,
+    마지막에 story_id가 담긴 최종 결과를 한 줄씩(NDJSON) 또는 SSE(format=sse)로 보내줍니다.
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format은 'ndjson' 또는 'sse'만 가능합니다.")
+
+    # 자리가 없으면 스트림을 열기 전에 429로 응답
+    events = pipeline_service.stream_story_pipeline(req, idempotency_key)
+
+    async def event_lines():
+        async for event, data in events:
+            payload = json.dumps(data, ensure_ascii=False)
+            if format == "sse":
+                yield f"event: {event}\ndata: {payload}\n\n"
+            else:
+                yield f'{{"event": "{event}", "data": {payload}}}\n'
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(event_lines(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """백그라운드 작업의 현재 Step, 씬별 진행 상황, 완성된 동화책을 조회합니다."""
     try:
-        curriculum_title, source_text = db_service.get_curriculum(req.stage_code)
-        logger.info(f"✅ [Step 1] DB 조회 성공: {curriculum_title}")
+        return job_service.get_job(job_id).to_dict()
     except Exception as e:
-        logger.error(f"❌ [Step 1] DB 조회 실패: {str(e)}")
         raise HTTPException(status_code=404, detail=str(e))
 
+@app.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: str):
+    """실패한 작업을 다시 실행합니다. 체크포인트가 켜져 있으면 지난 실행에서 끝난 단계를 이어받습니다."""
+    try:
+        job = job_service.retry_job(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job.job_id, "status": job.status, "status_url": f"/jobs/{job.job_id}"},
+    )
+
+@app.get("/curriculums")
+async def get_curriculums(request: Request):
+    """프론트엔드 '진도 선택' 화면에 보여줄 교재 목록을 반환합니다. (If-None-Match가 같으면 304)"""
+    # 캐시에 있으면 바로, 없으면 DB 조회는 스레드에서 (이벤트 루프를 막지 않음)
+    cached = db_service.get_cached_curriculums()
+    curriculums, etag = cached if cached is not None else await asyncio.to_thread(db_service.get_all_curriculums_with_etag)
+    if etag is None:
+        return curriculums
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=curriculums, headers=headers)
+
+@app.post("/curriculums/cache/invalidate")
+async def invalidate_curriculums_cache(x_admin_token: str = Header(None)):
+    """교재 데이터를 수정한 뒤 호출해서 캐시를 비웁니다. (X-Admin-Token 헤더 필요)"""
+    _require_admin(x_admin_token)
+    db_service.invalidate_curriculum_cache()
+    return {"status": "ok"}
+
+@app.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """모델별 동시 호출 수, 우선순위 차선별 대기열 길이, 평균/최대 대기 시간, 재시도/429 횟수를 보여줍니다."""
+    return ai_service.scheduler.stats()
+
+@app.get("/admission/stats")
+async def get_admission_stats():
+    """입장 제한 설정값(동시 실행 수, 대기열, 메모리 예산)과 현재 실행/대기 수, 예상 대기 시간을 보여줍니다."""
+    return admission_service.controller.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 형식 지표: 단계별 지연 히스토그램, 단계별 실패 수, 동시 실행 중인 파이프라인 수 등"""
+    for model, stats in ai_service.scheduler.stats().items():
+        OPENAI_IN_FLIGHT.set(stats["in_flight"], model=model)
+        for lane, queued in stats["queued"].items():
+            OPENAI_QUEUED.set(queued, model=model, lane=lane)
+    JOB_QUEUE_DEPTH.set(job_service.queue_depth())
+    admission = admission_service.controller.stats()
+    ADMISSION_QUEUED.set(admission["queued"])
+    ADMISSION_RESERVED_BYTES.set(admission["reserved_bytes"])
+    return PlainTextResponse(telemetry.render_metrics(), media_type="text/plain; version=0.0.4")
+
+# 씬 재생성으로 내용이 바뀔 수 있으므로 보관은 하되 매번 ETag로 확인받게 합니다 (아이 정보가 있으니 private)
+STORY_CACHE_CONTROL = "private, no-cache"
 
-    # ----------------------------------------------------
-    # Step 2. GPT 요리사에게 텍스트 대본 및 프롬프트 맡기기
-    # ----------------------------------------------------
+@app.get("/stories/{story_id}")
+async def get_story(story_id: str, request: Request, view: str = "full"):
+    """ID로 동화책 상세 조회 (view=summary면 제목/표지 등 요약만). ETag가 같으면 304"""
     try:
-        story_draft = ai_service.generate_story_draft(
-            child_name=req.child_name,
-            age=req.age,
-            personality=req.personality,
-            emotion=req.emotion,
-            source_text=source_text
+        if view == "summary":
+            summary = await asyncio.to_thread(db_service.get_story_summary, story_id)
+            return JSONResponse(content=summary, headers={"Cache-Control": STORY_CACHE_CONTROL})
+        # 캐시 적중은 이벤트 루프에서 바로, 처음 읽는 동화책만 스레드에서 DB 조회
+        story, etag = db_service.get_cached_story(story_id) or await asyncio.to_thread(
+            db_service.get_story_with_etag, story_id
         )
-        logger.info(f"✅ [Step 2] 대본 생성 완료: {story_draft.title}")
     except Exception as e:
-        logger.error(f"❌ [Step 2] 대본 생성 실패: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"대본 생성 실패: {str(e)}")
+        raise HTTPException(status_code=404, detail=str(e))
 
+    headers = {"ETag": etag, "Cache-Control": STORY_CACHE_CONTROL}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=story, headers=headers)
 
-    # ----------------------------------------------------
-    # Step 3. 순차적 공장 가동! (일관성 있는 그림 + TTS 음성)
-    # ----------------------------------------------------
+@app.get("/stories/{story_id}/pdf")
+async def get_story_pdf(story_id: str):
+    """동화책 PDF. 미리 만들어 둔 파일이 있으면 창고 URL로 바로 보내고, 없으면 지금 만들어서 보냅니다."""
+    if not pdf_service.available():
+        raise HTTPException(status_code=503, detail="PDF용 한글 글꼴이 설정되지 않아 PDF를 만들 수 없습니다.")
     try:
-        # 기존 parallel 대신 sequential 함수 호출
-        raw_media_results = await ai_service.generate_all_media_sequential(story_draft)
-        logger.info(f"✅ [Step 3] 미디어 생성 완료 (총 {len(raw_media_results)}개 파일)")
+        story, etag = db_service.get_cached_story(story_id) or await asyncio.to_thread(
+            db_service.get_story_with_etag, story_id
+        )
     except Exception as e:
-        logger.error(f"❌ [Step 3] 미디어 생성 실패: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"미디어 생성 실패: {str(e)}")
-
-
-    # ----------------------------------------------------
-    # Step 4. 생성된 파일들을 Supabase 창고에 업로드 
-    # ----------------------------------------------------
-    logger.info("\n📦 [Step 4] 생성된 파일들을 Supabase 창고에 안전하게 순서대로 업로드합니다...")
-    
-    upload_results = []
-    for item in raw_media_results:
-        scene_no = item["scene_no"]
-        m_type = item["type"]
-        data = item["data"] # 여기서는 이제 둘 다 bytes 데이터임!
-
-        # 데이터가 없으면 패스
-        if not data:
-            continue
-            
-        try:
-            if m_type == "image":
-                # 순차 생성된 이미지는 로컬 임시파일/Bytes 상태이므로 직접 업로드
-                perm_url = db_service.upload_to_supabase(data, ".png", "image/png")
-                upload_results.append((scene_no, "image_url", perm_url))
-                logger.info(f"   -> 🎨 {scene_no}번 씬 [그림] 업로드 완료!")
-                
-            elif m_type == "audio":
-                # 오디오도 Bytes 상태이므로 직접 업로드
-                perm_url = db_service.upload_to_supabase(data, ".mp3", "audio/mpeg")
-                upload_results.append((scene_no, "audio_url", perm_url))
-                logger.info(f"   -> 🎵 {scene_no}번 씬 [음성] 업로드 완료!")
-        except Exception as e:
-            logger.error(f"❌ [Step 4] 업로드 중 에러 발생 (씬 {scene_no}, {m_type}): {e}")
-
-    logger.info("✅ [Step 4] 창고 업로드 완벽 종료!")
-
-
-    # ----------------------------------------------------
-    # Step 5. 최종 JSON 조립 및 DB 저장
-    # ----------------------------------------------------
-    logger.info("\n🎁 [Step 5] 최종 JSON 조립 및 DB 저장 중...")
-    
-    final_scenes = []
-    for scene in story_draft.scenes:
-        scene_dict = scene.model_dump() 
-        for res in upload_results:
-            if res[0] == scene.scene_no:
-                scene_dict[res[1]] = res[2] 
-        final_scenes.append(scene_dict)
-
-    story_id = db_service.save_final_story(
-        user_id=req.user_id,  
-        stage_code=req.stage_code,
-        emotion=req.emotion,
-        title=story_draft.title,
-        scenes_dict=final_scenes
-    )
-
-    # ----------------------------------------------------
-    # Step 6. 프론트엔드로 배달! (Output)
-    # ----------------------------------------------------
-    logger.info("🎉 모든 작업 완료! 프론트엔드로 데이터를 발송합니다.\n")
-    return {
-        "story_id": story_id,
-        "title": story_draft.title,
-        "summary": story_draft.summary,
-        "created_at": "Just now", # 실제로는 DB의 created_at을 써도 됩니다.
-        "pdf_url": "https://[PDF기능은_나중에_추가_예정].pdf",
-        "scenes": final_scenes
-    }
+        raise HTTPException(status_code=404, detail=str(e))
 
-@app.get("/curriculums")
-async def get_curriculums():
-    """프론트엔드 '진도 선택' 화면에 보여줄 교재 목록을 반환합니다."""
-    return db_service.get_all_curriculums()
+    pdf_url = await pdf_service.get_pdf_url(story, etag)
+    if not pdf_url:
+        raise HTTPException(status_code=503, detail="PDF를 만들지 못했습니다. 잠시 후 다시 시도해 주세요.")
+    # 씬을 재생성하면 PDF 파일 이름이 바뀌므로 리다이렉트 자체는 매번 확인받게 합니다.
+    return RedirectResponse(pdf_url, status_code=307, headers={"Cache-Control": STORY_CACHE_CONTROL})
 
-@app.get("/stories/{story_id}")
-async def get_story(story_id: str):
-    """ID로 동화책 상세 조회"""
+@app.get("/users/{user_id}/stories")
+async def list_user_stories(user_id: str, limit: int = 20, cursor: str = None):
+    """아이의 동화책 요약 목록 (최신순). 응답의 next_cursor를 다음 요청의 cursor로 넘기면 다음 페이지"""
     try:
-        story = db_service.get_story_by_id(story_id)
-        return story
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=str(e))
+        return await asyncio.to_thread(db_service.list_user_stories, user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/stories/{story_id}/scenes/{scene_no}/regenerate")
+async def regenerate_scene(story_id: str, scene_no: int):
+    """씬 하나의 그림과 음성만 다시 만들어 교체합니다. 캐릭터 시트와 앞 씬 그림을 기준으로 그려 나머지 씬과 어울리게 합니다. (CHECKPOINT_DIR 필요, 없으면 501)"""
+    return await pipeline_service.regenerate_scene(story_id, scene_no)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,231 @@
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+import contextvars
+from email.utils import parsedate_to_datetime
+import openai
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 0. 우선순위 차선 (대화형 요청이 배치 작업보다 먼저)
+# ==========================================
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# 현재 실행 흐름의 우선순위. asyncio Task는 만들어질 때의 값을 물려받습니다.
+current_priority = contextvars.ContextVar("current_priority", default=INTERACTIVE)
+
+# 잠깐 기다리면 풀리는 오류들 (429 / 5xx / 네트워크)
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+
+# ==========================================
+# 1. 토큰 버킷 (분당 요청 수 / 분당 토큰 수)
+# ==========================================
+class TokenBucket:
+    """분당 per_minute 만큼 채워지는 양동이. per_minute가 0이면 제한 없음."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: int) -> float:
+        """amount만큼 꺼낼 수 있을 때까지 남은 시간(초)"""
+        if not self.capacity:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def take(self, amount: int):
+        if self.capacity:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+
+
+# ==========================================
+# 2. 모델별 대기열 상태
+# ==========================================
+class _ModelState:
+    def __init__(self, concurrency: int, rpm: int, tpm: int):
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.cooldown_until = 0.0  # 429를 받으면 이 시각까지 새 요청을 내보내지 않음
+        self.waiters = []  # heap: (우선순위, 순번, future, 토큰 수, 대기 시작 시각)
+        self.timer = None
+        # 통계
+        self.granted = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+# ==========================================
+# 3. 프로세스 전체 스케줄러
+# ==========================================
+class ModelScheduler:
+    """
+    모델별로 동시 호출 수 + 분당 요청/토큰 양동이를 지키면서 호출을 내보내는 스케줄러입니다.
+    대기 중에는 우선순위(대화형 → 배치) 순서로 자리를 배정하고,
+    429/5xx/네트워크 오류는 Retry-After를 존중하는 지터 지수 백오프로 재시도합니다.
+    """
+
+    def __init__(self, default_concurrency: int, concurrency: dict = None, rate_limits: dict = None,
+                 max_attempts: int = 4, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.default_concurrency = default_concurrency
+        self.concurrency = concurrency or {}
+        self.rate_limits = rate_limits or {}  # {model: (rpm, tpm)}
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._models = {}
+        self._seq = itertools.count()
+
+    def _state(self, model: str) -> _ModelState:
+        if model not in self._models:
+            rpm, tpm = self.rate_limits.get(model, (0, 0))
+            self._models[model] = _ModelState(self.concurrency.get(model, self.default_concurrency), rpm, tpm)
+        return self._models[model]
+
+    # ------------------------------------------
+    # 자리 배정
+    # ------------------------------------------
+    def _pump(self, model: str):
+        state = self._state(model)
+        state.timer = None
+        while state.waiters and state.in_flight < state.concurrency:
+            _, _, future, tokens, enqueued_at = state.waiters[0]
+            if future.done():  # 기다리다 취소된 요청
+                heapq.heappop(state.waiters)
+                continue
+
+            wait = max(
+                state.cooldown_until - time.monotonic(),
+                state.requests.wait_time(1),
+                state.tokens.wait_time(tokens),
+            )
+            if wait > 0:
+                state.timer = asyncio.get_running_loop().call_later(wait, self._pump, model)
+                return
+
+            heapq.heappop(state.waiters)
+            state.requests.take(1)
+            state.tokens.take(tokens)
+            state.in_flight += 1
+            state.granted += 1
+            waited = time.monotonic() - enqueued_at
+            state.total_wait += waited
+            state.max_wait = max(state.max_wait, waited)
+            future.set_result(waited)
+
+    async def _acquire(self, model: str, tokens: int):
+        state = self._state(model)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(state.waiters, (current_priority.get(), next(self._seq), future, tokens, time.monotonic()))
+        if state.timer is None:
+            self._pump(model)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # 자리를 받은 직후 취소됐다면 자리를 돌려줍니다.
+            if future.done() and not future.cancelled():
+                self._release(model)
+            raise
+
+    def _release(self, model: str):
+        state = self._state(model)
+        state.in_flight -= 1
+        if state.timer is None:
+            self._pump(model)
+
+    # ------------------------------------------
+    # 재시도
+    # ------------------------------------------
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        response = getattr(error, "response", None)
+        headers = response.headers if response is not None else {}
+        if headers.get("retry-after-ms"):
+            try:
+                return float(headers["retry-after-ms"]) / 1000
+            except ValueError:
+                pass
+        if headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                try:
+                    return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+        # Full jitter: 0 ~ min(최대, 기본 * 2^(n-1)) 사이에서 무작위
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def call(self, model: str, make_call, tokens: int = 1, label: str = ""):
+        """make_call()로 만든 API 호출을 자리가 날 때 실행하고, 일시적 오류는 재시도합니다."""
+        state = self._state(model)
+        for attempt in range(1, self.max_attempts + 1):
+            waited = await self._acquire(model, tokens)
+            # 지금 열려 있는 span(예: openai.image_edit)에 자리 대기 시간 / 시도 횟수를 남깁니다.
+            telemetry.annotate(queue_wait_ms=round(waited * 1000), attempts=attempt)
+            try:
+                return await make_call()
+            except RETRYABLE_ERRORS as e:
+                # 크레딧 소진은 기다려도 풀리지 않으므로 바로 포기
+                if getattr(e, "code", None) == "insufficient_quota" or attempt == self.max_attempts:
+                    state.failures += 1
+                    raise
+                delay = self._retry_delay(e, attempt)
+                state.retries += 1
+                if isinstance(e, openai.RateLimitError):
+                    state.rate_limited += 1
+                    state.cooldown_until = max(state.cooldown_until, time.monotonic() + delay)
+                logger.warning(f"⚠️ [{model}] {label} 재시도 {attempt}/{self.max_attempts - 1} ({type(e).__name__}), {delay:.1f}초 후")
+            except Exception:
+                state.failures += 1
+                raise
+            finally:
+                self._release(model)
+            await asyncio.sleep(delay)
+
+    # ------------------------------------------
+    # 통계 (대기열 길이 / 대기 시간)
+    # ------------------------------------------
+    def stats(self) -> dict:
+        result = {}
+        for model, state in self._models.items():
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _, future, _, _ in state.waiters:
+                if not future.done():
+                    queued[PRIORITY_NAMES.get(priority, str(priority))] += 1
+            result[model] = {
+                "concurrency": state.concurrency,
+                "in_flight": state.in_flight,
+                "queued": queued,
+                "granted": state.granted,
+                "retries": state.retries,
+                "rate_limited": state.rate_limited,
+                "failures": state.failures,
+                "avg_wait_ms": round(state.total_wait / state.granted * 1000, 1) if state.granted else 0.0,
+                "max_wait_ms": round(state.max_wait * 1000, 1),
+                "cooldown_ms": round(max(0.0, state.cooldown_until - time.monotonic()) * 1000),
+            }
+        return result
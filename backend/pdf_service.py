@@ -0,0 +1,361 @@
+import io
+import os
+import asyncio
+import hashlib
+import logging
+import functools
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw, ImageFont
+
+import db_service
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 0. PDF 설정 (판형 / 글꼴 / 워커 수)
+# ==========================================
+PDF_ENABLED = os.getenv("PDF_ENABLED", "true").lower() == "true"
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "1"))
+PDF_DPI = int(os.getenv("PDF_DPI", "150"))
+PDF_JPEG_QUALITY = int(os.getenv("PDF_JPEG_QUALITY", "85"))
+# 한글 글꼴(TTF/OTF/TTC) 경로. 비우면 흔한 설치 위치에서 찾고, 한글을 찍을 수 있는 글꼴이 없으면 PDF를 만들지 않습니다.
+PDF_FONT_PATH = os.getenv("PDF_FONT_PATH", "")
+# PDF_FONT_PATH가 비었을 때 차례로 찾아볼 위치 (fonts-noto-cjk / fonts-nanum / macOS / Windows)
+PDF_FONT_CANDIDATES = (
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/nanum/NanumGothic.ttf",
+    "/System/Library/Fonts/AppleSDGothicNeo.ttc",
+    "C:/Windows/Fonts/malgun.ttf",
+)
+# 업로드 중에 미리 그려 둘 페이지 수 (메모리에는 이만큼의 JPEG 페이지만 머무름)
+PDF_RENDER_AHEAD = int(os.getenv("PDF_RENDER_AHEAD", "2"))
+
+PAGE_POINTS = (595, 842)  # A4 (1pt = 1/72인치)
+PAGE_PX = tuple(round(points * PDF_DPI / 72) for points in PAGE_POINTS)
+
+_executor: ProcessPoolExecutor = None
+_renders = {}  # {창고 파일 이름: 렌더링 중인 Task} - 같은 동화책의 PDF는 한 번만 만듦
+_background = set()  # 저장 직후 띄운 렌더링 Task (GC 방지)
+
+
+# ==========================================
+# 1. 페이지 그리기 (별도 프로세스에서 실행)
+# ==========================================
+def _supports_hangul(path: str) -> bool:
+    """글꼴을 열 수 있고 '가'와 '힣'이 서로 다른 글리프로 찍히는지 (한글이 없으면 둘 다 같은 빈 네모)"""
+    try:
+        font = ImageFont.truetype(path, 24)
+    except OSError:
+        return False
+    first, last = font.getmask("가"), font.getmask("힣")
+    return bool(font.getbbox("가")) and (first.size, bytes(first)) != (last.size, bytes(last))
+
+
+@functools.lru_cache(maxsize=1)
+def font_path() -> str:
+    """PDF에 쓸 한글 글꼴 경로. 없으면 빈 문자열 (이때는 깨진 글자로 PDF를 만들지 않고 건너뜁니다)"""
+    candidates = (PDF_FONT_PATH,) if PDF_FONT_PATH else PDF_FONT_CANDIDATES
+    for path in candidates:
+        if os.path.exists(path) and _supports_hangul(path):
+            return path
+    if PDF_FONT_PATH:
+        logger.warning(f"⚠️ [PDF] PDF_FONT_PATH '{PDF_FONT_PATH}'로 한글을 찍을 수 없어 PDF를 만들지 않습니다.")
+    else:
+        logger.warning("⚠️ [PDF] 한글 글꼴을 찾지 못해 PDF를 만들지 않습니다. PDF_FONT_PATH에 한글 글꼴을 지정하세요.")
+    return ""
+
+
+def available() -> bool:
+    return bool(font_path())
+
+
+@functools.lru_cache(maxsize=16)
+def _font(path: str, size: int):
+    return ImageFont.truetype(path, size)
+
+
+def _wrap(draw: ImageDraw.ImageDraw, text: str, font, width: int) -> list:
+    """단어 단위로 줄을 나누고, 한 단어가 한 줄보다 길면 글자 단위로 자릅니다."""
+    lines = []
+    for paragraph in text.splitlines() or [""]:
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if draw.textlength(candidate, font=font) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            line = ""
+            for char in word:
+                if draw.textlength(line + char, font=font) > width and line:
+                    lines.append(line)
+                    line = ""
+                line += char
+        lines.append(line)
+    return lines
+
+
+def _draw_text(draw: ImageDraw.ImageDraw, text: str, font, top: int, margin: int, align_center: bool = False) -> int:
+    """top부터 줄바꿈한 글을 찍고 다음 줄의 y를 돌려줍니다."""
+    width = PAGE_PX[0] - margin * 2
+    line_height = round(font.size * 1.5)
+    for line in _wrap(draw, text, font, width):
+        left = margin + (width - draw.textlength(line, font=font)) / 2 if align_center else margin
+        draw.text((left, top), line, fill=(40, 40, 40), font=font)
+        top += line_height
+    return top
+
+
+def _paste_image(page: Image.Image, image_bytes: bytes, top: int, max_height: int, margin: int) -> int:
+    """삽화를 가로 여백에 맞춰(세로 최대 max_height) 가운데에 붙이고 아래 끝 y를 돌려줍니다."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((PAGE_PX[0] - margin * 2, max_height), Image.LANCZOS)
+        page.paste(image, ((PAGE_PX[0] - image.width) // 2, top))
+        return top + image.height
+
+
+def _render_page(page_spec: dict, image_bytes: bytes, font_file: str) -> bytes:
+    """
+    페이지 1장을 그려 JPEG 바이트로 돌려줍니다.
+    page_spec: {"kind": "title" / "scene" / "quiz" / "answers", ...}
+    (title: 제목+표지 그림, scene: 대사, quiz: 번호+질문+답 칸, answers: 마지막 정답 페이지)
+    """
+    page = Image.new("RGB", PAGE_PX, (255, 253, 247))
+    draw = ImageDraw.Draw(page)
+    margin = PAGE_PX[0] // 12
+    top = margin
+    kind = page_spec["kind"]
+    font = functools.partial(_font, font_file)
+
+    if kind == "title":
+        top = _draw_text(draw, page_spec["title"], font(PAGE_PX[0] // 16), top, margin, align_center=True)
+        top += margin // 2
+        if image_bytes:
+            _paste_image(page, image_bytes, top, PAGE_PX[1] // 2, margin)
+    elif kind == "scene":
+        if image_bytes:
+            top = _paste_image(page, image_bytes, top, PAGE_PX[1] * 3 // 5, margin) + margin // 2
+        _draw_text(draw, page_spec["text"], font(PAGE_PX[0] // 30), top, margin)
+    elif kind == "quiz":
+        heading = f"퀴즈 {page_spec['number']}"
+        top = _draw_text(draw, heading, font(PAGE_PX[0] // 18), top, margin, align_center=True) + margin // 2
+        top = _draw_text(draw, page_spec["question"], font(PAGE_PX[0] // 28), top, margin) + margin
+        draw.rectangle((margin, top, PAGE_PX[0] - margin, top + PAGE_PX[1] // 8), outline=(180, 170, 150), width=3)
+    else:
+        # 정답은 퀴즈 바로 아래가 아니라 책 맨 끝에 모아 둠 (풀기 전에 보이지 않게)
+        top = _draw_text(draw, "정답", font(PAGE_PX[0] // 18), top, margin, align_center=True) + margin // 2
+        answer_font = font(PAGE_PX[0] // 30)
+        for number, answer in page_spec["answers"]:
+            top = _draw_text(draw, f"퀴즈 {number}. {answer}", answer_font, top, margin) + margin // 4
+
+    buffer = io.BytesIO()
+    page.save(buffer, format="JPEG", quality=PDF_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+# ==========================================
+# 2. PDF 조립 (페이지를 받는 대로 바이트를 흘려보냄)
+# ==========================================
+class PdfWriter:
+    """
+    페이지마다 전면 JPEG 그림 하나로 된 PDF를 앞에서부터 순서대로 씁니다.
+    페이지 수만 미리 알면 되므로 전체 파일을 메모리에 들고 있지 않고 조각(bytes)으로 내보낼 수 있습니다.
+    객체 번호: 1 Catalog, 2 Pages, 페이지 i마다 (Page, Contents, Image) = 3+3i, 4+3i, 5+3i
+    """
+
+    def __init__(self, page_count: int):
+        self.page_count = page_count
+        self.offsets = {}  # {객체 번호: 파일 내 위치} - 마지막 xref 표용
+        self.position = 0
+        self.pages_written = 0
+
+    def _object(self, number: int, body: bytes) -> bytes:
+        self.offsets[number] = self.position
+        data = f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+        self.position += len(data)
+        return data
+
+    def header(self) -> bytes:
+        data = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+        self.position += len(data)
+        kids = " ".join(f"{3 + 3 * i} 0 R" for i in range(self.page_count))
+        return (
+            data
+            + self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+            + self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {self.page_count} >>".encode())
+        )
+
+    def page(self, jpeg_bytes: bytes) -> bytes:
+        number = 3 + 3 * self.pages_written
+        self.pages_written += 1
+        width, height = PAGE_PX
+        page_w, page_h = PAGE_POINTS
+        content = f"q {page_w} 0 0 {page_h} 0 0 cm /Im0 Do Q".encode()
+        return (
+            self._object(number, (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_w} {page_h}] "
+                f"/Resources << /XObject << /Im0 {number + 2} 0 R >> >> /Contents {number + 1} 0 R >>"
+            ).encode())
+            + self._object(number + 1, f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream")
+            + self._object(number + 2, (
+                f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace /DeviceRGB "
+                f"/BitsPerComponent 8 /Filter /DCTDecode /Length {len(jpeg_bytes)} >>\nstream\n"
+            ).encode() + jpeg_bytes + b"\nendstream")
+        )
+
+    def trailer(self) -> bytes:
+        size = 3 + 3 * self.page_count
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        lines += [f"{self.offsets[number]:010d} 00000 n \n" for number in range(1, size)]
+        lines.append(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{self.position}\n%%EOF\n")
+        return "".join(lines).encode()
+
+
+def build_page_specs(story: dict) -> list:
+    """[(페이지 설명, 삽화 URL)] 표지 → 씬마다 (그림+대사) 페이지, 퀴즈가 있는 씬은 바로 뒤에 퀴즈 페이지 → 마지막에 정답 페이지"""
+    scenes = sorted(story.get("scenes") or [], key=lambda scene: scene.get("scene_no", 0))
+    cover_url = scenes[0].get("image_url", "") if scenes else ""
+    specs = [({"kind": "title", "title": story.get("title", "")}, cover_url)]
+    answers = []
+    for scene in scenes:
+        specs.append(({"kind": "scene", "text": scene.get("text", "")}, scene.get("image_url", "")))
+        quiz = scene.get("quiz")
+        if quiz:
+            number = len(answers) + 1
+            specs.append(({"kind": "quiz", "number": number, "question": quiz.get("question", "")}, ""))
+            answers.append((number, quiz.get("answer", "")))
+    if answers:
+        specs.append(({"kind": "answers", "answers": answers}, ""))
+    return specs
+
+
+# ==========================================
+# 3. 비동기 진입점 (렌더링 → 스트리밍 업로드 → 캐시)
+# ==========================================
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # 이미 스레드가 떠 있는 서버 프로세스를 fork하지 않도록 spawn 방식으로 워커를 띄웁니다.
+        _executor = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def pdf_object_name(story_id: str, etag: str) -> str:
+    """동화책 ID + 내용 ETag로 이름을 지어, 씬을 재생성하면 새 PDF를 만들고 아니면 같은 파일을 재사용합니다."""
+    version = hashlib.sha256(etag.encode("utf-8")).hexdigest()[:12]
+    return f"pdf/{story_id}-{version}.pdf"
+
+
+async def _render_chunks(story: dict):
+    """페이지를 PDF_RENDER_AHEAD장씩 미리 그려 두면서, 다 그려진 페이지부터 PDF 조각으로 내보냅니다."""
+    specs = build_page_specs(story)
+    writer = PdfWriter(len(specs))
+    font_file = font_path()
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    # 표지와 1번 씬처럼 같은 그림은 한 번만 내려받고, 마지막으로 쓰인 뒤 바로 놓아줍니다.
+    downloads = {}  # {URL: 내려받는 Task}
+    remaining = Counter(image_url for _, image_url in specs if image_url)
+
+    async def download(image_url: str) -> bytes:
+        try:
+            return await db_service.download_asset(image_url)
+        except Exception as e:
+            logger.warning(f"⚠️ [PDF] 삽화를 내려받지 못해 글만 넣습니다 ({image_url}): {e}")
+            return b""
+
+    async def render(spec: dict, image_url: str) -> bytes:
+        image_bytes = b""
+        if image_url:
+            if image_url not in downloads:
+                downloads[image_url] = asyncio.ensure_future(download(image_url))
+            image_bytes = await downloads[image_url]
+            remaining[image_url] -= 1
+            if not remaining[image_url]:
+                downloads.pop(image_url)
+        return await loop.run_in_executor(executor, _render_page, spec, image_bytes, font_file)
+
+    yield writer.header()
+    pending = deque()
+    try:
+        for spec, image_url in specs:
+            pending.append(asyncio.ensure_future(render(spec, image_url)))
+            if len(pending) > PDF_RENDER_AHEAD:
+                yield writer.page(await pending.popleft())
+        while pending:
+            yield writer.page(await pending.popleft())
+    finally:
+        for task in pending:
+            task.cancel()
+    yield writer.trailer()
+
+
+async def _render_and_upload(story: dict, object_name: str) -> str:
+    with telemetry.span("pdf.render", pages=len(build_page_specs(story))):
+        url = await db_service.upload_stream_to_supabase_async(lambda: _render_chunks(story), object_name, "application/pdf")
+    if url:
+        logger.info(f"📕 [PDF] 동화책 PDF 업로드 완료 ({story['id']})")
+    return url
+
+
+async def get_pdf_url(story: dict, etag: str) -> str:
+    """
+    동화책 PDF의 창고 URL. 이미 만들어 둔 PDF가 있으면 그대로, 렌더링 중이면 그 결과를 기다리고, 없으면 지금 만듭니다.
+    실패하거나 한글 글꼴이 없으면 빈 문자열.
+    """
+    if not available():
+        return ""
+    object_name = pdf_object_name(str(story["id"]), etag)
+    cached_url = await db_service.find_asset(object_name)
+    if cached_url:
+        return cached_url
+
+    task = _renders.get(object_name)
+    if task is None:
+        task = asyncio.create_task(_render_and_upload(story, object_name))
+        _renders[object_name] = task
+        task.add_done_callback(lambda _: _renders.pop(object_name, None))
+    # 요청한 클라이언트가 끊어도 렌더링은 끝까지 진행 (다음 요청이 캐시를 씀)
+    return await asyncio.shield(task)
+
+
+async def _render_saved_story(story_id: str):
+    try:
+        story, etag = await asyncio.to_thread(db_service.get_story_with_etag, story_id)
+        await get_pdf_url(story, etag)
+    except Exception as e:
+        logger.error(f"❌ [PDF] 동화책 PDF 생성 실패 ({story_id}): {e}")
+
+
+def schedule_render(story_id: str):
+    """동화책 저장 직후 응답을 막지 않고 PDF를 미리 만들어 둡니다."""
+    if not PDF_ENABLED or not available():
+        return
+    task = asyncio.create_task(_render_saved_story(story_id))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def drain():
+    """미리 만들기로 띄운 렌더링이 모두 끝날 때까지 기다립니다 (배치처럼 곧 종료할 프로세스용)."""
+    while _background:
+        await asyncio.gather(*list(_background), return_exceptions=True)
+
+
+def shutdown():
+    global _executor
+    for task in list(_background):
+        task.cancel()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,617 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import contextlib
+import logging
+from fastapi import HTTPException
+
+from schemas import GenerateRequest, StoryDraft
+import admission_service
+import ai_service
+import anchor_library
+import audio_service
+import checkpoint_service
+import db_service
+import draft_templates
+import image_service
+import pdf_service
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# 같은 주문이 다시 들어왔을 때 저장된 결과를 그대로 돌려주는 시간 (0이면 끔)
+REPLAY_WINDOW_SECONDS = int(os.getenv("GENERATE_REPLAY_WINDOW_SECONDS", "300"))
+
+
+# ==========================================
+# 0. 진행 상황 기록판 (Job 모드 / 상태 조회용)
+# ==========================================
+class PipelineProgress:
+    """
+    파이프라인이 지금 몇 번째 Step에 있고, 씬별로 어디까지 왔는지 기록합니다.
+    진행 중에 일어난 일은 이벤트(step/draft/scene/done/error)로도 쌓여서 스트리밍 응답이 따라 읽을 수 있습니다.
+    """
+
+    TERMINAL_EVENTS = ("done", "error")
+
+    def __init__(self):
+        self.step = "queued"
+        self.scenes = {}  # {scene_no: {"image": 상태, "audio": 상태}}
+        self.updated_at = time.time()
+        self.events = []  # [(이벤트 이름, 데이터)]
+        self._new_event = asyncio.Event()
+
+    def emit(self, event: str, data: dict):
+        self.events.append((event, data))
+        self.updated_at = time.time()
+        # 기다리던 구독자를 모두 깨우고, 다음 이벤트를 위해 새 신호로 교체
+        self._new_event.set()
+        self._new_event = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return bool(self.events) and self.events[-1][0] in self.TERMINAL_EVENTS
+
+    async def follow(self):
+        """처음부터 지금까지의 이벤트를 내보내고, done/error가 나올 때까지 새 이벤트를 기다리며 계속 내보냅니다."""
+        index = 0
+        while True:
+            while index < len(self.events):
+                event = self.events[index]
+                index += 1
+                yield event
+                if event[0] in self.TERMINAL_EVENTS:
+                    return
+            await self._new_event.wait()
+
+    def set_step(self, step: str):
+        self.step = step
+        self.emit("step", {"step": step})
+
+    def init_scenes(self, scene_numbers):
+        self.scenes = {no: {"image": "pending", "audio": "pending"} for no in scene_numbers}
+        self.updated_at = time.time()
+
+    def mark_scene(self, scene_no: int, m_type: str, state: str):
+        self.scenes.setdefault(scene_no, {"image": "pending", "audio": "pending"})[m_type] = state
+        self.updated_at = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "step": self.step,
+            "scenes": [{"scene_no": no, **states} for no, states in sorted(self.scenes.items())],
+            "updated_at": self.updated_at,
+        }
+
+
+# ==========================================
+# 1. Step 1~5 전체 공정 (동기 응답 / 백그라운드 워커 공용)
+# ==========================================
+async def run_story_pipeline(req: GenerateRequest, progress: PipelineProgress = None, checkpoint_key: str = None) -> dict:
+    """
+    교재 조회 → 대본 → 미디어 → 업로드 → DB 저장까지 실행하고 최종 응답 JSON을 돌려줍니다.
+    checkpoint_key(기본: 요청 지문)가 같은 지난 실행이 중간에 실패했다면 끝난 단계는 건너뛰고 이어서 진행합니다.
+    """
+    # 요청 1건 = trace 1개. 각 Step과 외부 호출은 그 아래 span으로 기록됩니다 (/metrics, 느린 요청 로그)
+    with telemetry.trace("pipeline", stage_code=req.stage_code):
+        return await _run_story_pipeline(req, progress or PipelineProgress(), checkpoint_key or request_fingerprint(req))
+
+async def _write_draft(req: GenerateRequest, progress: PipelineProgress, graph: ai_service.MediaGraph) -> StoryDraft:
+    # ----------------------------------------------------
+    # Step 1. 창고에서 교재 텍스트 꺼내오기
+    # ----------------------------------------------------
+    progress.set_step("curriculum")
+    try:
+        with telemetry.span("curriculum"):
+            curriculum_title, source_text = await asyncio.to_thread(db_service.get_curriculum, req.stage_code)
+        logger.info(f"✅ [Step 1] DB 조회 성공: {curriculum_title}")
+    except Exception as e:
+        logger.error(f"❌ [Step 1] DB 조회 실패: {str(e)}")
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+    # ----------------------------------------------------
+    # Step 2. GPT 요리사에게 텍스트 대본 및 프롬프트 맡기기
+    # (스트리밍 모드면 캐릭터 설정/씬 대사가 확정되는 대로 Anchor와 음성을 먼저 출발)
+    # ----------------------------------------------------
+    progress.set_step("draft")
+    # 같은 (진도, 감정, 나이대, 성향) 대본 템플릿이 모여 있으면 이름만 바꿔 쓰고 GPT 호출을 건너뜁니다.
+    template_key = draft_templates.template_key(req.stage_code, source_text, req.emotion, req.age, req.personality)
+    try:
+        with telemetry.span("draft"):
+            story_draft = draft_templates.find_draft(template_key, req.child_name)
+            template_hit = story_draft is not None
+            telemetry.annotate(template_hit=template_hit)
+            if not template_hit:
+                story_draft = await ai_service.generate_story_draft(
+                    child_name=req.child_name,
+                    age=req.age,
+                    personality=req.personality,
+                    emotion=req.emotion,
+                    source_text=source_text,
+                    on_characters=graph.start_anchor,
+                    on_scene_text=graph.start_audio,
+                    stage_code=req.stage_code,
+                )
+                await draft_templates.save_draft(template_key, story_draft, req.child_name)
+        logger.info(f"✅ [Step 2] 대본 {'템플릿 재사용' if template_hit else '생성 완료'}: {story_draft.title}")
+    except Exception as e:
+        graph.cancel()
+        logger.error(f"❌ [Step 2] 대본 생성 실패: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"대본 생성 실패: {str(e)}")
+    return story_draft
+
+async def _run_story_pipeline(req: GenerateRequest, progress: PipelineProgress, checkpoint_key: str) -> dict:
+
+    logger.info(f"\n=============================================")
+    logger.info(f"📥 [주문 접수] 아이: {req.child_name}, 감정: {req.emotion}, 진도: {req.stage_code}")
+    logger.info(f"=============================================")
+
+    # 같은 주문의 지난 실행 기록(실패/중단)이 있으면 끝난 단계는 건너뜁니다.
+    checkpoint = await asyncio.to_thread(checkpoint_service.load, checkpoint_key)
+    consistency_mode = req.consistency_mode or ai_service.CONSISTENCY_MODE
+    # 같은 진도+캐릭터 유형의 캐릭터 시트가 라이브러리에 있으면 그대로 쓰고 Anchor 생성을 건너뜁니다.
+    library_entry = anchor_library.find_entry(req.stage_code, req.character_archetype)
+    library_anchor = await anchor_library.load_anchor(library_entry) if library_entry else b""
+    # 대본을 쓰는 동안 먼저 출발하는 Anchor/음성도 같은 공정표에 올립니다. (업로드 콜백은 대본 확정 후 연결)
+    graph = ai_service.MediaGraph(anchor_image=library_anchor or None, consistency_mode=consistency_mode)
+
+    story_draft = checkpoint.draft
+    fresh_draft = False
+    if story_draft is not None:
+        logger.info(f"♻️ [Step 1/2] 지난 실행의 대본을 재사용합니다: {story_draft.title}")
+    else:
+        story_draft = await _write_draft(req, progress, graph)
+        fresh_draft = True
+    # 씬 그림이 시트와 어긋나지 않도록 스타일/캐릭터 설정도 라이브러리 것으로 맞춥니다.
+    if library_anchor:
+        story_draft.style_guide = library_entry["style_guide"]
+        story_draft.character_bible = library_entry["character_bible"]
+        story_draft.anchor_prompt = library_entry["anchor_prompt"]
+        logger.info(f"📚 [Step 2] 앵커 라이브러리 사용: {req.stage_code} / {req.character_archetype}")
+        if checkpoint.anchor_url != library_entry["anchor_url"]:
+            await checkpoint.set_anchor(library_entry["anchor_url"])
+    if fresh_draft:
+        await checkpoint.set_draft(story_draft)
+
+    # 지난 실행에서 그려 둔 캐릭터 시트가 있으면 다시 그리지 않고 내려받아 씁니다.
+    anchor_image = library_anchor
+    if not anchor_image and checkpoint.anchor_url:
+        try:
+            anchor_image = await db_service.download_asset(checkpoint.anchor_url)
+        except Exception as e:
+            logger.warning(f"⚠️ [Checkpoint] 캐릭터 시트를 내려받지 못해 새로 그립니다: {e}")
+
+    progress.init_scenes(scene.scene_no for scene in story_draft.scenes)
+    progress.emit("draft", {
+        "title": story_draft.title,
+        "summary": story_draft.summary,
+        "scenes": [scene.model_dump(include={"scene_no", "text", "quiz"}) for scene in story_draft.scenes],
+    })
+
+
+    # ----------------------------------------------------
+    # Step 3 + 4. 미디어 공정 가동! 완성된 파일은 그 즉시 Supabase 창고로 업로드
+    # ----------------------------------------------------
+    progress.set_step("media")
+    upload_results = []
+    variant_results = {  # {scene_no: {"webp": url, "webp_512": url, ...}}
+        int(no): scene["image_variants"] for no, scene in checkpoint.data["scenes"].items() if scene.get("image_variants")
+    }
+    audio_clips = {}  # {scene_no: 음성 bytes 또는 캐시 URL} - 전체 낭독 트랙용
+    narration = {}  # {"url": ..., "offsets": {scene_no: (시작, 끝)}}
+    build_narration = audio_service.NARRATION_TRACK_ENABLED and audio_service.ffmpeg_available()
+
+    async def upload_narration_track():
+        # 씬 순서대로 음성을 모아(캐시 재사용분은 내려받아) 한 트랙으로 잇고, 씬별 시작/끝 위치를 기록
+        try:
+            clips = []
+            for scene_no in sorted(audio_clips):
+                clip = audio_clips[scene_no]
+                if isinstance(clip, str):
+                    clip = await db_service.download_asset(clip)
+                if clip:
+                    clips.append((scene_no, clip))
+            if not clips:
+                return
+            with telemetry.span("audio.narration", scenes=len(clips)):
+                track, offsets = await audio_service.build_narration(clips)
+            url = await db_service.upload_to_supabase_async(track, ".opus", "audio/ogg")
+            if url:
+                narration.update(url=url, offsets=offsets)
+                progress.emit("narration", {"narration_url": url, "offsets": offsets})
+                logger.info(f"   -> 🎧 전체 낭독 트랙 업로드 완료! ({len(clips)}개 씬)")
+        except Exception as e:
+            logger.error(f"❌ [Step 4] 전체 낭독 트랙 생성 실패: {e}")
+
+    async def upload_image_variants(scene_no: int, png_bytes: bytes):
+        # WebP/AVIF 변환은 프로세스 풀에서, 변형 파일들은 동시에 업로드
+        variants = await image_service.make_variants(png_bytes)
+        names = list(variants)
+        urls = await asyncio.gather(*(db_service.upload_to_supabase_async(*variants[name]) for name in names))
+        variant_urls = {name: url for name, url in zip(names, urls) if url}
+        if variant_urls:
+            variant_results[scene_no] = variant_urls
+            await checkpoint.set_scene(scene_no, image_variants=variant_urls)
+            progress.emit("scene", {"scene_no": scene_no, "image_variants": variant_urls})
+            logger.info(f"   -> 🖼️ {scene_no}번 씬 [변형 이미지 {len(variant_urls)}개] 업로드 완료!")
+
+    async def upload_original(item: dict):
+        scene_no = item["scene_no"]
+        m_type = item["type"]
+        try:
+            perm_url = await db_service.upload_media_item(item)
+            if perm_url:
+                upload_results.append((scene_no, f"{m_type}_url", perm_url))
+                await checkpoint.set_scene(scene_no, **{f"{m_type}_url": perm_url})
+                progress.emit("scene", {"scene_no": scene_no, f"{m_type}_url": perm_url})
+                logger.info(f"   -> {'🎨' if m_type == 'image' else '🎵'} {scene_no}번 씬 [{m_type}] 업로드 완료!")
+            progress.mark_scene(scene_no, m_type, "uploaded" if perm_url else "failed")
+        except Exception as e:
+            logger.error(f"❌ [Step 4] 업로드 중 에러 발생 (씬 {scene_no}, {m_type}): {e}")
+            progress.mark_scene(scene_no, m_type, "failed")
+
+    async def upload_media(item: dict):
+        await upload_one(item)
+        if item["type"] == "audio" and build_narration:
+            audio_clips[item["scene_no"]] = item.get("url") or item["data"]
+            # 마지막 씬 음성까지 준비되면 전체 낭독 트랙을 만듭니다 (그림 사슬과 겹쳐서 진행)
+            if len(audio_clips) == len(story_draft.scenes):
+                await upload_narration_track()
+
+    async def upload_one(item: dict):
+        scene_no = item["scene_no"]
+        m_type = item["type"]
+        data = item["data"] # 여기서는 이제 둘 다 bytes 데이터임!
+
+        # 캐시에서 재사용한 파일은 이미 창고에 있으므로 URL만 기록
+        if item.get("url"):
+            upload_results.append((scene_no, f"{m_type}_url", item["url"]))
+            if checkpoint.scene(scene_no).get(f"{m_type}_url") != item["url"]:
+                await checkpoint.set_scene(scene_no, **{f"{m_type}_url": item["url"]})
+            progress.mark_scene(scene_no, m_type, "cached")
+            progress.emit("scene", {"scene_no": scene_no, f"{m_type}_url": item["url"]})
+            return
+
+        # 데이터가 없으면 패스
+        if not data:
+            progress.mark_scene(scene_no, m_type, "failed")
+            return
+        progress.mark_scene(scene_no, m_type, "generated")
+
+        if m_type == "image":
+            # 원본 PNG 업로드와 경량 변형 생성/업로드를 겹쳐서 진행
+            await asyncio.gather(upload_original(item), upload_image_variants(scene_no, data))
+        else:
+            await upload_original(item)
+
+    async def save_anchor(anchor_bytes: bytes):
+        # 새로 그린 캐릭터 시트도 창고에 올려 두면, 실패 후 재실행이나 씬 재생성 때 다시 그리지 않음
+        url = await db_service.upload_to_supabase_async(anchor_bytes, ".png", "image/png")
+        if url:
+            await checkpoint.set_anchor(url)
+
+    # 씬 재생성도 같은 방식으로 그리도록 일관성 방식을 기록
+    if checkpoint.data.get("consistency_mode") != consistency_mode:
+        await checkpoint.set_consistency_mode(consistency_mode)
+
+    completed = checkpoint.completed_media()
+    graph.connect(on_media=upload_media, on_anchor=save_anchor, completed=completed, anchor_image=anchor_image or None)
+    try:
+        with telemetry.span("media", consistency=consistency_mode, library_anchor=bool(library_anchor), resumed=len(completed)):
+            raw_media_results = await ai_service.generate_all_media_sequential(story_draft, graph=graph)
+        logger.info(f"✅ [Step 3/4] 미디어 생성 및 업로드 완료 (총 {len(raw_media_results)}개 파일)")
+        # 이 주문이 메모리에 들고 있던 미디어 크기로 입장 관리자의 메모리 추정치를 보정
+        admission_service.controller.observe_media_bytes(
+            sum(len(item["data"] or b"") for item in raw_media_results) + len(graph.anchor_image or b"")
+        )
+    except Exception as e:
+        logger.error(f"❌ [Step 3] 미디어 생성 실패: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"미디어 생성 실패: {str(e)}")
+
+    # 라이브러리에 없던 조합이면 이번에 그린 캐릭터 시트를 다음 주문들을 위해 저장 (배치 실행 시)
+    if req.character_archetype and not library_anchor and graph.anchor_image and anchor_library.ANCHOR_LIBRARY_AUTOSAVE:
+        try:
+            await anchor_library.save_entry(
+                req.stage_code, req.character_archetype, story_draft.style_guide,
+                story_draft.character_bible, story_draft.anchor_prompt, graph.anchor_image,
+            )
+        except Exception as e:
+            logger.error(f"❌ [Anchor Library] 저장 실패: {e}")
+
+
+    # ----------------------------------------------------
+    # Step 5. 최종 JSON 조립 및 DB 저장
+    # ----------------------------------------------------
+    progress.set_step("save")
+    logger.info("\n🎁 [Step 5] 최종 JSON 조립 및 DB 저장 중...")
+
+    final_scenes = []
+    for scene in story_draft.scenes:
+        scene_dict = scene.model_dump()
+        for res in upload_results:
+            if res[0] == scene.scene_no:
+                scene_dict[res[1]] = res[2]
+        scene_dict["image_variants"] = variant_results.get(scene.scene_no, {})
+        if scene.scene_no in narration.get("offsets", {}):
+            scene_dict["narration_url"] = narration["url"]
+            scene_dict["narration_start"], scene_dict["narration_end"] = narration["offsets"][scene.scene_no]
+        final_scenes.append(scene_dict)
+
+    try:
+        with telemetry.span("save"):
+            story_id = await asyncio.to_thread(
+                db_service.save_final_story,
+                user_id=req.user_id,
+                stage_code=req.stage_code,
+                emotion=req.emotion,
+                title=story_draft.title,
+                scenes_dict=final_scenes
+            )
+    except Exception as e:
+        logger.error(f"❌ [Step 5] DB 저장 실패: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"DB 저장 실패: {str(e)}")
+    # 주문 기록은 동화책 기록으로 옮겨 두고 씬 재생성에 씁니다.
+    await checkpoint_service.finish(checkpoint, story_id)
+    # PDF는 응답을 막지 않고 뒤에서 미리 만들어 둡니다 (GET /stories/{id}/pdf가 완성본을 바로 내줌)
+    pdf_service.schedule_render(story_id)
+
+    # ----------------------------------------------------
+    # Step 6. 프론트엔드로 배달! (Output)
+    # ----------------------------------------------------
+    progress.set_step("done")
+    logger.info("🎉 모든 작업 완료! 프론트엔드로 데이터를 발송합니다.\n")
+    result = {
+        "story_id": story_id,
+        "title": story_draft.title,
+        "summary": story_draft.summary,
+        "created_at": "Just now", # 실제로는 DB의 created_at을 써도 됩니다.
+        "pdf_url": f"/stories/{story_id}/pdf",
+        "narration_url": narration.get("url", ""),
+        "scenes": final_scenes
+    }
+    progress.emit("done", result)
+    return result
+
+
+# ==========================================
+# 2. 중복 주문 합치기 (Single-flight + 재전송 창)
+# ==========================================
+_inflight = {}  # {요청 지문: 실행 중인 Task}
+_recent_results = db_service.TTLCache(REPLAY_WINDOW_SECONDS, 1024)
+
+def request_fingerprint(req: GenerateRequest, idempotency_key: str = None) -> str:
+    """요청 바디를 정렬된 JSON으로 만든 뒤 멱등성 키와 함께 해시한 '주문 지문'"""
+    body = json.dumps(req.model_dump(), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{idempotency_key or ''}\n{body}".encode("utf-8")).hexdigest()
+
+def _finish_flight(key: str, task: asyncio.Task):
+    _inflight.pop(key, None)
+    if REPLAY_WINDOW_SECONDS > 0 and not task.cancelled() and task.exception() is None:
+        _recent_results.set(key, task.result())
+
+def _admit(wait_when_busy: bool) -> admission_service.Admission:
+    try:
+        return admission_service.controller.admit(wait_when_busy)
+    except admission_service.Overloaded as e:
+        raise HTTPException(
+            status_code=429,
+            detail="지금은 주문이 너무 많습니다. 잠시 후 다시 시도해주세요.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+async def _run_admitted(admission: admission_service.Admission, req: GenerateRequest, progress: PipelineProgress, key: str) -> dict:
+    if admission.waiting:
+        progress.set_step("queued")
+        logger.info("🚦 [입장 제한] 자리가 날 때까지 대기합니다.")
+    async with admission:
+        return await run_story_pipeline(req, progress, checkpoint_key=key)
+
+def start_story_pipeline(req: GenerateRequest, idempotency_key: str = None, progress: PipelineProgress = None,
+                         wait_when_busy: bool = False) -> asyncio.Future:
+    """
+    주문 1건의 실행(Future)을 돌려줍니다. 같은 주문(더블 탭, 타임아웃 재시도)이 진행 중이면 그 실행을,
+    재전송 창 안에 다시 들어오면 저장된 결과가 담긴 Future를 돌려줍니다.
+    새 실행은 입장 관리자의 자리를 받아야 시작되며, 자리도 대기열도 없으면 429(Retry-After)를 즉시 던집니다.
+    """
+    key = request_fingerprint(req, idempotency_key)
+
+    replay = _recent_results.get(key)
+    if replay is not None:
+        logger.info(f"♻️ [중복 주문] 재전송 창 안의 같은 주문 → 저장된 결과 반환 (story_id: {replay['story_id']})")
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(replay)
+        return future
+
+    task = _inflight.get(key)
+    if task is None:
+        admission = _admit(wait_when_busy)
+        task = asyncio.create_task(_run_admitted(admission, req, progress or PipelineProgress(), key))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _finish_flight(key, t))
+    else:
+        logger.info("🔗 [중복 주문] 같은 주문이 이미 진행 중 → 첫 번째 실행에 합류합니다.")
+    return task
+
+async def run_story_pipeline_once(req: GenerateRequest, idempotency_key: str = None, progress: PipelineProgress = None,
+                                  wait_when_busy: bool = False) -> dict:
+    """start_story_pipeline으로 실행(또는 합류)하고 결과를 기다립니다."""
+    # 한 클라이언트가 연결을 끊어도 함께 기다리는 다른 요청의 실행은 취소되지 않도록 보호
+    return await asyncio.shield(start_story_pipeline(req, idempotency_key, progress, wait_when_busy))
+
+
+# ==========================================
+# 3. 씬 단위 점진 배달 (스트리밍)
+# ==========================================
+def stream_story_pipeline(req: GenerateRequest, idempotency_key: str = None):
+    """
+    파이프라인을 시작하고, (이벤트 이름, 데이터)를 진행되는 대로 내보내는 비동기 이터레이터를 돌려줍니다.
+    draft(제목/요약/대사) → scene(씬별 image_url/audio_url, 업로드되는 즉시) → done(최종 story_id 포함) 순서입니다.
+    자리가 없으면 스트림을 열기 전에 429를 던집니다.
+    """
+    progress = PipelineProgress()
+    task = start_story_pipeline(req, idempotency_key, progress)
+
+    def close_stream(t: asyncio.Task):
+        # 이미 진행 중인 같은 주문에 합류했거나 실패한 경우에도 스트림이 반드시 끝나도록 마무리 이벤트를 보냅니다.
+        if progress.finished:
+            return
+        if t.cancelled():
+            progress.emit("error", {"detail": "작업이 취소되었습니다."})
+        elif t.exception() is not None:
+            e = t.exception()
+            progress.emit("error", {"detail": e.detail if isinstance(e, HTTPException) else str(e)})
+        else:
+            progress.emit("done", t.result())
+
+    task.add_done_callback(close_stream)
+    return progress.follow()
+
+
+# ==========================================
+# 4. 씬 하나만 다시 만들기 (완성된 동화책)
+# ==========================================
+_regenerate_locks = {}  # {story_id: [asyncio.Lock, 기다리거나 쓰는 요청 수]} - 같은 동화책의 재생성은 한 번에 하나씩 (scenes 덮어쓰기 충돌 방지)
+
+@contextlib.asynccontextmanager
+async def _story_lock(story_id: str):
+    """동화책별 잠금. 마지막 사용자가 놓으면 항목을 지워 잠금 표가 끝없이 커지지 않게 합니다."""
+    entry = _regenerate_locks.setdefault(story_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            _regenerate_locks.pop(story_id, None)
+
+async def _download_or_empty(url: str) -> bytes:
+    if not url:
+        return b""
+    try:
+        return await db_service.download_asset(url)
+    except Exception as e:
+        logger.warning(f"⚠️ [재생성] 기준 그림을 내려받지 못했습니다 ({url}): {e}")
+        return b""
+
+async def _upload_scene_image(png_bytes: bytes) -> tuple:
+    """(원본 PNG URL, {변형 이름: URL}). 그림이 없으면 ("", {})"""
+    if not png_bytes:
+        return "", {}
+    variants = await image_service.make_variants(png_bytes)
+    names = list(variants)
+    urls = await asyncio.gather(
+        db_service.upload_to_supabase_async(png_bytes, ".png", "image/png"),
+        *(db_service.upload_to_supabase_async(*variants[name]) for name in names),
+    )
+    return urls[0], {name: url for name, url in zip(names, urls[1:]) if url}
+
+async def _rebuild_narration(scenes: list) -> dict:
+    """씬 음성을 모두 내려받아 전체 낭독 트랙을 다시 잇습니다. 실패하면 빈 dict (기존 트랙 유지)."""
+    try:
+        clips = await asyncio.gather(*(_download_or_empty(scene.get("audio_url")) for scene in scenes))
+        clips = [(scene["scene_no"], clip) for scene, clip in zip(scenes, clips) if clip]
+        with telemetry.span("audio.narration", scenes=len(clips)):
+            track, offsets = await audio_service.build_narration(clips)
+        url = await db_service.upload_to_supabase_async(track, ".opus", "audio/ogg")
+        return {"url": url, "offsets": offsets} if url else {}
+    except Exception as e:
+        logger.error(f"❌ [재생성] 전체 낭독 트랙 갱신 실패: {e}")
+        return {}
+
+async def regenerate_scene(story_id: str, scene_no: int) -> dict:
+    """
+    완성된 동화책에서 씬 하나의 그림과 음성만 새로 만들어 교체하고, 바뀐 씬을 돌려줍니다.
+    체크포인트에 남은 대본과 캐릭터 시트(이어 그리는 씬이면 바로 앞 씬 그림도)를 기준으로 그리므로 나머지 씬은 그대로입니다.
+    유료 그림/음성 호출을 하므로 /generate와 같은 입장 관리자의 자리를 받아야 시작하고, 자리가 없으면 429를 돌려줍니다.
+    """
+    if not checkpoint_service.CHECKPOINT_DIR:
+        raise HTTPException(
+            status_code=501,
+            detail="체크포인트가 꺼져 있어 씬 재생성을 할 수 없습니다. (서버에 CHECKPOINT_DIR 설정 필요)",
+        )
+    context = await asyncio.to_thread(checkpoint_service.load_story, story_id)
+    story_draft = context.draft if context else None
+    if story_draft is None:
+        raise HTTPException(status_code=404, detail="재생성에 필요한 기록이 없는 동화책입니다.")
+    index, scene = next(((i, s) for i, s in enumerate(story_draft.scenes) if s.scene_no == scene_no), (0, None))
+    if scene is None:
+        raise HTTPException(status_code=404, detail=f"{scene_no}번 씬이 없습니다.")
+
+    async with _story_lock(story_id):
+        # 같은 동화책 차례를 기다리는 동안에는 자리를 잡지 않고, 차례가 오면 입장 관리자의 자리를 받음
+        async with _admit(wait_when_busy=False):
+            with telemetry.trace("regenerate", scene_no=scene_no):
+                try:
+                    story, _ = await asyncio.to_thread(db_service.get_story_with_etag, story_id)
+                except ValueError as e:
+                    raise HTTPException(status_code=404, detail=str(e))
+                logger.info(f"🔁 [재생성] {story_id} 동화책의 {scene_no}번 씬을 다시 만듭니다.")
+
+                anchor_image, prev_image = await asyncio.gather(
+                    _download_or_empty(context.anchor_url),
+                    _download_or_empty(
+                        context.scene(scene_no - 1).get("image_url")
+                        if ai_service.chains_previous(context.consistency_mode, scene, index) else ""
+                    ),
+                )
+                if not anchor_image:
+                    anchor_image = await ai_service.generate_anchor_image(
+                        story_draft.anchor_prompt, story_draft.style_guide, story_draft.character_bible
+                    )
+                    anchor_url = await db_service.upload_to_supabase_async(anchor_image, ".png", "image/png") if anchor_image else ""
+                    if anchor_url:
+                        await context.set_anchor(anchor_url)
+
+                with telemetry.span("media", scene_no=scene_no):
+                    image_bytes, audio_item = await asyncio.gather(
+                        ai_service.generate_scene_image_consistent(
+                            scene_no=scene_no,
+                            scene_prompt=scene.image_prompt,
+                            style_guide=story_draft.style_guide,
+                            character_bible=story_draft.character_bible,
+                            anchor_image=anchor_image,
+                            prev_image=prev_image or None,
+                        ),
+                        ai_service.generate_audio(scene.text, scene_no, use_cache=False),
+                    )
+                if not image_bytes and not audio_item["data"]:
+                    raise HTTPException(status_code=500, detail=f"{scene_no}번 씬 재생성 실패")
+
+                # 새 파일 업로드 (실패한 쪽은 기존 URL 유지)
+                (image_url, variant_urls), audio_url = await asyncio.gather(
+                    _upload_scene_image(image_bytes), db_service.upload_media_item(audio_item)
+                )
+
+                scenes = [dict(s) for s in story["scenes"]]
+                target = next(s for s in scenes if s["scene_no"] == scene_no)
+                changed = {}
+                if image_url:
+                    changed["image_url"] = image_url
+                    changed["image_variants"] = variant_urls
+                if audio_url:
+                    changed["audio_url"] = audio_url
+                target.update(changed)
+
+                # 음성이 바뀌었으면 전체 낭독 트랙도 다시 이어서 씬별 위치를 맞춤
+                if audio_url and any(s.get("narration_url") for s in scenes):
+                    narration = await _rebuild_narration(scenes)
+                    for s in scenes:
+                        if s["scene_no"] in narration.get("offsets", {}):
+                            s["narration_url"] = narration["url"]
+                            s["narration_start"], s["narration_end"] = narration["offsets"][s["scene_no"]]
+
+                try:
+                    with telemetry.span("save"):
+                        await asyncio.to_thread(db_service.update_story_scenes, story_id, scenes)
+                except Exception as e:
+                    logger.error(f"❌ [재생성] DB 갱신 실패: {e}")
+                    raise HTTPException(status_code=500, detail=f"DB 갱신 실패: {str(e)}")
+                await context.set_scene(scene_no, **changed)
+                # 내용이 바뀌었으므로 새 버전의 PDF를 미리 만들어 둠
+                pdf_service.schedule_render(story_id)
+                logger.info(f"✅ [재생성] {scene_no}번 씬 교체 완료 ({', '.join(changed)})")
+                return target
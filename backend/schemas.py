@@ -1,6 +1,6 @@
 # schemas.py
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 # 1. 프론트가 백엔드로 보낼 때의 규격 (Input)
 class GenerateRequest(BaseModel):
@@ -10,6 +10,10 @@ class GenerateRequest(BaseModel):
     personality: str
     emotion: str
     stage_code: str
+    # 캐릭터 유형 (예: "brave_rabbit"). 앵커 라이브러리에 같은 진도+유형 조합이 있으면 캐릭터 시트를 재사용
+    character_archetype: Optional[str] = None
+    # 씬 그림 일관성 방식: chain(앞 씬에 이어 그림) / anchor(캐릭터 시트만 보고 동시에) / hybrid. 없으면 서버 기본값
+    consistency_mode: Optional[Literal["chain", "anchor", "hybrid"]] = None
 
 # 2. GPT가 만들어낼 '퀴즈' 규격
 class QuizSchema(BaseModel):
@@ -24,6 +28,7 @@ class SceneSchema(BaseModel):
     scene_no: int
     text: str = Field(description="이 장면에 들어갈 동화책 내레이션 대사")
     image_prompt: str = Field(description="이 장면을 DALL-E 3로 그리기 위한 영문 프롬프트 (최대한 상세하게)")
+    continues_previous: bool = Field(False, description="바로 앞 장면과 같은 장소/순간이 이어지면 true (1번 장면은 false)")
     # 프론트가 쓸 임시 빈칸 (나중에 백엔드가 채워줌)
     image_url: str = "" 
     audio_url: str = ""
@@ -0,0 +1,239 @@
+import os
+import time
+import asyncio
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 0. 계측 설정
+# ==========================================
+# 이 시간(초)보다 오래 걸린 요청은 구간(span) 트리를 통째로 로그에 남깁니다. 0이면 끔
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))
+METRICS_PREFIX = "edutale"
+# 대본 수 초 ~ 그림 사슬 수 분까지 담을 수 있는 지연 구간 (초)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+# ==========================================
+# 1. Prometheus 지표 (카운터 / 게이지 / 히스토그램)
+# ==========================================
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: tuple, values: tuple, le: str = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}  # {라벨 값 튜플: 값}
+        self._lock = threading.Lock()  # 스레드(to_thread)에서 기록해도 안전하게
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def _samples(self) -> list:
+        raise NotImplementedError
+
+    def render(self) -> list:
+        with self._lock:
+            samples = self._samples()
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}", *samples]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        with self._lock:
+            key = self._key(labels)
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0.0, 0]  # [구간별 개수, 합계, 전체 개수]
+            counts, _, _ = state = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def mean(self, **labels) -> float:
+        """지금까지 관찰한 값의 평균. 아직 없으면 None"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+        return state[1] / state[2] if state and state[2] else None
+
+    def _samples(self) -> list:
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, bound)} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, '+Inf')} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+_registry = []
+
+STAGE_DURATION = Histogram("stage_duration_seconds", "Latency of each pipeline step and external call", ("stage",))
+STAGE_ERRORS = Counter("stage_errors_total", "Failed pipeline steps and external calls", ("stage", "error"))
+# kind: 최상위 trace 이름 ("pipeline" = 동화책 전체 생성, "regenerate" = 씬 1개 재생성)
+PIPELINE_DURATION = Histogram("pipeline_duration_seconds", "End-to-end request latency by kind", ("kind", "outcome"))
+PIPELINES_IN_FLIGHT = Gauge("pipelines_in_flight", "Requests currently running by kind", ("kind",))
+PIPELINES_IN_FLIGHT.set(0, kind="pipeline")
+
+
+def render_metrics() -> str:
+    """등록된 모든 지표를 Prometheus 텍스트 형식으로 만듭니다."""
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+# ==========================================
+# 2. 요청별 구간 추적 (span 트리)
+# ==========================================
+class Span:
+    def __init__(self, name: str, attrs: dict, parent: "Span" = None):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.children = []
+        self.started_at = time.perf_counter()
+        self.duration = None
+        self.error = None
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        if parent is not None:
+            parent.children.append(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "attrs": self.attrs,
+            "duration_ms": round(self.duration * 1000, 1) if self.duration is not None else None,
+            "error": self.error,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+    def format_tree(self, root_start: float = None, depth: int = 0) -> str:
+        """들여쓰기 트리: 요청 시작 기준 시작 시각(+ms)과 걸린 시간"""
+        root_start = self.started_at if root_start is None else root_start
+        offset = (self.started_at - root_start) * 1000
+        duration = f"{self.duration * 1000:.0f}ms" if self.duration is not None else "unfinished"
+        attrs = " ".join(f"{k}={v}" for k, v in self.attrs.items())
+        line = f"{'  ' * depth}- {self.name} +{offset:.0f}ms {duration} {attrs}".rstrip()
+        if self.error:
+            line += f" ❌ {self.error.splitlines()[0][:200]}"  # 여러 줄짜리 오류는 첫 줄만
+        children = sorted(self.children, key=lambda child: child.started_at)
+        return "\n".join([line, *(child.format_tree(root_start, depth + 1) for child in children)])
+
+
+# 현재 실행 흐름의 span. asyncio Task / to_thread는 만들어질 때의 값을 물려받아 자식 span이 제자리에 붙습니다.
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _finish(span: Span, error: BaseException = None):
+    span.duration = time.perf_counter() - span.started_at
+    STAGE_DURATION.observe(span.duration, stage=span.name)
+    if error is not None:
+        span.error = f"{type(error).__name__}: {getattr(error, 'detail', error)}"
+        STAGE_ERRORS.inc(stage=span.name, error=type(error).__name__)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """with 블록 하나를 구간으로 기록합니다 (지연 히스토그램 + 실패 카운터, 요청 중이면 트리에도 추가)."""
+    current = Span(name, attrs, _current_span.get())
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        _finish(current, e)
+        raise
+    else:
+        _finish(current)
+    finally:
+        _current_span.reset(token)
+
+
+def annotate(**attrs):
+    """지금 열려 있는 span에 속성을 덧붙입니다. (예: 재시도 횟수, 대기 시간)"""
+    current = _current_span.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def mark_failed(reason: str):
+    """예외 없이 빈 값으로 실패를 알리는 단계(예: 업로드 최종 실패)에서 지금 span을 실패로 기록합니다."""
+    current = _current_span.get()
+    if current is not None:
+        current.error = reason
+        STAGE_ERRORS.inc(stage=current.name, error=reason)
+
+
+@contextmanager
+def trace(name: str, **attrs):
+    """
+    요청 1건 전체를 감싸는 최상위 span. 동시 실행 게이지, 전체 지연, 느린 요청 로그를 담당합니다.
+    게이지와 지연 히스토그램은 name을 kind 라벨로 나눠 기록하므로, 씬 재생성처럼 짧은 요청이 동화책 생성 지표에 섞이지 않습니다.
+    """
+    root = Span(name, attrs)
+    token = _current_span.set(root)
+    PIPELINES_IN_FLIGHT.inc(kind=name)
+    outcome = "succeeded"
+    try:
+        yield root
+    except BaseException as e:
+        outcome = "cancelled" if isinstance(e, asyncio.CancelledError) else "failed"
+        _finish(root, e)
+        raise
+    else:
+        _finish(root)
+    finally:
+        _current_span.reset(token)
+        PIPELINES_IN_FLIGHT.dec(kind=name)
+        PIPELINE_DURATION.observe(root.duration, kind=name, outcome=outcome)
+        if SLOW_REQUEST_SECONDS and root.duration >= SLOW_REQUEST_SECONDS:
+            logger.warning(
+                f"🐢 [Trace {root.trace_id}] 느린 요청 {root.duration:.1f}초 ({outcome})\n{root.format_tree()}"
+            )
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# 테스트는 backend 폴더의 모듈을 그대로 import 합니다 (python -m pytest backend/tests 어디서 실행해도)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 모듈을 불러올 때 클라이언트를 만드는 서비스들이 실제 키 없이도 import 되도록 (네트워크 호출은 하지 않음)
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_API", "test-service-key")
+os.environ.setdefault("CHECKPOINT_DIR", "")
+os.environ.setdefault("DRAFT_TEMPLATE_PATH", "")
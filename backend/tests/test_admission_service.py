@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from admission_service import AdmissionController, Overloaded
+
+MB = 1024 * 1024
+
+
+def make_controller(**overrides) -> AdmissionController:
+    settings = dict(max_pipelines=2, max_queue=2, media_budget_bytes=100 * MB, media_estimate_bytes=10 * MB)
+    settings.update(overrides)
+    return AdmissionController(**settings)
+
+
+def test_grants_immediately_while_slots_are_free():
+    async def scenario():
+        controller = make_controller()
+        first, second = controller.admit(), controller.admit()
+        assert not first.waiting and not second.waiting
+        assert controller.in_flight == 2
+        assert controller.reserved_bytes == 20 * MB
+
+    asyncio.run(scenario())
+
+
+def test_queues_in_order_and_hands_over_slots_on_release():
+    async def scenario():
+        controller = make_controller(max_pipelines=1)
+        running = controller.admit()
+        queued = [controller.admit(), controller.admit()]
+        assert [admission.waiting for admission in queued] == [True, True]
+
+        await running.__aexit__(None, None, None)
+        assert not queued[0].waiting and queued[1].waiting
+        await queued[0].__aexit__(None, None, None)
+        assert not queued[1].waiting
+        await queued[1].__aexit__(None, None, None)
+        assert controller.in_flight == 0 and controller.reserved_bytes == 0
+
+    asyncio.run(scenario())
+
+
+def test_rejects_when_queue_is_full_with_retry_after():
+    async def scenario():
+        controller = make_controller(max_pipelines=1, max_queue=1)
+        controller.admit()
+        controller.admit()
+        with pytest.raises(Overloaded) as excinfo:
+            controller.admit()
+        assert excinfo.value.reason == "queue_full"
+        assert excinfo.value.retry_after > 0
+        assert controller.rejected == 1
+
+    asyncio.run(scenario())
+
+
+def test_background_callers_wait_instead_of_being_rejected():
+    async def scenario():
+        controller = make_controller(max_pipelines=1, max_queue=0)
+        controller.admit()
+        assert controller.admit(wait_when_busy=True).waiting
+
+    asyncio.run(scenario())
+
+
+def test_media_budget_limits_admission_but_never_blocks_the_first_pipeline():
+    async def scenario():
+        controller = make_controller(max_pipelines=8, media_budget_bytes=15 * MB)
+        first = controller.admit()
+        assert not first.waiting  # 예산보다 크든 작든 혼자서는 돌 수 있음
+        assert controller.admit().waiting
+        assert controller.effective_slots() == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue_without_taking_a_slot():
+    async def scenario():
+        controller = make_controller(max_pipelines=1)
+        running = controller.admit()
+        cancelled = controller.admit()
+        next_in_line = controller.admit()
+
+        async def use(admission):
+            async with admission:
+                await asyncio.sleep(10)
+
+        task = asyncio.create_task(use(cancelled))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        await running.__aexit__(None, None, None)
+        # 취소된 주문은 건너뛰고 다음 주문이 자리를 받음
+        assert not next_in_line.waiting
+        assert controller.in_flight == 1
+        assert controller.stats()["queued"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancel_right_after_grant_returns_the_slot():
+    async def scenario():
+        controller = make_controller(max_pipelines=1)
+        running = controller.admit()
+        waiter = controller.admit()
+
+        async def use(admission):
+            async with admission:
+                await asyncio.sleep(10)
+
+        task = asyncio.create_task(use(waiter))
+        await asyncio.sleep(0)
+        await running.__aexit__(None, None, None)  # 자리를 넘겨받은 직후
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert controller.in_flight == 0 and controller.reserved_bytes == 0
+
+    asyncio.run(scenario())
+
+
+def test_media_estimate_follows_observed_sizes():
+    controller = make_controller()
+    controller.observe_media_bytes(20 * MB)
+    assert controller.media_estimate_bytes == round(10 * MB * 0.8 + 20 * MB * 0.2)
+    controller.observe_media_bytes(0)  # 측정값이 없으면 그대로
+    assert controller.media_estimate_bytes == round(10 * MB * 0.8 + 20 * MB * 0.2)
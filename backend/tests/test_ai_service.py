@@ -0,0 +1,132 @@
+import asyncio
+
+import ai_service
+from ai_service import _dispatch_partial_draft
+from schemas import StoryDraft
+
+
+def collect(partial: dict, started: set = None):
+    characters, scenes = [], []
+    _dispatch_partial_draft(
+        partial,
+        started if started is not None else set(),
+        on_characters=lambda *args: characters.append(args),
+        on_scene_text=lambda scene_no, text: scenes.append((scene_no, text)),
+    )
+    return characters, scenes
+
+
+def test_characters_wait_until_the_next_key_appears():
+    # anchor_prompt 다음 키(scenes)가 아직 없으면 anchor_prompt가 덜 쓰였을 수 있음
+    partial = {"title": "t", "summary": "s", "style_guide": "sg", "character_bible": "cb", "anchor_prompt": "anc"}
+    assert collect(partial) == ([], [])
+
+    characters, _ = collect({**partial, "scenes": []})
+    assert characters == [("anc", "sg", "cb")]
+
+
+def test_scene_text_dispatches_once_its_next_field_starts():
+    base = {"title": "t", "summary": "s", "style_guide": "sg", "character_bible": "cb", "anchor_prompt": "anc"}
+    streaming = {**base, "scenes": [{"scene_no": 1, "text": "반쯤 쓴 대"}]}
+    assert collect(streaming)[1] == []
+
+    finished = {**base, "scenes": [{"scene_no": 1, "text": "다 쓴 대사", "image_prompt": ""}]}
+    assert collect(finished)[1] == [(1, "다 쓴 대사")]
+
+
+def test_each_field_dispatches_only_once():
+    started = set()
+    partial = {
+        "title": "t", "summary": "s", "style_guide": "sg", "character_bible": "cb", "anchor_prompt": "anc",
+        "scenes": [{"scene_no": 1, "text": "하나", "image_prompt": "p"}, {"scene_no": 2, "text": "둘"}],
+    }
+    assert collect(partial, started) == ([("anc", "sg", "cb")], [(1, "하나")])
+    assert collect(partial, started) == ([], [])
+
+
+def make_draft(continues=(False, False, False)) -> StoryDraft:
+    scenes = [
+        {"scene_no": no, "text": f"{no}번 대사", "image_prompt": f"p{no}", "continues_previous": flag}
+        for no, flag in enumerate(continues, start=1)
+    ]
+    return StoryDraft(title="t", summary="s", style_guide="sg", character_bible="cb", anchor_prompt="anc", scenes=scenes)
+
+
+def fake_media(monkeypatch, events: list, anchor_gate: asyncio.Event = None):
+    async def anchor(anchor_prompt, style_guide, character_bible):
+        if anchor_gate is not None:
+            await anchor_gate.wait()
+        events.append("anchor")
+        return b"anchor"
+
+    async def scene_image(scene_no, scene_prompt, style_guide, character_bible, anchor_image, prev_image=None):
+        events.append(("image-start", scene_no, prev_image))
+        await asyncio.sleep(0)
+        return f"img{scene_no}".encode()
+
+    async def audio(text, scene_no, use_cache=True):
+        events.append(("audio", scene_no))
+        return {"scene_no": scene_no, "type": "audio", "data": b"mp3"}
+
+    monkeypatch.setattr(ai_service, "generate_anchor_image", anchor)
+    monkeypatch.setattr(ai_service, "generate_scene_image_consistent", scene_image)
+    monkeypatch.setattr(ai_service, "generate_audio", audio)
+
+
+def test_audio_does_not_wait_for_the_anchor(monkeypatch):
+    events = []
+
+    async def scenario():
+        gate = asyncio.Event()
+        fake_media(monkeypatch, events, gate)
+        uploaded = []
+
+        async def on_media(item):
+            uploaded.append((item["type"], item["scene_no"]))
+
+        run = asyncio.create_task(ai_service.MediaGraph(on_media, consistency_mode="anchor").run(make_draft()))
+        for _ in range(5):
+            await asyncio.sleep(0)
+        # Anchor가 아직 안 끝났어도 음성은 모두 나왔고, 씬 그림은 하나도 출발하지 않음
+        assert sorted(e for e in events if e[0] == "audio") == [("audio", 1), ("audio", 2), ("audio", 3)]
+        assert not any(e[0] == "image-start" for e in events if isinstance(e, tuple))
+        gate.set()
+        results = await run
+        assert len(results) == 6
+        assert sorted(uploaded) == sorted((item["type"], item["scene_no"]) for item in results)
+
+    asyncio.run(scenario())
+
+
+def test_completed_media_is_not_generated_again(monkeypatch):
+    events = []
+    fake_media(monkeypatch, events)
+    completed = {(no, kind): f"https://example.com/{no}.{kind}" for no in (1, 2, 3) for kind in ("image", "audio")}
+
+    results = asyncio.run(ai_service.MediaGraph(completed=completed, consistency_mode="chain").run(make_draft()))
+    assert events == []  # Anchor도 필요 없음
+    assert sorted(item["url"] for item in results) == sorted(completed.values())
+
+
+def test_chains_previous_follows_the_consistency_mode():
+    draft = make_draft(continues=(False, True, False))
+    modes = {mode: [ai_service.chains_previous(mode, scene, index) for index, scene in enumerate(draft.scenes)]
+             for mode in ("chain", "anchor", "hybrid")}
+    assert modes == {
+        "chain": [False, True, True],
+        "anchor": [False, False, False],
+        "hybrid": [False, True, False],
+    }
+
+
+def test_scene_images_get_the_previous_image_only_when_chained(monkeypatch):
+    for mode, expected in (
+        ("chain", [None, b"img1", b"img2"]),
+        ("anchor", [None, None, None]),
+        ("hybrid", [None, b"img1", None]),
+    ):
+        events = []
+        fake_media(monkeypatch, events)
+        asyncio.run(ai_service.MediaGraph(consistency_mode=mode).run(make_draft(continues=(False, True, False))))
+        starts = sorted(e[1:] for e in events if isinstance(e, tuple) and e[0] == "image-start")
+        assert [prev for _, prev in starts] == expected, mode
@@ -0,0 +1,34 @@
+import asyncio
+import json
+import os
+
+import anchor_library
+import db_service
+
+
+def test_relative_library_path_is_resolved_against_backend_dir():
+    assert os.path.isabs(anchor_library.ANCHOR_LIBRARY_PATH)
+    assert os.path.dirname(anchor_library.ANCHOR_LIBRARY_PATH) == os.path.dirname(os.path.abspath(anchor_library.__file__))
+
+
+def test_save_entry_appends_once_per_combination(monkeypatch, tmp_path):
+    path = tmp_path / "anchors.jsonl"
+    monkeypatch.setattr(anchor_library, "ANCHOR_LIBRARY_PATH", str(path))
+    monkeypatch.setattr(anchor_library, "_entries", {})
+    monkeypatch.setattr(anchor_library, "_anchor_bytes", {})
+
+    async def fake_upload(data, ext, content_type):
+        return "https://example.com/anchor.png"
+
+    monkeypatch.setattr(db_service, "upload_to_supabase_async", fake_upload)
+
+    async def scenario():
+        first = await anchor_library.save_entry("1-1", " Fox ", "sg", "cb", "ap", b"png")
+        second = await anchor_library.save_entry("1-1", "fox", "sg2", "cb2", "ap2", b"png2")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert second is first
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["archetype"] for line in lines] == ["fox"]
+    assert anchor_library.find_entry("1-1", "FOX") is first
@@ -0,0 +1,47 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+import audio_service
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    def apply(tts_format: str = "mp3", bitrate: str = "", ffmpeg: bool = True):
+        monkeypatch.setattr(audio_service, "TTS_FORMAT", tts_format)
+        monkeypatch.setattr(audio_service, "AUDIO_BITRATE", bitrate)
+        monkeypatch.setattr(audio_service, "ffmpeg_available", lambda: ffmpeg)
+        monkeypatch.setattr(audio_service, "_warned_no_ffmpeg", False)
+    return apply
+
+
+def test_tts_format_is_kept_without_bitrate(settings):
+    settings(tts_format="aac")
+    assert not audio_service.reencodes()
+    assert audio_service.output_format() == "aac"
+
+
+@pytest.mark.parametrize("tts_format", ["mp3", "opus"])
+def test_bitrate_reencodes_to_opus_even_when_tts_is_opus(settings, tts_format):
+    settings(tts_format=tts_format, bitrate="24k")
+    assert audio_service.reencodes()
+    assert audio_service.output_format() == "opus"
+
+
+def test_bitrate_without_ffmpeg_keeps_tts_format_and_warns_once(settings, caplog):
+    settings(tts_format="mp3", bitrate="24k", ffmpeg=False)
+    assert audio_service.output_format() == "mp3"
+    assert audio_service.output_format() == "mp3"
+    assert sum("ffmpeg" in record.message for record in caplog.records) == 1
+
+
+def test_unknown_tts_format_stops_startup():
+    env = {**os.environ, "TTS_FORMAT": "ogg"}
+    result = subprocess.run([sys.executable, "-c", "import audio_service"], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode != 0
+    assert "TTS_FORMAT" in result.stderr
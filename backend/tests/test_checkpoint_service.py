@@ -0,0 +1,66 @@
+import os
+import time
+import asyncio
+
+import pytest
+
+import checkpoint_service
+from schemas import StoryDraft
+
+
+@pytest.fixture
+def checkpoint_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(checkpoint_service, "CHECKPOINT_DIR", str(tmp_path))
+    return tmp_path
+
+
+def make_draft() -> StoryDraft:
+    return StoryDraft(
+        title="t", summary="s", style_guide="sg", character_bible="cb", anchor_prompt="anc",
+        scenes=[{"scene_no": 1, "text": "하나", "image_prompt": "p"}],
+    )
+
+
+def test_checkpoint_resumes_and_moves_to_story_record(checkpoint_dir):
+    async def scenario():
+        checkpoint = checkpoint_service.load("order-key")
+        await checkpoint.set_draft(make_draft())
+        await checkpoint.set_scene(1, image_url="https://cdn/1.png")
+
+        resumed = checkpoint_service.load("order-key")
+        assert resumed.draft.title == "t"
+        assert resumed.completed_media() == {(1, "image"): "https://cdn/1.png"}
+
+        await checkpoint_service.finish(resumed, "story-1")
+        assert sorted(os.listdir(checkpoint_dir)) == ["story-story-1.json"]
+        assert checkpoint_service.load_story("story-1").scene(1)["image_url"] == "https://cdn/1.png"
+
+    asyncio.run(scenario())
+
+
+def test_disabled_checkpoints_write_nothing(monkeypatch, tmp_path):
+    monkeypatch.setattr(checkpoint_service, "CHECKPOINT_DIR", "")
+    monkeypatch.chdir(tmp_path)
+
+    async def scenario():
+        checkpoint = checkpoint_service.load("order-key")
+        await checkpoint.set_draft(make_draft())
+        await checkpoint_service.finish(checkpoint, "story-1")
+
+    asyncio.run(scenario())
+    assert os.listdir(tmp_path) == []
+    assert checkpoint_service.load_story("story-1") is None
+
+
+def test_prune_stale_uses_separate_ttls(monkeypatch, checkpoint_dir):
+    monkeypatch.setattr(checkpoint_service, "CHECKPOINT_TTL_SECONDS", 60)
+    monkeypatch.setattr(checkpoint_service, "CHECKPOINT_STORY_TTL_SECONDS", 3600)
+    two_hours_ago = time.time() - 7200
+    ten_minutes_ago = time.time() - 600
+    for name, mtime in (("order.json", ten_minutes_ago), ("story-old.json", two_hours_ago), ("story-new.json", ten_minutes_ago)):
+        path = checkpoint_dir / name
+        path.write_text("{}")
+        os.utime(path, (mtime, mtime))
+
+    checkpoint_service.prune_stale()
+    assert os.listdir(checkpoint_dir) == ["story-new.json"]
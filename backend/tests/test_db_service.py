@@ -0,0 +1,163 @@
+import json
+import base64
+import asyncio
+from collections import OrderedDict
+
+import httpx
+import pytest
+
+import db_service
+from db_service import ByteLRUCache, TTLCache, _decode_cursor, _encode_cursor
+
+STORY_ID = "4f1c2b9e-8a57-4d4e-9a3b-2f6c1d0e7a55"
+
+
+def encode(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+def test_cursor_round_trip():
+    row = {"created_at": "2026-10-16T12:34:56.123456+00:00", "id": STORY_ID}
+    assert _decode_cursor(_encode_cursor(row)) == ("2026-10-16T12:34:56.123456+00:00", STORY_ID)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    encode({"created_at": "2026-10-16"}),
+    encode(["2026-10-16T00:00:00", STORY_ID, "extra"]),
+    encode(['2026-10-16T00:00:00",id.gt."0', STORY_ID]),  # 필터 문자열을 끊고 조건을 끼워 넣으려는 값
+    encode(["2026-10-16T00:00:00", 'x",id.gt."0']),
+    encode([1234, STORY_ID]),
+    encode(["2026-10-16T00:00:00", 1234]),
+])
+def test_bad_cursor_is_rejected_before_querying(cursor):
+    with pytest.raises(ValueError):
+        _decode_cursor(cursor)
+
+
+def test_curriculum_cache_expires_and_drops_least_recently_used(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(db_service.time, "time", lambda: now[0])
+    cache = TTLCache(ttl=60, max_entries=2)
+    cache.set("MATH-1", "a")
+    cache.set("MATH-2", "b")
+    assert cache.get("MATH-1") == "a"  # MATH-2가 가장 오래 안 쓴 항목이 됨
+    cache.set("MATH-3", "c")
+    assert cache.get("MATH-2") is None
+    now[0] += 61
+    assert cache.get("MATH-1") is None
+
+
+def test_story_cache_expires_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(db_service.time, "time", lambda: now[0])
+    cache = ByteLRUCache(max_bytes=100, ttl=30)
+    cache.set("story", "old", 10)
+    now[0] += 29
+    assert cache.get("story") == "old"
+    now[0] += 2
+    assert cache.get("story") is None
+    assert cache.size == 0
+
+
+def test_story_cache_evicts_by_total_bytes():
+    cache = ByteLRUCache(max_bytes=100)
+    cache.set("a", "A", 40)
+    cache.set("b", "B", 40)
+    assert cache.get("a") == "A"  # b가 가장 오래 안 쓴 항목이 됨
+    cache.set("c", "C", 40)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c"), cache.size) == ("A", "C", 80)
+    cache.set("huge", "H", 101)  # 한도보다 큰 항목은 보관하지 않음
+    assert cache.get("huge") is None and cache.size == 80
+
+
+def test_failed_scene_update_drops_the_cached_story(monkeypatch):
+    story = {"id": STORY_ID, "title": "t", "scenes": []}
+    db_service._cache_story(story)
+
+    class FailingTable:
+        def update(self, *args):
+            raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(db_service.supabase, "table", lambda name: FailingTable())
+    with pytest.raises(RuntimeError):
+        db_service.update_story_scenes(STORY_ID, [{"scene_no": 1}])
+    assert db_service.get_cached_story(STORY_ID) is None
+
+
+class FakeHttpClient:
+    def __init__(self):
+        self.posts = []
+
+    async def post(self, url, content=None, headers=None):
+        self.posts.append(url)
+        return httpx.Response(200, request=httpx.Request("POST", url))
+
+
+@pytest.fixture
+def asset_index(monkeypatch, tmp_path):
+    client = FakeHttpClient()
+    monkeypatch.setattr(db_service, "get_http_client", lambda: client)
+    monkeypatch.setattr(db_service, "_asset_index", OrderedDict())
+    monkeypatch.setattr(db_service, "ASSET_INDEX_PATH", str(tmp_path / "assets.jsonl"))
+    return client
+
+
+def test_named_assets_are_uploaded_once(asset_index):
+    async def scenario():
+        first = await db_service.upload_to_supabase_async(b"voice", ".mp3", "audio/mpeg", "tts/abc.mp3")
+        second = await db_service.upload_to_supabase_async(b"voice", ".mp3", "audio/mpeg", "tts/abc.mp3")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == second and first.endswith("tts/abc.mp3")
+    assert len(asset_index.posts) == 1
+    with open(db_service.ASSET_INDEX_PATH, encoding="utf-8") as f:
+        assert [json.loads(line)["name"] for line in f] == ["tts/abc.mp3"]
+
+
+def test_content_hashed_images_are_not_indexed(asset_index):
+    asyncio.run(db_service.upload_to_supabase_async(b"png", ".png", "image/png"))
+    assert db_service._asset_index == {}
+
+
+def test_asset_index_keeps_only_recent_entries(monkeypatch, asset_index):
+    monkeypatch.setattr(db_service, "ASSET_INDEX_MAX_ENTRIES", 2)
+    for name in ("a", "b"):
+        db_service._remember_asset(name, f"https://cdn/{name}")
+    assert db_service._known_asset("a")  # a를 최근에 쓴 것으로
+    db_service._remember_asset("c", "https://cdn/c")
+    assert list(db_service._asset_index) == ["a", "c"]
+
+
+def test_loading_a_large_index_file_compacts_it(monkeypatch, asset_index):
+    monkeypatch.setattr(db_service, "ASSET_INDEX_MAX_ENTRIES", 2)
+    with open(db_service.ASSET_INDEX_PATH, "w", encoding="utf-8") as f:
+        for name in ("a", "b", "c"):
+            f.write(json.dumps({"name": name, "url": f"https://cdn/{name}"}) + "\n")
+        f.write('{"name": "d", "ur')  # 쓰다 만 줄
+
+    db_service._load_asset_index()
+    assert list(db_service._asset_index) == ["b", "c"]
+    with open(db_service.ASSET_INDEX_PATH, encoding="utf-8") as f:
+        assert [json.loads(line)["name"] for line in f] == ["b", "c"]
+
+
+def test_upload_retries_without_holding_an_upload_slot(monkeypatch, asset_index):
+    statuses = [503, 200]
+    slots_during_backoff = []
+
+    async def post(url, content=None, headers=None):
+        asset_index.posts.append(url)
+        return httpx.Response(statuses.pop(0), request=httpx.Request("POST", url))
+
+    async def sleep(delay):
+        slots_during_backoff.append(db_service._upload_semaphore._value)
+
+    monkeypatch.setattr(asset_index, "post", post)
+    monkeypatch.setattr(db_service.asyncio, "sleep", sleep)
+    url = asyncio.run(db_service.upload_to_supabase_async(b"png", ".png", "image/png"))
+    assert url.endswith(".png")
+    assert len(asset_index.posts) == 2
+    assert slots_during_backoff == [db_service.UPLOAD_CONCURRENCY]
@@ -0,0 +1,122 @@
+import json
+import asyncio
+
+import pytest
+
+import draft_templates
+from draft_templates import _personalize, _to_template, age_band, romanizations
+from schemas import StoryDraft
+
+
+@pytest.mark.parametrize("text, template", [
+    ("민준이는 웃었어요.", "{{name이}}는 웃었어요."),
+    ("민준아!", "{{name|아/야}}!"),
+    ("민준과 친구", "{{name|과/와}} 친구"),
+    ("민준으로 가자", "{{name|으로/로}} 가자"),
+    ("민준을 봐", "{{name|을/를}} 봐"),
+    ("민준이 뛰었다", "{{name|이/가}} 뛰었다"),
+    ("민준은", "{{name|은/는}}"),
+    ("민준, 안녕", "{{name}}, 안녕"),
+    ("하민준", "하민준"),  # 다른 낱말 속 이름은 그대로
+])
+def test_consonant_name_to_template(text, template):
+    assert _to_template(text, "민준") == template
+
+
+@pytest.mark.parametrize("text, template", [
+    ("지아는 지아가 지아야", "{{name|은/는}} {{name|이/가}} {{name|아/야}}"),
+    ("지아를 지아와 지아로 지아랑", "{{name|을/를}} {{name|과/와}} {{name|으로/로}} {{name|이랑/랑}}"),
+])
+def test_vowel_name_to_template(text, template):
+    assert _to_template(text, "지아") == template
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("민준", "민준이는 민준아 민준과 민준으로 민준을 민준이 민준이랑"),
+    ("지아", "지아는 지아야 지아와 지아로 지아를 지아가 지아랑"),
+    ("하늘", "하늘이는 하늘아 하늘과 하늘로 하늘을 하늘이 하늘이랑"),  # ㄹ 받침 뒤에는 '로'
+    ("Sam", "Sam는 Sam야 Sam와 Sam로 Sam를 Sam가 Sam랑"),  # 한글이 아니면 받침 없는 쪽
+])
+def test_personalize_picks_particles_by_final_consonant(name, expected):
+    template = _to_template("민준이는 민준아 민준과 민준으로 민준을 민준이 민준이랑", "민준")
+    assert _personalize(template, name) == expected
+
+
+def test_round_trip_keeps_original_text():
+    text = "민준이는 숲에서 민준의 친구를 만났어요. 민준아, 같이 가자!"
+    assert _personalize(_to_template(text, "민준"), "민준") == text
+
+
+def test_romanizations_cover_common_spellings():
+    assert {"minjun", "minjoon"} <= romanizations("민준")
+    assert {"seoyeon", "suyeon"} <= romanizations("서연")
+    assert "haneul" in romanizations("하늘")
+    assert romanizations("Sam") == {"sam"}
+
+
+def test_age_band():
+    assert [age_band(age) for age in (3, 4, 5, 6, 7, 8, 9)] == ["0-4", "0-4", "5-6", "5-6", "7-8", "7-8", "9+"]
+
+
+def make_draft(character_bible: str = "A small child with messy brown hair and a green hoodie",
+               text: str = "민준이는 웃었어요.") -> StoryDraft:
+    return StoryDraft(
+        title="민준의 모험",
+        summary="민준이 숲에서 덧셈을 배워요.",
+        style_guide="Watercolor, soft pastel colors",
+        character_bible=character_bible,
+        anchor_prompt="Full body character sheet of the child",
+        scenes=[{"scene_no": 1, "text": text, "image_prompt": "The child walks in a forest"}],
+    )
+
+
+@pytest.fixture
+def template_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(draft_templates, "DRAFT_TEMPLATE_CACHE_ENABLED", True)
+    monkeypatch.setattr(draft_templates, "DRAFT_TEMPLATE_PATH", str(tmp_path / "draft_templates.jsonl"))
+    monkeypatch.setattr(draft_templates, "DRAFT_TEMPLATE_VARIANTS", 1)
+    monkeypatch.setattr(draft_templates, "_templates", {})
+    return draft_templates._templates
+
+
+def save(draft: StoryDraft, name: str = "민준"):
+    asyncio.run(draft_templates.save_draft("key", draft, name))
+
+
+def test_saved_template_is_personalized_for_another_child(template_cache):
+    save(make_draft())
+    reused = draft_templates.find_draft("key", "지아")
+    assert reused.title == "지아의 모험"
+    assert reused.summary == "지아가 숲에서 덧셈을 배워요."
+    assert reused.scenes[0].text == "지아는 웃었어요."
+    assert reused.character_bible == "A small child with messy brown hair and a green hoodie"
+    assert "민준" not in reused.model_dump_json()
+
+
+def test_saved_template_is_written_to_the_template_file(template_cache):
+    save(make_draft())
+    with open(draft_templates.DRAFT_TEMPLATE_PATH, encoding="utf-8") as f:
+        entry = json.loads(f.readline())
+    assert entry["key"] == "key"
+    assert entry["draft"]["scenes"][0]["text"] == "{{name이}}는 웃었어요."
+
+
+def test_romanized_name_in_english_fields_is_not_cached(template_cache):
+    save(make_draft(character_bible="Min-jun, a small child with brown hair"))
+    assert template_cache == {}
+    assert draft_templates.find_draft("key", "지아") is None
+
+
+@pytest.mark.parametrize("character_bible", [
+    "A little boy with messy brown hair",
+    "The child wears her favorite yellow raincoat",
+])
+def test_gendered_protagonist_is_not_cached(template_cache, character_bible):
+    save(make_draft(character_bible=character_bible))
+    assert template_cache == {}
+
+
+def test_name_inside_another_word_is_not_cached(template_cache):
+    save(make_draft(text="하민준 선생님이 민준이를 불렀어요."))
+    assert template_cache == {}
+
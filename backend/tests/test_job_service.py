@@ -0,0 +1,38 @@
+import asyncio
+
+import job_service
+from model_scheduler import BATCH, INTERACTIVE, current_priority
+from schemas import GenerateRequest
+
+
+def test_background_jobs_call_models_in_the_batch_lane(monkeypatch):
+    lanes = []
+
+    async def fake_pipeline(req, idempotency_key, progress, wait_when_busy):
+        # 파이프라인이 띄우는 하위 Task도 워커의 차선을 물려받아야 함
+        async def model_call():
+            return current_priority.get()
+        lanes.append(await asyncio.create_task(model_call()))
+        return {"story_id": "story-1"}
+
+    monkeypatch.setattr(job_service, "run_story_pipeline_once", fake_pipeline)
+    monkeypatch.setattr(job_service, "JOB_WORKERS", 1)
+    monkeypatch.setattr(job_service, "_jobs", {})
+    monkeypatch.setattr(job_service, "_jobs_by_fingerprint", {})
+    monkeypatch.setattr(job_service, "_workers", [])
+    monkeypatch.setattr(job_service, "_queue", None)
+
+    async def scenario():
+        job_service.start_workers()
+        try:
+            req = GenerateRequest(child_name="민준", age=6, personality="활발함", emotion="슬픔", stage_code="MATH-1")
+            job = job_service.submit_job(req)
+            await job_service._queue.join()
+        finally:
+            await job_service.stop_workers()
+        assert job.status == "succeeded"
+        # 워커가 차선을 바꿔도 요청을 받은 쪽(대화형)의 값은 그대로
+        assert current_priority.get() == INTERACTIVE
+
+    asyncio.run(scenario())
+    assert lanes == [BATCH]
@@ -0,0 +1,42 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import db_service
+import main
+
+
+@pytest.fixture
+def client():
+    # lifespan(교재 캐시 준비, 워커)은 띄우지 않고 라우트만 호출
+    return TestClient(main.app)
+
+
+def test_bad_story_list_cursor_is_a_400(client):
+    response = client.get("/users/user-1/stories", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_curriculums_answer_304_when_the_etag_matches(client, monkeypatch):
+    curriculums = [{"stage_code": "MATH-1", "title": "덧셈"}]
+    monkeypatch.setattr(db_service, "get_cached_curriculums", lambda: (curriculums, '"v1"'))
+
+    first = client.get("/curriculums")
+    assert first.status_code == 200
+    assert first.json() == curriculums
+    assert first.headers["etag"] == '"v1"'
+
+    again = client.get("/curriculums", headers={"If-None-Match": '"old", "v1"'})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert client.get("/curriculums", headers={"If-None-Match": '"old"'}).status_code == 200
+
+
+def test_story_answers_304_when_the_etag_matches(client, monkeypatch):
+    story = {"id": "story-1", "title": "t", "scenes": []}
+    monkeypatch.setattr(db_service, "get_cached_story", lambda story_id: (story, '"s1"'))
+
+    first = client.get("/stories/story-1")
+    assert first.status_code == 200
+    assert first.headers["etag"] == '"s1"'
+    assert first.headers["cache-control"] == main.STORY_CACHE_CONTROL
+    assert client.get("/stories/story-1", headers={"If-None-Match": '"s1"'}).status_code == 304
@@ -0,0 +1,82 @@
+import time
+import asyncio
+from email.utils import formatdate
+from types import SimpleNamespace
+
+import pytest
+
+from model_scheduler import BATCH, INTERACTIVE, ModelScheduler, TokenBucket, current_priority
+
+
+def error_with_headers(headers: dict) -> Exception:
+    error = Exception("rate limited")
+    error.response = SimpleNamespace(headers=headers)
+    return error
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.wait_time(60) == 0.0
+    bucket.take(60)
+    assert bucket.wait_time(30) == pytest.approx(30, abs=0.5)
+
+
+def test_token_bucket_caps_requests_larger_than_capacity():
+    bucket = TokenBucket(per_minute=10)
+    bucket.take(10)
+    # 양동이보다 큰 요청도 가득 찰 때까지만 기다리면 됨 (영원히 막히지 않음)
+    assert bucket.wait_time(1000) == pytest.approx(60, abs=0.5)
+
+
+def test_token_bucket_without_limit_never_waits():
+    bucket = TokenBucket(per_minute=0)
+    bucket.take(10 ** 6)
+    assert bucket.wait_time(10 ** 6) == 0.0
+
+
+@pytest.fixture
+def scheduler() -> ModelScheduler:
+    return ModelScheduler(default_concurrency=1, base_delay=1.0, max_delay=8.0)
+
+
+def test_retry_delay_prefers_retry_after_ms(scheduler):
+    assert scheduler._retry_delay(error_with_headers({"retry-after-ms": "1500", "retry-after": "9"}), 1) == 1.5
+
+
+def test_retry_delay_reads_retry_after_seconds_and_http_date(scheduler):
+    assert scheduler._retry_delay(error_with_headers({"retry-after": "3"}), 1) == 3.0
+    http_date = formatdate(time.time() + 20, usegmt=True)
+    assert scheduler._retry_delay(error_with_headers({"retry-after": http_date}), 1) == pytest.approx(20, abs=1.5)
+
+
+def test_retry_delay_uses_capped_full_jitter_without_headers(scheduler):
+    for attempt, cap in ((1, 1.0), (3, 4.0), (10, 8.0)):
+        delays = [scheduler._retry_delay(Exception("boom"), attempt) for _ in range(50)]
+        assert all(0 <= delay <= cap for delay in delays)
+
+
+def test_interactive_calls_get_slots_before_batch_calls():
+    async def scenario():
+        scheduler = ModelScheduler(default_concurrency=1)
+        release = asyncio.Event()
+        order = []
+
+        async def call(tag: str, priority: int):
+            current_priority.set(priority)
+            async def make_call():
+                order.append(tag)
+                if tag == "running":
+                    await release.wait()
+            await scheduler.call("gpt", make_call)
+
+        running = asyncio.create_task(call("running", INTERACTIVE))
+        await asyncio.sleep(0)
+        queued = [asyncio.create_task(call("batch", BATCH)), asyncio.create_task(call("interactive", INTERACTIVE))]
+        await asyncio.sleep(0)
+        assert scheduler.stats()["gpt"]["queued"] == {"interactive": 1, "batch": 1}
+
+        release.set()
+        await asyncio.gather(running, *queued)
+        assert order == ["running", "interactive", "batch"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,84 @@
+import re
+
+import pytest
+from PIL import ImageFont
+
+import pdf_service
+from pdf_service import PdfWriter, build_page_specs
+
+
+def write_pdf(pages: list) -> bytes:
+    writer = PdfWriter(len(pages))
+    return writer.header() + b"".join(writer.page(jpeg) for jpeg in pages) + writer.trailer()
+
+
+def test_xref_offsets_point_at_each_object():
+    pdf = write_pdf([b"\xff\xd8fake-jpeg-1\xff\xd9", b"\xff\xd8" + b"x" * 5000 + b"\xff\xd9"])
+    xref_at = int(re.search(rb"startxref\n(\d+)\n", pdf).group(1))
+    assert pdf[xref_at:].startswith(b"xref\n")
+
+    size = int(re.search(rb"/Size (\d+)", pdf).group(1))
+    assert size == 3 + 3 * 2
+    entries = re.findall(rb"(\d{10}) 00000 n \n", pdf[xref_at:])
+    assert len(entries) == size - 1
+    for number, offset in enumerate(entries, start=1):
+        assert pdf[int(offset):].startswith(f"{number} 0 obj\n".encode())
+
+
+def test_page_tree_lists_every_page():
+    pdf = write_pdf([b"a", b"b", b"c"])
+    assert b"/Kids [3 0 R 6 0 R 9 0 R] /Count 3" in pdf
+    assert pdf.endswith(b"%%EOF\n")
+
+
+def test_page_specs_put_answers_on_a_final_page():
+    story = {
+        "title": "제목",
+        "scenes": [
+            {"scene_no": 3, "text": "셋", "image_url": "c.png", "quiz": {"question": "2+2?", "answer": "4"}},
+            {"scene_no": 2, "text": "둘", "image_url": "b.png", "quiz": {"question": "1+1?", "answer": "2"}},
+            {"scene_no": 1, "text": "하나", "image_url": "a.png", "quiz": None},
+        ],
+    }
+    specs = build_page_specs(story)
+    assert [spec["kind"] for spec, _ in specs] == ["title", "scene", "scene", "quiz", "scene", "quiz", "answers"]
+    assert specs[0] == ({"kind": "title", "title": "제목"}, "a.png")
+    assert specs[3][0] == {"kind": "quiz", "number": 1, "question": "1+1?"}
+    assert specs[-1] == ({"kind": "answers", "answers": [(1, "2"), (2, "4")]}, "")
+
+
+def test_page_specs_without_quizzes_have_no_answer_page():
+    specs = build_page_specs({"title": "제목", "scenes": [{"scene_no": 1, "text": "하나", "image_url": "a.png"}]})
+    assert [spec["kind"] for spec, _ in specs] == ["title", "scene"]
+
+
+@pytest.fixture
+def fresh_font_path():
+    pdf_service.font_path.cache_clear()
+    yield
+    pdf_service.font_path.cache_clear()
+
+
+def test_font_without_hangul_glyphs_is_rejected(monkeypatch, fresh_font_path, tmp_path):
+    # Pillow 기본 글꼴은 한글을 모두 같은 빈 네모로 찍음
+    latin_font = tmp_path / "latin.ttf"
+    latin_font.write_bytes(b"")
+    default_font = ImageFont.load_default(24)
+    monkeypatch.setattr(pdf_service.ImageFont, "truetype", lambda path, size: default_font)
+    monkeypatch.setattr(pdf_service, "PDF_FONT_PATH", str(latin_font))
+    assert pdf_service.font_path() == ""
+    assert not pdf_service.available()
+
+
+def test_missing_font_disables_pdf(monkeypatch, fresh_font_path):
+    monkeypatch.setattr(pdf_service, "PDF_FONT_PATH", "/nonexistent/font.ttf")
+    assert not pdf_service.available()
+    assert pdf_service.schedule_render("story-id") is None
+
+
+def test_hangul_font_renders_pages(fresh_font_path):
+    path = pdf_service.font_path()
+    if not path:
+        pytest.skip("이 환경에는 한글 글꼴이 없음")
+    page = pdf_service._render_page({"kind": "answers", "answers": [(1, "사과 두 개")]}, b"", path)
+    assert page.startswith(b"\xff\xd8")
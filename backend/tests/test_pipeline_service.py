@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import admission_service
+import checkpoint_service
+import pipeline_service
+from schemas import GenerateRequest
+
+
+def test_regenerate_without_checkpoints_is_not_implemented(monkeypatch):
+    monkeypatch.setattr(checkpoint_service, "CHECKPOINT_DIR", "")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(pipeline_service.regenerate_scene("story-1", 1))
+    assert error.value.status_code == 501
+
+
+def test_regenerate_is_rejected_when_admission_is_full(monkeypatch, tmp_path):
+    monkeypatch.setattr(checkpoint_service, "CHECKPOINT_DIR", str(tmp_path))
+    (tmp_path / "story-story-1.json").write_text(
+        '{"draft": {"title": "t", "summary": "s", "style_guide": "sg", "character_bible": "cb",'
+        ' "anchor_prompt": "anc", "scenes": [{"scene_no": 1, "text": "하나", "image_prompt": "p"}]},'
+        ' "anchor_url": "", "scenes": {}}'
+    )
+
+    async def scenario():
+        controller = admission_service.AdmissionController(
+            max_pipelines=1, max_queue=0, media_budget_bytes=100, media_estimate_bytes=10
+        )
+        monkeypatch.setattr(admission_service, "controller", controller)
+        controller.admit()  # 자리 하나를 다른 파이프라인이 차지
+        with pytest.raises(HTTPException) as error:
+            await pipeline_service.regenerate_scene("story-1", 1)
+        assert error.value.status_code == 429
+        assert pipeline_service._regenerate_locks == {}
+
+    asyncio.run(scenario())
+
+
+def test_story_lock_is_dropped_after_the_last_holder():
+    async def scenario():
+        order = []
+
+        async def hold(tag: str):
+            async with pipeline_service._story_lock("story-1"):
+                order.append(tag)
+                await asyncio.sleep(0)
+
+        await asyncio.gather(hold("a"), hold("b"))
+        assert order == ["a", "b"]
+        assert pipeline_service._regenerate_locks == {}
+
+    asyncio.run(scenario())
+
+
+def make_request(**overrides) -> GenerateRequest:
+    fields = dict(child_name="민준", age=6, personality="활발함", emotion="슬픔", stage_code="MATH-1")
+    fields.update(overrides)
+    return GenerateRequest(**fields)
+
+
+def test_same_order_has_same_fingerprint_regardless_of_field_order():
+    shuffled = GenerateRequest(**dict(reversed(list(make_request().model_dump().items()))))
+    assert pipeline_service.request_fingerprint(make_request()) == pipeline_service.request_fingerprint(shuffled)
+
+
+def test_fingerprint_changes_with_body_and_idempotency_key():
+    fingerprint = pipeline_service.request_fingerprint
+    base = fingerprint(make_request())
+    assert fingerprint(make_request(emotion="기쁨")) != base
+    assert fingerprint(make_request(), idempotency_key="abc") != base
+    assert fingerprint(make_request(), idempotency_key="abc") == fingerprint(make_request(), "abc")